@@ -5,215 +5,1780 @@ from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
     BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
     pipeline
 )
 from accelerate import Accelerator
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import AuthenticationError, Client
+from threading import Event, Lock, Semaphore, Thread
+import asyncio
+import copy
+import functools
+import hashlib
+import http.client
 import json
+import queue
 import re
+import secrets
+import tempfile
+import time
+from urllib.parse import urlsplit
 
-class IAEngine:
-    def __init__(self, model_name=None):
-        # Configuración de modelos disponibles - Solo QWEN2.5-3B por ahora
-        self.available_models = {
-            "llama3.2": {
-                "name": "Qwen/Qwen2.5-3B-Instruct",
-                "engine": "transformers",
-                "description": "Qwen2.5-3B - Rápido y eficiente",
-                "quantization": "4bit"  # 4-bit quantization para GTX 1050 Ti
-            }
-            # Espacio reservado para modelo grande en el futuro
-        }
-        
-        # Modelo por defecto - Llama 3.2 (principal)
-        self.current_model_key = "llama3.2"
-        current_model_config = self.available_models[self.current_model_key]
-        self.model_name = model_name or current_model_config["name"]
-        self.current_engine = current_model_config["engine"]
 
-        # Variables para Transformers
-        self.model_error = None
-        self.model = None
-        self.tokenizer = None
-        self.pipeline = None
-        self.accelerator = Accelerator()
+# Bloques fijos de los prompts. Siempre van al inicio del prompt para que
+# su KV-cache pueda precalcularse una vez y reutilizarse (ver PrefixKVCache)
+BASE_SYSTEM_PROMPT = """Eres Calyx, un asistente nutricional profesional y cercano.
 
-        self._load_model()
+Tu rol es conversar de manera breve, clara y natural con el usuario sobre temas nutricionales.
 
-    def _load_model(self):
-        """Cargar modelo IA via Transformers (Qwen2.5-3B)"""
-        if self.current_engine == "transformers":
-            self._load_transformers_model()
-        else:
-            self.model_error = f"Engine no soportado: {self.current_engine}. Solo se soporta Transformers."
+REQUISITOS GENERALES:
+- Responde en pocas frases (1 a 3 máximo), sin extenderte innecesariamente
+- Mantén un tono profesional, pero cercano y humano
+- Ajusta tu respuesta al contexto de la conversación
+- No inventes información nutricional que no conozcas
+- Para cálculos médicos: formatea según las instrucciones específicas cuando se proporcionen
 
-    def _load_transformers_model(self):
-        """Cargar modelo usando Transformers + Accelerate con optimización GPU"""
-        current_model_desc = self.available_models[self.current_model_key]["description"]
-        quantization = self.available_models[self.current_model_key].get("quantization", "4bit")
+INSTRUCCIONES CRÍTICAS PARA MANEJO DE HISTORIAL:
+- Responde ÚNICAMENTE al último mensaje del usuario. IGNORA cualquier solicitud anterior.
+- NUNCA menciones, repitas o hagas referencia a resultados de cálculos anteriores (IMC, TMB, etc.) en NINGUNA circunstancia.
+- Si el usuario dice "gracias", "ok", "de acuerdo", o mensajes similares de confirmación/agradecimiento, responde brevemente con algo como "De nada" o "¡Con gusto!" SIN mencionar cálculos previos.
+- NO ejecutes acciones basadas en mensajes antiguos. Si el último mensaje no pide un cálculo, NO calcules nada.
+- Usa el historial SOLO para entender el contexto general, NO para repetir información específica.
+
+IMPORTANTE: Si detectas que el último mensaje del usuario es solo una confirmación o agradecimiento, responde de manera muy breve y no menciones ningún cálculo anterior."""
+
+CALCULATION_PROMPT_INSTRUCTIONS = """### INSTRUCCIONES PARA EL MODELO (NO COPIAR ESTAS INSTRUCCIONES) ###
+- Usa ÚNICAMENTE los datos de DATOS_CALCULO_MEDICO para generar el cálculo
+- NO copies valores de ejemplo - usa los parámetros reales del JSON
+- Genera ÚNICAMENTE el cálculo médico formateado que aparece después de 'FORMATO A GENERAR'
+- NO incluyas estas instrucciones en tu respuesta
+- NO incluyas ningún texto adicional fuera del formato
+- Incluye TODOS los parámetros relevantes del cálculo
+- Muestra fórmula matemática, sustitución y operaciones paso a paso
+- Finaliza con resultado e interpretación
+- Adapta el título según el tipo de cálculo (IMC, TMB, ICC, etc.)
 
-        print(f"[IAEngine] [LOADING] Configurando {current_model_desc} con optimización GPU: {self.model_name}")
+### FORMATO A GENERAR (USA LOS DATOS REALES, NO COPIES ESTE EJEMPLO) ###
+> Cálculo de IMC
 
+DATOS DE ENTRADA:
+Peso: [peso] kg
+Altura: [altura] m
+
+FÓRMULA:
+IMC = peso / altura²
+
+SUSTITUCIÓN:
+IMC = [peso] / ([altura] × [altura])
+
+OPERACIÓN:
+IMC = [peso] / [altura_cuadrado]
+IMC = [resultado]
+
+RESULTADO:
+IMC = [resultado] ([interpretacion])"""
+
+NUTRITION_PROMPT_INSTRUCTIONS = """### INSTRUCCIONES PARA RESPUESTAS NUTRICIONALES PROFESIONALES ###
+
+Para consultas sobre alimentos, SIEMPRE debes usar las herramientas disponibles para obtener datos reales de la base de datos SMAE. NO inventes información nutricional.
+
+HERRAMIENTAS DISPONIBLES (usa TOOL_CALL para acceder a datos reales):
+- consultar_alimento: Para información nutricional específica de un alimento (ej: "manzana", "arroz integral")
+- buscar_alimentos_filtrados: Para búsquedas avanzadas (ej: alimentos bajos en sodio, ricos en fibra)
+- calcular_composicion_total: Para composición nutricional de múltiples alimentos
+- sustituir_alimento: Para sustitutos de un alimento (ej: parecido a "jamón" pero con menos sodio)
+- generar_recomendaciones_dieta: Para recomendaciones dietéticas personalizadas
+
+FORMATO PARA LLAMAR HERRAMIENTAS:
+TOOL_CALL: {"tool": "consultar_alimento", "parameters": {"nombre": "manzana"}}
+
+### INSTRUCCIONES DE FORMATO (NO COPIAR EN RESPUESTA) ###
+
+Cuando proporciones información nutricional:
+- Comienza con una breve introducción sobre el alimento
+- Incluye una tabla nutricional usando sintaxis Markdown pura
+- Agrega una conclusión breve si es relevante
+- Termina mencionando la fuente SMAE
+
+Ejemplo de tabla Markdown:
+| Componente | Valor por 100g |
+|------------|----------------|
+| Energía (kcal) | 342 |
+| Proteínas (g) | 2.7 |
+| Grasas Total (g) | 0.4 |
+
+IMPORTANTE:
+- Usa TABLAS MARKDOWN con | para separar columnas
+- NO uses **asteriscos** para negritas dentro de las tablas
+- Mantén las unidades en la columna de valores
+- Si hay subcategorías, usa filas separadas
+- La respuesta debe ser conversacional y natural"""
+
+STATIC_PROMPT_PREFIXES = (BASE_SYSTEM_PROMPT, CALCULATION_PROMPT_INSTRUCTIONS, NUTRITION_PROMPT_INSTRUCTIONS)
+
+
+def _common_prefix_length(ids_a, ids_b):
+    """Número de tokens iniciales idénticos entre dos secuencias 1-D de input_ids"""
+    length = min(ids_a.shape[-1], ids_b.shape[-1])
+    if length == 0:
+        return 0
+    mismatches = (ids_a[:length] != ids_b[:length]).nonzero()
+    return int(mismatches[0][0]) if len(mismatches) else length
+
+
+def _cache_length(past_key_values):
+    """Número de tokens almacenados en un cache de KV (DynamicCache o formato legacy de tuplas)"""
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length()
+    return past_key_values[0][0].shape[-2]
+
+
+def _crop_cache(past_key_values, length):
+    """
+    Recortar un cache de KV a sus primeros `length` tokens; False si no se puede (formato sin
+    crop(), cache más corto o capas que no permiten retroceder) y el llamador hace el prefill
+    completo. crop() recibe cuántos tokens quitar como entero negativo: pasarle la longitud final
+    está obsoleto y las capas de ventana deslizante o atención lineal lo rechazan.
+    """
+    if not hasattr(past_key_values, "crop"):
+        return False
+    tokens_to_remove = _cache_length(past_key_values) - length
+    if tokens_to_remove < 0:
+        return False
+    if tokens_to_remove > 0:
         try:
-            # Configuración de cuantización 4-bit para Qwen2.5-3B
-            if quantization == "4bit":
-                bnb_config = BitsAndBytesConfig(
-                    load_in_4bit=True,
-                    bnb_4bit_compute_dtype=torch.float16,
-                    bnb_4bit_use_double_quant=True,
-                    bnb_4bit_quant_type="nf4"
-                )
-                print("[IAEngine] [CONFIG] Cuantización 4-bit activada para GPU GTX 1050 Ti")
+            past_key_values.crop(-tokens_to_remove)
+        except (RuntimeError, ValueError):
+            # El cache puede quedar recortado a medias: los llamadores lo descartan
+            return False
+    return True
+
+
+# ===== INFERENCIA EN CPU (máquinas sin CUDA) =====
+# bf16: pesos a la mitad y matmul nativo en CPUs con AVX512-BF16/AMX; fp32: referencia;
+# int8: cuantización dinámica de las capas Linear (pesos int8, activaciones cuantizadas al vuelo)
+CPU_PRECISIONS = ("bf16", "fp32", "int8")
+
+
+def cpu_bf16_supported():
+    """True si oneDNN tiene bf16 nativo en este CPU (sin él, bf16 se emula y es más lento que fp32)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def cpu_thread_count():
+    """
+    Hilos de cómputo para la inferencia en CPU: CALYX_CPU_THREADS o los núcleos asignados al proceso,
+    dejando uno libre para el event loop y los endpoints de alimentos cuando hay más de 4
+    """
+    if os.environ.get("CALYX_CPU_THREADS"):
+        return max(1, int(os.environ["CALYX_CPU_THREADS"]))
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return cores - 1 if cores > 4 else cores
+
+
+def configure_cpu_threads(threads=None):
+    """Fijar los hilos intra-op de torch; inter-op en 1 porque generate no paraleliza entre operadores"""
+    threads = threads or cpu_thread_count()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo en paralelo (ej. al cambiar de modelo)
+        pass
+    return threads
+
+
+def resolve_cpu_precision(precision="auto"):
+    """
+    Precisión efectiva. 'auto' es fp32: en generate (batch 1) bf16 no resultó más rápido ni con
+    bf16 nativo, e int8 es bastante más rápido pero cambia las salidas; ambos se eligen explícitamente
+    (ver scripts/benchmark_cpu.py)
+    """
+    precision = (precision or "auto").lower()
+    if precision == "auto":
+        return "fp32"
+    if precision not in CPU_PRECISIONS:
+        raise ValueError(f"Precisión '{precision}' no soportada. Opciones: {', '.join(CPU_PRECISIONS)}")
+    if precision == "bf16" and not cpu_bf16_supported():
+        print("[IAEngine] [WARNING] El CPU no soporta bf16 nativo, se usa fp32")
+        return "fp32"
+    return precision
+
+
+def prepare_cpu_model(model, precision):
+    """Dejar un modelo ya cargado en fp32/bf16 listo para inferencia en CPU con la precisión pedida"""
+    model.eval()
+    if precision == "int8":
+        # Solo las Linear (proyecciones de atención y MLP: casi todo el cómputo); embeddings y normas quedan en fp32
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_cpu_model(model_name, precision="auto", progress_callback=None):
+    """
+    Cargar tokenizer y modelo para inferencia en CPU (sin bitsandbytes, que requiere CUDA).
+    Devuelve (tokenizer, model, precisión efectiva).
+    progress_callback (opcional) recibe "tokenizer" y "weights" al comenzar cada paso.
+    """
+    precision = resolve_cpu_precision(precision)
+    if progress_callback is not None:
+        progress_callback("tokenizer")
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    if progress_callback is not None:
+        progress_callback("weights")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        # La cuantización dinámica parte de pesos fp32
+        torch_dtype=torch.bfloat16 if precision == "bf16" else torch.float32,
+        low_cpu_mem_usage=True
+    )
+    return tokenizer, prepare_cpu_model(model, precision), precision
+
+
+def default_model_key(available_models):
+    """Modelo por defecto según el hardware: CALYX_MODEL_KEY, o el de GPU si hay CUDA y si no el de CPU"""
+    requested = os.environ.get("CALYX_MODEL_KEY")
+    if requested:
+        if requested not in available_models:
+            raise ValueError(f"CALYX_MODEL_KEY='{requested}' no disponible. Opciones: {list(available_models.keys())}")
+        return requested
+    engine = "transformers" if torch.cuda.is_available() else "transformers-cpu"
+    return next(key for key, config in available_models.items() if config["engine"] == engine)
+
+
+def default_model_server_address():
+    """Dirección IPC del servidor de modelo: named pipe en Windows, socket Unix en el resto"""
+    if os.name == "nt":
+        return r"\\.\pipe\calyx-model-server"
+    return os.path.join(tempfile.gettempdir(), "calyx-model-server.sock")
+
+
+def model_server_authkey_path():
+    """Archivo con la clave del servidor de modelo cuando no se define CALYX_MODEL_SERVER_AUTHKEY"""
+    return os.environ.get("CALYX_MODEL_SERVER_AUTHKEY_FILE") or os.path.join(os.path.expanduser("~"), ".calyx", "model-server.key")
+
+
+def model_server_authkey(create=False):
+    """
+    Clave compartida entre el servidor de modelo y los workers. multiprocessing.connection
+    deserializa con pickle cada mensaje, así que la clave nunca puede ser un valor conocido: se toma
+    de CALYX_MODEL_SERVER_AUTHKEY o, si no está definida, de un archivo 0600 que el servidor genera
+    con una clave aleatoria al arrancar (create=True) y que los workers leen.
+    """
+    authkey = os.environ.get("CALYX_MODEL_SERVER_AUTHKEY")
+    if authkey:
+        return authkey.encode("utf-8")
+
+    path = model_server_authkey_path()
+    if create:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as key_file:
+            key_file.write(secrets.token_hex(32))
+        # Si el archivo ya existía conserva sus permisos anteriores
+        os.chmod(path, 0o600)
+    try:
+        with open(path, encoding="utf-8") as key_file:
+            return key_file.read().strip().encode("utf-8")
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"Sin clave para el servidor de modelo: define CALYX_MODEL_SERVER_AUTHKEY o arranca model_server.py (genera {path})"
+        )
+
+
+class PrefixKVCache:
+    """
+    Caché de past-key-values para los bloques fijos de los prompts.
+    La entrada se identifica por (model_key, sha256 del texto del prefijo). Cada petición
+    reutiliza una copia del KV del prefijo y el modelo solo hace prefill de su sufijo variable.
+    """
+
+    def __init__(self, max_entries=8, static_prefixes=STATIC_PROMPT_PREFIXES):
+        self.max_entries = max(1, int(max_entries))
+        self.static_prefixes = static_prefixes
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "tokens_saved": 0,
+            "prefill_ms_saved": 0.0
+        }
+
+    def find_prefix(self, full_prompt):
+        """Texto del prompt hasta el final del bloque fijo conocido; None si no contiene ninguno"""
+        prefix_end = -1
+        for block in self.static_prefixes:
+            index = full_prompt.find(block)
+            if index != -1:
+                prefix_end = max(prefix_end, index + len(block))
+        return full_prompt[:prefix_end] if prefix_end > 0 else None
+
+    def prepare(self, model, tokenizer, model_key, full_prompt, prefix_text):
+        """
+        Tokenizar el prompt completo y devolver (input_ids, past_key_values).
+        past_key_values es None cuando no hay prefijo reutilizable.
+        Debe llamarse con el lock del modelo tomado: en un miss se hace el prefill del prefijo.
+        """
+        input_ids = tokenizer(full_prompt, return_tensors="pt").input_ids.to(model.device)
+        if not prefix_text:
+            return input_ids, None
+
+        key = (model_key, hashlib.sha256(prefix_text.encode("utf-8")).hexdigest())
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        hit = entry is not None
+        if not hit:
+            entry = self._build_entry(model, tokenizer, prefix_text)
+            with self.lock:
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        # El prefijo tokenizado por separado puede diferir en el último token del prompt completo:
+        # solo se reutiliza la parte común y siempre queda al menos un token por procesar
+        prefix_length = entry["input_ids"].shape[-1]
+        reuse_length = min(_common_prefix_length(entry["input_ids"][0], input_ids[0]), input_ids.shape[-1] - 1)
+        if reuse_length <= 0:
+            return input_ids, None
+
+        past_key_values = copy.deepcopy(entry["past_key_values"])
+        if reuse_length < prefix_length and not _crop_cache(past_key_values, reuse_length):
+            return input_ids, None
+
+        with self.lock:
+            if hit:
+                self.stats["hits"] += 1
+                self.stats["tokens_saved"] += reuse_length
+                self.stats["prefill_ms_saved"] += entry["prefill_ms"] * reuse_length / prefix_length
             else:
-                bnb_config = None
+                self.stats["misses"] += 1
+
+        return input_ids, past_key_values
+
+    def _build_entry(self, model, tokenizer, prefix_text):
+        """Prefill del prefijo fijo, midiendo su costo para estimar el tiempo ahorrado"""
+        prefix_ids = tokenizer(prefix_text, return_tensors="pt").input_ids.to(model.device)
+        started_at = time.perf_counter()
+        with torch.no_grad():
+            outputs = model(input_ids=prefix_ids, use_cache=True)
+        prefill_ms = (time.perf_counter() - started_at) * 1000
+        print(f"[IAEngine] [CACHE] Prefijo precalculado: {prefix_ids.shape[-1]} tokens en {prefill_ms:.1f} ms")
+        return {
+            "input_ids": prefix_ids,
+            "past_key_values": outputs.past_key_values,
+            "prefill_ms": prefill_ms
+        }
 
-            # Cargar tokenizer
-            print(f"[IAEngine] [LOADING] Cargando tokenizer: {self.model_name}")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                trust_remote_code=True
-            )
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
 
-            # Cargar modelo con configuración optimizada
-            print(f"[IAEngine] [LOADING] Cargando modelo con cuantización {quantization}")
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                quantization_config=bnb_config,
-                device_map="auto",
-                trust_remote_code=True,
-                torch_dtype=torch.float16
-            )
+    def get_stats(self):
+        """Contadores de hit/miss y prefill ahorrado"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0
+        stats["prefill_ms_saved"] = round(stats["prefill_ms_saved"], 1)
+        return stats
 
-            # Crear pipeline para inference
-            print("[IAEngine] [LOADING] Creando pipeline de inference")
-            self.pipeline = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device_map="auto",
-                torch_dtype=torch.float16
-            )
 
-            print(f"[IAEngine] [SUCCESS] {current_model_desc} cargado exitosamente con Transformers")
-            self.model_error = None
+class KVSession:
+    """
+    Estado KV de una generación de varias iteraciones (loop de tools en generate_with_tools).
+    Guarda el cache del modelo al terminar cada iteración; la siguiente iteración solo
+    procesa los tokens que no comparte con lo ya calculado (ej. el RESULTADO DE TOOL agregado).
+    """
+
+    def __init__(self):
+        self.input_ids = None
+        self.past_key_values = None
+        self.stats = {"tokens_reused": 0, "tokens_prefilled": 0}
+
+    def prepare(self, input_ids):
+        """Recortar el cache a la parte común con el nuevo prompt; None si no hay nada reutilizable"""
+        if self.past_key_values is None:
+            return None
+
+        reuse_length = min(_common_prefix_length(self.input_ids[0], input_ids[0]), input_ids.shape[-1] - 1)
+        if reuse_length <= 0 or not _crop_cache(self.past_key_values, reuse_length):
+            self.reset()
+            return None
+
+        self.stats["tokens_reused"] += reuse_length
+        self.stats["tokens_prefilled"] += input_ids.shape[-1] - reuse_length
+        return self.past_key_values
+
+    def update(self, sequences, past_key_values):
+        """Guardar el cache resultante de generate(); cubre el prompt y lo generado salvo el último token"""
+        self.past_key_values = past_key_values
+        self.input_ids = sequences[:, :_cache_length(past_key_values)]
+
+    def reset(self):
+        self.input_ids = None
+        self.past_key_values = None
+
+
+class GenerationCancelled(Exception):
+    """La petición se canceló (cancel_event activado) antes de terminar de generarse"""
+
+
+class CancelledStoppingCriteria(StoppingCriteria):
+    """
+    Detiene model.generate en el siguiente token para las filas cuyo cancel_event está activado;
+    cancel_events va alineado con las filas del batch (None = fila sin cancelación)
+    """
+
+    def __init__(self, cancel_events):
+        self.cancel_events = cancel_events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        cancelled = [event is not None and event.is_set() for event in self.cancel_events]
+        return torch.tensor(cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+def cancellation_criteria(cancel_events):
+    """StoppingCriteriaList para model.generate, o None si ninguna fila puede cancelarse"""
+    if all(event is None for event in cancel_events):
+        return None
+    return StoppingCriteriaList([CancelledStoppingCriteria(cancel_events)])
+
+
+class InferenceRequest:
+    """Petición de generación pendiente dentro del scheduler"""
+
+    def __init__(self, prompt_text, max_new_tokens, temperature, top_p, prefix_text=None, kv_session=None, cancel_event=None):
+        self.prompt_text = prompt_text
+        self.prefix_text = prefix_text
+        self.kv_session = kv_session
+        self.cancel_event = cancel_event
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Cola de inferencia con micro-batching dinámico.
+    Un hilo worker junta las peticiones que llegan dentro de una ventana de espera corta,
+    las agrupa en una sola llamada a model.generate (con padding a la izquierda)
+    y devuelve a cada llamador únicamente su salida.
+    Una petición que llega sola y tiene prefijo fijo usa el PrefixKVCache en lugar del batch,
+    y las que continúan una KVSession siempre se generan individualmente sobre su propio cache.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=4, max_wait_ms=10, model_lock=None, prefix_cache=None, model_key=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.model_key = model_key
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        # Lock compartido con otras rutas (ej. streaming) que también usan el modelo
+        self.model_lock = model_lock or Lock()
+
+        self.queue = queue.Queue()
+        self.stats = {
+            "requests_served": 0,
+            "batches_run": 0,
+            "max_batch_seen": 0,
+            "cancelled": 0,
+            "errors": 0
+        }
+        self._stopped = False
+        self._worker = Thread(target=self._worker_loop, name="calyx-inference-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt_text, max_new_tokens=120, temperature=0.3, top_p=0.8, prefix_text=None, kv_session=None, cancel_event=None):
+        """
+        Encolar un prompt ya formateado con el chat template; devuelve un Future con el texto generado.
+        Si cancel_event se activa, la petición se descarta si aún está en cola o se detiene en el
+        siguiente token, y el Future termina con GenerationCancelled.
+        """
+        if self._stopped:
+            raise RuntimeError("El scheduler de inferencia está detenido")
+        request = InferenceRequest(prompt_text, max_new_tokens, temperature, top_p, prefix_text, kv_session, cancel_event)
+        self.queue.put(request)
+        return request.future
+
+    def generate(self, prompt_text, max_new_tokens=120, temperature=0.3, top_p=0.8, prefix_text=None, kv_session=None, cancel_event=None):
+        """Versión bloqueante de submit()"""
+        return self.submit(prompt_text, max_new_tokens, temperature, top_p, prefix_text, kv_session, cancel_event).result()
+
+    def shutdown(self):
+        """Detener el worker; las peticiones ya encoladas se atienden antes de salir"""
+        if not self._stopped:
+            self._stopped = True
+            self.queue.put(None)
+            self._worker.join(timeout=5)
+
+    def get_stats(self):
+        """Estadísticas de batching para diagnóstico"""
+        stats = dict(self.stats)
+        stats.update({
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "pending": self.queue.qsize(),
+            "avg_batch_size": round(stats["requests_served"] / stats["batches_run"], 2) if stats["batches_run"] else 0
+        })
+        return stats
+
+    def _collect_batch(self, first_request):
+        """Juntar peticiones hasta llenar el batch o agotar la ventana de espera"""
+        batch = [first_request]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Señal de parada: reinsertarla para salir después de este batch
+                self.queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            first_request = self.queue.get()
+            if first_request is None:
+                break
+
+            # Las peticiones canceladas mientras esperaban en cola no llegan al modelo
+            batch = [request for request in self._collect_batch(first_request) if not self._finish_if_cancelled(request)]
+
+            # Un batch solo puede compartir parámetros de muestreo
+            groups = {}
+            for request in batch:
+                if request.kv_session is not None:
+                    self._run_cached(request)
+                    continue
+                groups.setdefault((request.temperature, request.top_p), []).append(request)
+
+            for group in groups.values():
+                if len(group) == 1 and group[0].prefix_text and self.prefix_cache is not None:
+                    self._run_cached(group[0])
+                else:
+                    self._run_batch(group)
+
+    def _finish_if_cancelled(self, request):
+        """Terminar con GenerationCancelled una petición cuyo cancel_event está activado"""
+        if request.cancel_event is None or not request.cancel_event.is_set():
+            return False
+        self.stats["cancelled"] += 1
+        if not request.future.done():
+            request.future.set_exception(GenerationCancelled())
+        return True
+
+    def _pad_token_id(self):
+        pad_token_id = self.tokenizer.pad_token_id
+        return self.tokenizer.eos_token_id if pad_token_id is None else pad_token_id
+
+    def _run_cached(self, request):
+        """
+        Generar una petición individual reutilizando KV ya calculado: el de su KVSession
+        (iteraciones previas) o, si no hay, el del prefijo fijo en el PrefixKVCache
+        """
+        try:
+            with self.model_lock:
+                input_ids, past_key_values = None, None
+                session = request.kv_session
+
+                if session is not None and session.past_key_values is not None:
+                    input_ids = self.tokenizer(request.prompt_text, return_tensors="pt").input_ids.to(self.model.device)
+                    past_key_values = session.prepare(input_ids)
+
+                if past_key_values is None:
+                    if self.prefix_cache is not None:
+                        input_ids, past_key_values = self.prefix_cache.prepare(
+                            self.model, self.tokenizer, self.model_key, request.prompt_text, request.prefix_text
+                        )
+                    elif input_ids is None:
+                        input_ids = self.tokenizer(request.prompt_text, return_tensors="pt").input_ids.to(self.model.device)
+
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        input_ids=input_ids,
+                        attention_mask=torch.ones_like(input_ids),
+                        past_key_values=past_key_values,
+                        max_new_tokens=request.max_new_tokens,
+                        temperature=request.temperature,
+                        top_p=request.top_p,
+                        do_sample=True,
+                        pad_token_id=self._pad_token_id(),
+                        stopping_criteria=cancellation_criteria([request.cancel_event]),
+                        return_dict_in_generate=True
+                    )
+
+                if session is not None:
+                    session.update(outputs.sequences, outputs.past_key_values)
+
+            if self._finish_if_cancelled(request):
+                return
+            text = self.tokenizer.decode(outputs.sequences[0, input_ids.shape[-1]:], skip_special_tokens=True)
+            request.future.set_result(text.strip())
+
+            self.stats["requests_served"] += 1
+            self.stats["batches_run"] += 1
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], 1)
 
         except Exception as e:
-            error_msg = f"Error cargando modelo {self.model_name}: {str(e)}"
-            print(f"[IAEngine] [ERROR] {error_msg}")
-            self.model_error = error_msg
-            self.model = None
-            self.tokenizer = None
-            self.pipeline = None
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en generación con prefijo cacheado: {e}")
+            if not request.future.done():
+                request.future.set_exception(e)
+
+    def _run_batch(self, requests):
+        """Ejecutar un grupo de peticiones en una sola llamada batched a model.generate"""
+        try:
+            previous_padding_side = self.tokenizer.padding_side
+            pad_token_id = self._pad_token_id()
+
+            with self.model_lock:
+                self.tokenizer.padding_side = "left"
+                try:
+                    inputs = self.tokenizer(
+                        [request.prompt_text for request in requests],
+                        return_tensors="pt",
+                        padding=True
+                    ).to(self.model.device)
+                finally:
+                    self.tokenizer.padding_side = previous_padding_side
+
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max(request.max_new_tokens for request in requests),
+                        temperature=requests[0].temperature,
+                        top_p=requests[0].top_p,
+                        do_sample=True,
+                        pad_token_id=pad_token_id,
+                        # Cada fila cancelada deja de generar sin detener al resto del batch
+                        stopping_criteria=cancellation_criteria([request.cancel_event for request in requests])
+                    )
+
+            prompt_length = inputs["input_ids"].shape[1]
+            for index, request in enumerate(requests):
+                if self._finish_if_cancelled(request):
+                    continue
+                # Cada petición recibe solo sus tokens nuevos, recortados a su propio límite
+                generated_ids = outputs[index, prompt_length:prompt_length + request.max_new_tokens]
+                text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+                request.future.set_result(text.strip())
+
+            self.stats["requests_served"] += len(requests)
+            self.stats["batches_run"] += 1
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(requests))
+            print(f"[IAEngine] [BATCH] {len(requests)} peticiones generadas en un batch")
+
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en batch de inferencia: {e}")
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+
+# ===== ENGINES DE INFERENCIA =====
+# IAEngine delega la carga y la generación en un engine elegido por available_models[...]["engine"]
+
+ENGINE_REGISTRY = {}
+
+
+def register_engine(name):
+    """Decorador: registra una clase de engine bajo el nombre usado en available_models"""
+    def decorator(engine_class):
+        engine_class.engine_name = name
+        ENGINE_REGISTRY[name] = engine_class
+        return engine_class
+    return decorator
+
+
+def create_engine(model_key, model_config, model_name=None, inference_executor=None, scheduler_config=None):
+    """Instanciar (sin cargar) el engine de un modelo de available_models"""
+    engine_class = ENGINE_REGISTRY.get(model_config["engine"])
+    if engine_class is None:
+        raise ValueError(f"Engine no soportado: {model_config['engine']}. Opciones: {', '.join(ENGINE_REGISTRY)}")
+    return engine_class(model_key, model_config, model_name or model_config["name"], inference_executor, scheduler_config or {})
+
+
+class InferenceEngine:
+    """
+    Interfaz común de los engines: load() carga el modelo (lanza excepción si falla),
+    generate() devuelve el texto completo, generate_stream() lo produce por fragmentos,
+    is_ready()/get_status() informan el estado y unload() libera el modelo.
+    Durante load() y warmup() el engine avisa cada paso que comienza (tokenizer, weights,
+    pipeline, warmup) a progress_callback, si IAEngine le asignó uno.
+    cancel_event (threading.Event, opcional) cancela la petición: generate() lanza
+    GenerationCancelled y generate_stream() deja de producir fragmentos.
+    """
+
+    engine_name = None
+    device = "cpu"
+    progress_callback = None
+
+    def __init__(self, model_key, model_config, model_name, inference_executor=None, scheduler_config=None):
+        self.model_key = model_key
+        self.model_config = model_config
+        self.model_name = model_name
+        self.description = model_config.get("description", model_name)
+        self.inference_executor = inference_executor
+        self.scheduler_config = scheduler_config or {}
+
+    def load(self):
+        raise NotImplementedError
 
     def is_ready(self):
-        """Verificar si el modelo está listo"""
-        return self.model is not None and self.tokenizer is not None and self.model_error is None
+        raise NotImplementedError
+
+    def generate(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
+        raise NotImplementedError
+
+    def generate_stream(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, cancel_event=None):
+        raise NotImplementedError
+
+    def report_progress(self, step):
+        """Avisar el paso de carga que comienza"""
+        if self.progress_callback is not None:
+            self.progress_callback(step)
+
+    def warmup(self):
+        """Generación corta tras load() para que la primera petición real no pague la inicialización"""
 
     def get_status(self):
-        """Obtener estado del modelo Transformers"""
-        status_info = {
-            "model_name": self.model_name,
-            "engine": self.current_engine,
-            "device": "cuda" if torch.cuda.is_available() else "cpu"
-        }
+        """Información adicional del engine para /health"""
+        return {}
 
-        if self.model_error:
-            status_info.update({
-                "status": "error",
-                "message": f"Modelo no disponible: {self.model_error}",
-                "ready": False
-            })
-        elif self.is_ready():
-            status_info.update({
-                "status": "ready",
-                "message": "Modelo cargado y listo para usar",
-                "ready": True
-            })
+    def unload(self):
+        pass
+
+
+@register_engine("transformers")
+class TransformersEngine(InferenceEngine):
+    """Qwen2.5-3B con Transformers + Accelerate en GPU (cuantización 4-bit con bitsandbytes)"""
+
+    @property
+    def device(self):
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = None
+        self.tokenizer = None
+        self.pipeline = None
+        self.scheduler = None
+        # Lock del modelo: lo comparten el scheduler y la generación en streaming
+        self.model_lock = Lock()
+        # KV-cache de los bloques fijos de los prompts (system prompt base, instrucciones)
+        self.prefix_cache = PrefixKVCache(max_entries=int(os.environ.get("CALYX_PREFIX_CACHE_ENTRIES", "8")))
+
+    def load(self):
+        print(f"[IAEngine] [LOADING] Configurando {self.description}: {self.model_name}")
+        try:
+            self._load_weights()
+
+            # Crear pipeline para inference
+            print("[IAEngine] [LOADING] Creando pipeline de inference")
+            self.report_progress("pipeline")
+            self._create_pipeline()
+
+            # Scheduler de micro-batching para peticiones concurrentes
+            self.scheduler = InferenceScheduler(
+                self.model,
+                self.tokenizer,
+                model_lock=self.model_lock,
+                prefix_cache=self.prefix_cache,
+                model_key=self.model_key,
+                **self.scheduler_config
+            )
+            print(f"[IAEngine] [SUCCESS] {self.description} cargado exitosamente con Transformers")
+        except Exception:
+            self.unload()
+            raise
+
+    def _load_weights(self):
+        """Cargar tokenizer y modelo con optimización GPU"""
+        quantization = self.model_config.get("quantization", "4bit")
+
+        # Configuración de cuantización 4-bit para Qwen2.5-3B
+        if quantization == "4bit":
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4"
+            )
+            print("[IAEngine] [CONFIG] Cuantización 4-bit activada para GPU GTX 1050 Ti")
         else:
-            status_info.update({
-                "status": "loading",
-                "message": "Cargando modelo...",
-                "ready": False
-            })
+            bnb_config = None
+
+        # Cargar tokenizer
+        print(f"[IAEngine] [LOADING] Cargando tokenizer: {self.model_name}")
+        self.report_progress("tokenizer")
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            self.model_name,
+            trust_remote_code=True
+        )
+
+        # Cargar modelo con configuración optimizada
+        print(f"[IAEngine] [LOADING] Cargando modelo con cuantización {quantization}")
+        self.report_progress("weights")
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            quantization_config=bnb_config,
+            device_map="auto",
+            trust_remote_code=True,
+            torch_dtype=torch.float16
+        )
+
+    def _create_pipeline(self):
+        self.pipeline = pipeline(
+            "text-generation",
+            model=self.model,
+            tokenizer=self.tokenizer,
+            device_map="auto",
+            torch_dtype=torch.float16
+        )
 
-        return status_info
+    def is_ready(self):
+        return self.pipeline is not None and self.model is not None and self.tokenizer is not None
 
-    def generate(self, prompt, system_prompt=None, max_new_tokens=120, temperature=0.3, top_p=0.8):
+    def warmup(self):
         """
-        Generación usando Transformers
+        Generar un token con el system prompt base: inicializa los kernels del modelo
+        y deja el KV de ese bloque fijo en el PrefixKVCache para la primera petición
         """
-        if not self.is_ready():
-            raise RuntimeError("Modelo no está disponible. Verifica que esté cargado correctamente.")
+        self.report_progress("warmup")
+        started_at = time.perf_counter()
+        self.generate("Hola", system_prompt=BASE_SYSTEM_PROMPT, max_new_tokens=1)
+        print(f"[IAEngine] [WARMUP] Generación de calentamiento en {time.perf_counter() - started_at:.2f} s")
+
+    def get_status(self):
+        return {
+            "batching": self.scheduler.get_stats() if self.scheduler else None,
+            "prefix_cache": self.prefix_cache.get_stats()
+        }
+
+    def unload(self):
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        self.scheduler = None
+        self.prefix_cache.clear()
+        self.model = None
+        self.tokenizer = None
+        self.pipeline = None
 
-        if self.current_engine == "transformers":
-            return self._generate_transformers(prompt, system_prompt, max_new_tokens, temperature, top_p)
+    def _build_chat_prompt(self, user_prompt, system_prompt=None):
+        """Construir el prompt completo usando el chat template del modelo"""
+        if system_prompt:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
         else:
-            raise RuntimeError(f"Engine no soportado: {self.current_engine}. Solo se soporta Transformers.")
+            messages = [{"role": "user", "content": user_prompt}]
+
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
 
-    def _generate_transformers(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8):
+    def generate(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
         """Generación usando Transformers + Accelerate con optimización GPU"""
         try:
-            current_model_desc = self.available_models[self.current_model_key]["description"]
-            print(f"[IAEngine] [GENERATE] Generando con {current_model_desc}, prompt length: {len(user_prompt)}")
+            print(f"[IAEngine] [GENERATE] Generando con {self.description}, prompt length: {len(user_prompt)}")
 
             # Construir el prompt usando el chat template del modelo
-            if system_prompt:
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            else:
-                messages = [{"role": "user", "content": user_prompt}]
-
-            # Usar el chat template del tokenizer
-            full_prompt = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
+            full_prompt = self._build_chat_prompt(user_prompt, system_prompt)
+
+            # Generar respuesta a través del scheduler (puede agruparse con otras peticiones)
+            generated_text = self.scheduler.generate(
+                full_prompt,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                prefix_text=self.prefix_cache.find_prefix(full_prompt),
+                kv_session=kv_session,
+                cancel_event=cancel_event
             )
-
-            # Generar respuesta usando el pipeline
-            with torch.no_grad():
-                outputs = self.pipeline(
-                    full_prompt,
-                    max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    return_full_text=False  # No repetir el prompt de entrada
-                )
-
-            # Extraer la respuesta generada
-            generated_text = outputs[0]['generated_text']
             print(f"[IAEngine] [SUCCESS] Respuesta generada, length: {len(generated_text)}")
 
             return generated_text.strip()
 
+        except GenerationCancelled:
+            print("[IAEngine] [CANCEL] Generación cancelada")
+            raise
         except Exception as e:
             error_msg = f"Error en generación con Transformers: {str(e)}"
             print(f"[IAEngine] [ERROR] {error_msg}")
             return "Lo siento, el modelo de IA no está disponible en este momento."
 
+    def generate_stream(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, cancel_event=None):
+        """
+        Generación en streaming con TextIteratorStreamer: model.generate corre en un hilo aparte.
+        Si el consumidor abandona el generador (o se activa cancel_event), model.generate se
+        detiene en el siguiente token en lugar de seguir ocupando el modelo.
+        """
+        print(f"[IAEngine] [STREAM] Generando en streaming con {self.description}, prompt length: {len(user_prompt)}")
+
+        full_prompt = self._build_chat_prompt(user_prompt, system_prompt)
+        prefix_text = self.prefix_cache.find_prefix(full_prompt)
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = cancel_event or Event()
+        generation_error = []
+
+        def run_generation():
+            try:
+                with self.model_lock, torch.no_grad():
+                    input_ids, past_key_values = self.prefix_cache.prepare(
+                        self.model, self.tokenizer, self.model_key, full_prompt, prefix_text
+                    )
+                    self.model.generate(
+                        input_ids=input_ids,
+                        attention_mask=torch.ones_like(input_ids),
+                        past_key_values=past_key_values,
+                        streamer=streamer,
+                        max_new_tokens=max_new_tokens,
+                        temperature=temperature,
+                        top_p=top_p,
+                        do_sample=True,
+                        pad_token_id=self.tokenizer.eos_token_id,
+                        stopping_criteria=cancellation_criteria([stop_event])
+                    )
+            except Exception as e:
+                generation_error.append(e)
+                # Liberar al consumidor del streamer aunque la generación haya fallado
+                streamer.end()
+
+        # La generación se encola en el executor de inferencia para no competir por el modelo
+        generation_future = self.inference_executor.submit(run_generation)
+
+        generated_length = 0
+        completed = False
+        try:
+            for text in streamer:
+                if text:
+                    generated_length += len(text)
+                    yield text
+            completed = True
+        finally:
+            if not completed:
+                # El consumidor dejó de leer: liberar el modelo cuanto antes
+                stop_event.set()
+                print("[IAEngine] [CANCEL] Streaming cancelado por el consumidor")
+
+        generation_future.result()
+
+        if stop_event.is_set():
+            print(f"[IAEngine] [CANCEL] Streaming cancelado, length: {generated_length}")
+        elif generation_error:
+            print(f"[IAEngine] [ERROR] Error en generación streaming con Transformers: {generation_error[0]}")
+            if generated_length == 0:
+                yield "Lo siento, el modelo de IA no está disponible en este momento."
+        else:
+            print(f"[IAEngine] [SUCCESS] Streaming completado, length: {generated_length}")
+
+
+@register_engine("transformers-cpu")
+class CPUTransformersEngine(TransformersEngine):
+    """Mismo modelo en CPU: pesos bf16/fp32, int8 dinámico opcional e hilos ajustados al hardware"""
+
+    device = "cpu"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Precisión e hilos efectivos
+        self.cpu_info = None
+
+    def _load_weights(self):
+        threads = configure_cpu_threads()
+        print(f"[IAEngine] [CONFIG] torch usará {threads} hilos de CPU")
+
+        precision = self.model_config.get("precision", "auto")
+        print(f"[IAEngine] [LOADING] Cargando tokenizer y modelo (precisión {precision})")
+        self.tokenizer, self.model, precision = load_cpu_model(self.model_name, precision, self.report_progress)
+        self.cpu_info = {"precision": precision, "threads": threads}
+
+    def _create_pipeline(self):
+        self.pipeline = pipeline("text-generation", model=self.model, tokenizer=self.tokenizer)
+
+    def get_status(self):
+        return {"cpu": self.cpu_info, **super().get_status()}
+
+
+@register_engine("stub")
+class StubEngine(InferenceEngine):
+    """
+    Engine simulado y determinista para medir HTTP, ruteo y tools sin modelo: la respuesta depende
+    solo del prompt y tarda latency_ms (hasta el primer token) más un token cada 1/tokens_per_s.
+    Con "tool_call" en la configuración, la primera pasada de un prompt con herramientas responde
+    ese TOOL_CALL y la siguiente (ya con RESULTADO DE TOOL) la respuesta final, como el modelo real.
+    max_concurrency limita las generaciones simultáneas (1 = un solo modelo, como en GPU).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency_ms = float(self.model_config.get("latency_ms", 50))
+        self.tokens_per_s = float(self.model_config.get("tokens_per_s", 30))
+        # Largo de la respuesta (sin pasar de max_new_tokens)
+        self.response_tokens = int(self.model_config.get("response_tokens", 64))
+        self.tool_call = self.model_config.get("tool_call")
+        self.slots = Semaphore(int(self.model_config.get("max_concurrency", 1)))
+        self.loaded = False
+        self.stats = {"requests_served": 0, "tokens_generated": 0, "cancelled": 0}
+
+    def load(self):
+        self.loaded = True
+        print(f"[IAEngine] [SUCCESS] Engine simulado listo ({self.latency_ms} ms de latencia, {self.tokens_per_s} tokens/s)")
+
+    def is_ready(self):
+        return self.loaded
+
+    def unload(self):
+        self.loaded = False
+
+    def get_status(self):
+        return {"stub": {"latency_ms": self.latency_ms, "tokens_per_s": self.tokens_per_s, **self.stats}}
+
+    def _tokens(self, user_prompt, system_prompt, max_new_tokens):
+        if self.tool_call and "TOOL_CALL" in f"{system_prompt or ''}{user_prompt}" and "RESULTADO DE TOOL" not in user_prompt:
+            return [f"TOOL_CALL: {json.dumps(self.tool_call, ensure_ascii=False)}"]
+        digest = hashlib.sha1(f"{system_prompt or ''}\x00{user_prompt}".encode("utf-8")).hexdigest()
+        length = min(max_new_tokens, self.response_tokens)
+        words = ["Respuesta", "simulada", digest[:8] + "."] + [f"token{int(digest[i % 40], 16)}" for i in range(length)]
+        return [word + " " for word in words[:length]]
+
+    def generate_stream(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, cancel_event=None):
+        tokens = self._tokens(user_prompt, system_prompt, max_new_tokens)
+        with self.slots:
+            time.sleep(self.latency_ms / 1000.0)
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(1.0 / self.tokens_per_s)
+                if cancel_event is not None and cancel_event.is_set():
+                    self.stats["cancelled"] += 1
+                    return
+                yield token
+            self.stats["requests_served"] += 1
+            self.stats["tokens_generated"] += len(tokens)
+
+    def generate(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
+        text = "".join(self.generate_stream(user_prompt, system_prompt, max_new_tokens, temperature, top_p, cancel_event)).strip()
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled()
+        return text
+
+
+class HTTPConnectionPool:
+    """
+    Conexiones HTTP/1.1 keep-alive reutilizables hacia un mismo host. Cada petición toma una
+    conexión libre (o abre una nueva) y la devuelve al terminar de leer la respuesta; se conservan
+    como máximo max_idle conexiones libres.
+    """
+
+    def __init__(self, base_url, timeout_s=120.0, max_idle=8):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"URL no soportada: {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout_s = timeout_s
+        self._idle = queue.LifoQueue(maxsize=max(1, int(max_idle)))
+        self.stats = {"connections_opened": 0, "requests": 0}
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            self.stats["connections_opened"] += 1
+            return connection_class(self.host, self.port, timeout=self.timeout_s)
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            try:
+                self._idle.put_nowait(connection)
+                return
+            except queue.Full:
+                pass
+        connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Enviar una petición; devuelve (conexión, respuesta). La respuesta debe leerse completa antes de release()"""
+        connection = self.acquire()
+        try:
+            connection.request(method, self.base_path + path, body=body, headers=headers or {})
+            response = connection.getresponse()
+        except Exception:
+            # Una conexión keep-alive que el servidor ya cerró falla aquí: no se reutiliza
+            connection.close()
+            raise
+        self.stats["requests"] += 1
+        return connection, response
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HealthProbe:
+    """
+    Estado de un servidor externo sin bloquear a quien lo consulta: get() devuelve el último
+    resultado y, si tiene más de ttl_s segundos, lo refresca en un hilo aparte (uno a la vez).
+    check() devuelve un dict con "ok": True o lanza excepción.
+    """
+
+    def __init__(self, check, ttl_s=5.0):
+        self.check = check
+        self.ttl_s = ttl_s
+        self.result = None
+        self.checked_at = 0.0
+        self._refreshing = False
+        self._lock = Lock()
+
+    def get(self):
+        with self._lock:
+            start = not self._refreshing and time.monotonic() - self.checked_at >= self.ttl_s
+            if start:
+                self._refreshing = True
+        if start:
+            Thread(target=self._refresh, name="calyx-health-probe", daemon=True).start()
+        return self.result or {"ok": False, "error": "estado aún no verificado"}
+
+    def refresh(self):
+        """Verificación síncrona (ej. en load()); devuelve el resultado"""
+        with self._lock:
+            self._refreshing = True
+        return self._refresh()
+
+    def invalidate(self):
+        """Forzar que el próximo get() vuelva a verificar"""
+        with self._lock:
+            self.checked_at = 0.0
+
+    def _refresh(self):
+        started_at = time.perf_counter()
+        try:
+            result = self.check()
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        result["latency_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+        with self._lock:
+            self.result, self.checked_at, self._refreshing = result, time.monotonic(), False
+        return result
+
+
+class RemoteEngineError(RuntimeError):
+    """Error del servidor remoto; retryable indica si vale la pena reintentar"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@register_engine("openai")
+class OpenAICompatibleEngine(InferenceEngine):
+    """
+    Inferencia en un proceso aparte (llama.cpp server, vLLM, ...) a través de su API
+    OpenAI-compatible /v1/chat/completions, con conexiones keep-alive, streaming SSE, timeouts
+    y reintentos con backoff ante errores de conexión, 429 y 5xx. El modelo vive fuera del
+    backend, así que los workers de uvicorn escalan sin cargarlo.
+    """
+
+    # Segundos que se reutiliza el último resultado de GET /models para el estado
+    HEALTH_TTL_S = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base_url = self.model_config.get("base_url", "http://127.0.0.1:8080/v1")
+        # La API key no va en available_models (se publica en /model/available)
+        self.api_key = self.model_config.get("api_key") or os.environ.get("CALYX_REMOTE_API_KEY")
+        self.timeout_s = float(self.model_config.get("timeout_s", 120))
+        # La verificación de estado no espera lo mismo que una generación
+        self.health_timeout_s = float(self.model_config.get("health_timeout_s", 2))
+        self.max_retries = int(self.model_config.get("max_retries", 2))
+        self.pool = None
+        # Conexión propia para GET /models: no compite con las generaciones ni usa su timeout
+        self.health_pool = None
+        self.health = HealthProbe(self._probe, self.HEALTH_TTL_S)
+        self.stats = {"requests_served": 0, "retries": 0, "errors": 0}
+
+    @property
+    def device(self):
+        return self.base_url
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def load(self):
+        self.pool = HTTPConnectionPool(self.base_url, self.timeout_s, int(self.model_config.get("pool_size", 8)))
+        self.health_pool = HTTPConnectionPool(self.base_url, self.health_timeout_s, max_idle=1)
+        # El servidor remoto puede arrancar después que el backend: no es un error de carga
+        health = self.health.refresh()
+        if health["ok"]:
+            print(f"[IAEngine] [SUCCESS] Servidor remoto disponible en {self.base_url}: {health.get('models')}")
+        else:
+            print(f"[IAEngine] [WARNING] Servidor remoto no disponible en {self.base_url}: {health.get('error')}")
+
+    def unload(self):
+        for pool in (self.pool, self.health_pool):
+            if pool is not None:
+                pool.close()
+        self.pool = None
+        self.health_pool = None
+
+    def _probe(self):
+        """GET /models del servidor remoto con timeout corto"""
+        connection, response = self.health_pool.request("GET", "/models", headers=self._headers())
+        body = response.read()
+        self.health_pool.release(connection, not response.will_close)
+        if response.status != 200:
+            raise RemoteEngineError(f"HTTP {response.status}")
+        return {"ok": True, "models": [model.get("id") for model in json.loads(body).get("data", [])]}
+
+    def check_health(self):
+        """Último estado conocido del servidor remoto; se refresca en segundo plano cada HEALTH_TTL_S segundos"""
+        return self.health.get()
+
+    def is_ready(self):
+        return self.pool is not None and self.check_health()["ok"]
+
+    def get_status(self):
+        health = self.check_health() if self.pool is not None else {"ok": False, "error": "engine descargado"}
+        status = {"remote": {"base_url": self.base_url, "health": health, **self.stats, **(self.pool.stats if self.pool else {})}}
+        if not health["ok"]:
+            status.update({"status": "unavailable", "message": f"Servidor remoto no disponible: {health.get('error')}"})
+        return status
+
+    def _payload(self, user_prompt, system_prompt, max_new_tokens, temperature, top_p, stream):
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.append({"role": "user", "content": user_prompt})
+        return json.dumps({
+            "model": self.model_name,
+            "messages": messages,
+            "max_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "stream": stream
+        }, ensure_ascii=False).encode("utf-8")
+
+    def _open(self, payload):
+        """POST /chat/completions; devuelve (conexión, respuesta) con status 200 o lanza RemoteEngineError"""
+        try:
+            connection, response = self.pool.request("POST", "/chat/completions", body=payload, headers=self._headers())
+        except (OSError, http.client.HTTPException) as e:
+            raise RemoteEngineError(f"Sin conexión con {self.base_url}: {e}", retryable=True)
+        if response.status != 200:
+            detail = response.read()[:300].decode("utf-8", "replace")
+            self.pool.release(connection, not response.will_close)
+            raise RemoteEngineError(f"HTTP {response.status} de {self.base_url}: {detail}",
+                                    retryable=response.status == 429 or response.status >= 500)
+        return connection, response
+
+    def _with_retries(self, attempt):
+        """Ejecutar attempt() reintentando errores transitorios con backoff exponencial"""
+        for retry in range(self.max_retries + 1):
+            try:
+                return attempt()
+            except RemoteEngineError as e:
+                if not e.retryable or retry == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                delay = 0.2 * (2 ** retry)
+                print(f"[IAEngine] [WARNING] {e}; reintento {retry + 1}/{self.max_retries} en {delay:.1f} s")
+                time.sleep(delay)
+
+    def generate(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
+        # kv_session no aplica: el servidor remoto administra su propio cache de prompts.
+        # Sin streaming no hay forma de interrumpir la petición HTTP: cancel_event solo aplica a generate_stream()
+        payload = self._payload(user_prompt, system_prompt, max_new_tokens, temperature, top_p, stream=False)
+
+        def attempt():
+            connection, response = self._open(payload)
+            try:
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise RemoteEngineError(f"Respuesta interrumpida de {self.base_url}: {e}", retryable=True)
+            self.pool.release(connection, not response.will_close)
+            return json.loads(body)["choices"][0]["message"]["content"] or ""
+
+        try:
+            text = self._with_retries(attempt)
+            self.stats["requests_served"] += 1
+            return text.strip()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en generación remota: {e}")
+            return "Lo siento, el modelo de IA no está disponible en este momento."
+
+    def generate_stream(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, cancel_event=None):
+        """Streaming SSE (data: {...} por línea, data: [DONE] al final); se reintenta solo antes del primer fragmento"""
+        payload = self._payload(user_prompt, system_prompt, max_new_tokens, temperature, top_p, stream=True)
+        try:
+            connection, response = self._with_retries(lambda: self._open(payload))
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en streaming remoto: {e}")
+            yield "Lo siento, el modelo de IA no está disponible en este momento."
+            return
+
+        finished = False
+        try:
+            for line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    # Cerrar la conexión (no reutilizable) corta la generación en el servidor
+                    break
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    finished = True
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content")
+                if text:
+                    yield text
+            if finished:
+                self.stats["requests_served"] += 1
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Streaming remoto interrumpido: {e}")
+        finally:
+            if finished:
+                # Consumir el resto del cuerpo para poder reutilizar la conexión
+                response.read()
+            # Si el consumidor abandonó el stream a medias, la conexión no se puede reutilizar
+            self.pool.release(connection, finished and not response.will_close)
+
+
+class ModelServerBusy(RemoteEngineError):
+    """El servidor de modelo rechazó la petición porque su cola está llena (backpressure)"""
+
+    def __init__(self, message, retry_after_s=1.0):
+        super().__init__(message, retryable=True)
+        self.retry_after_s = retry_after_s
+
+
+@register_engine("model-server")
+class ModelServerEngine(InferenceEngine):
+    """
+    Cliente del servidor de modelo compartido (model_server.py): un solo proceso carga el modelo
+    y cada worker de uvicorn le envía sus generaciones por IPC local (socket Unix, o named pipe en
+    Windows) con multiprocessing.connection. Las tools, los prompts y la base de datos se quedan en
+    el worker. Una conexión lleva una petición a la vez y se reutiliza; cerrarla a mitad de una
+    petición la cancela en el servidor. Con la cola del servidor llena se lanza ModelServerBusy.
+    """
+
+    # Segundos que se reutiliza el último estado del servidor
+    HEALTH_TTL_S = 2.0
+    # Tiempo máximo de espera de la consulta de estado
+    HEALTH_TIMEOUT_S = 2.0
+    # Intervalo con el que se revisa cancel_event mientras se espera la respuesta
+    POLL_INTERVAL_S = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.address = self.model_config.get("address") or default_model_server_address()
+        self.timeout_s = float(self.model_config.get("timeout_s", 120))
+        self._idle = None
+        self.health = HealthProbe(self._probe, self.HEALTH_TTL_S)
+        self.stats = {"requests_served": 0, "connections_opened": 0, "rejected_busy": 0, "cancelled": 0, "errors": 0}
+
+    @property
+    def device(self):
+        return self.address
+
+    def load(self):
+        self._idle = queue.LifoQueue(maxsize=max(1, int(self.model_config.get("pool_size", 8))))
+        # El servidor de modelo puede arrancar después que los workers: no es un error de carga
+        health = self.health.refresh()
+        if health["ok"]:
+            print(f"[IAEngine] [SUCCESS] Servidor de modelo disponible en {self.address}: {health['server'].get('model_name')}")
+        else:
+            print(f"[IAEngine] [WARNING] Servidor de modelo no disponible en {self.address}: {health.get('error')}")
+
+    def unload(self):
+        if self._idle is None:
+            return
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._idle = None
+
+    def _send(self, message):
+        """Enviar el mensaje por una conexión libre (o nueva); devuelve la conexión"""
+        while True:
+            try:
+                connection, pooled = self._idle.get_nowait(), True
+            except queue.Empty:
+                try:
+                    connection, pooled = Client(self.address, authkey=model_server_authkey()), False
+                except AuthenticationError:
+                    raise RemoteEngineError(f"El servidor de modelo en {self.address} rechazó la clave (CALYX_MODEL_SERVER_AUTHKEY)")
+                except (OSError, EOFError) as e:
+                    raise RemoteEngineError(f"Sin conexión con el servidor de modelo en {self.address}: {e}", retryable=True)
+                self.stats["connections_opened"] += 1
+            try:
+                connection.send(message)
+                return connection
+            except (OSError, EOFError) as e:
+                connection.close()
+                # Una conexión reutilizada puede haber quedado cerrada (servidor reiniciado): abrir otra
+                if not pooled:
+                    raise RemoteEngineError(f"Sin conexión con el servidor de modelo en {self.address}: {e}", retryable=True)
+
+    def _release(self, connection, reusable):
+        if reusable and self._idle is not None:
+            try:
+                self._idle.put_nowait(connection)
+                return
+            except queue.Full:
+                pass
+        connection.close()
+
+    def _request(self, message, cancel_event=None, timeout_s=None):
+        """
+        Enviar una petición y producir sus mensajes de respuesta hasta el final ("chunk" no es final).
+        Si cancel_event se activa o el consumidor abandona el generador, la conexión se cierra y el
+        servidor cancela la generación.
+        """
+        timeout_s = timeout_s or self.timeout_s
+        connection = self._send(message)
+        finished = False
+        try:
+            deadline = time.monotonic() + timeout_s
+            while True:
+                if not connection.poll(self.POLL_INTERVAL_S):
+                    if cancel_event is not None and cancel_event.is_set():
+                        self.stats["cancelled"] += 1
+                        raise GenerationCancelled()
+                    if time.monotonic() > deadline:
+                        raise RemoteEngineError(f"El servidor de modelo no respondió en {timeout_s:.0f} s")
+                    continue
+                response = connection.recv()
+                if response["type"] != "chunk":
+                    finished = True
+                    break
+                deadline = time.monotonic() + timeout_s
+                yield response
+        except (OSError, EOFError) as e:
+            raise RemoteEngineError(f"Conexión con el servidor de modelo interrumpida: {e}")
+        finally:
+            self._release(connection, finished)
+        # La conexión vuelve al pool antes de entregar la respuesta final
+        yield response
+
+    def _raise_for(self, response):
+        if response["type"] == "busy":
+            self.stats["rejected_busy"] += 1
+            raise ModelServerBusy(response["error"], response.get("retry_after_s", 1.0))
+        raise RemoteEngineError(response.get("error", f"Respuesta inesperada del servidor de modelo: {response['type']}"))
+
+    def _probe(self):
+        response = next(self._request({"op": "status"}, timeout_s=self.HEALTH_TIMEOUT_S))
+        if response["type"] != "status":
+            self._raise_for(response)
+        return {"ok": True, "server": response["status"]}
+
+    def check_health(self):
+        """Último estado conocido del servidor de modelo; se refresca en segundo plano cada HEALTH_TTL_S segundos"""
+        return self.health.get()
+
+    def is_ready(self):
+        if self._idle is None:
+            return False
+        health = self.check_health()
+        return health["ok"] and health["server"].get("ready", False)
+
+    def get_status(self):
+        health = self.check_health() if self._idle is not None else {"ok": False, "error": "engine descargado"}
+        status = {"model_server": {"address": self.address, "health": health, **self.stats}}
+        if not health["ok"]:
+            status.update({"status": "unavailable", "message": f"Servidor de modelo no disponible: {health.get('error')}"})
+        elif not health["server"].get("ready"):
+            status.update({"status": health["server"].get("status", "loading"), "message": health["server"].get("message")})
+        return status
+
+    def switch_model(self, model_key):
+        """Cambiar el modelo del servidor (afecta a todos los workers); devuelve si quedó listo"""
+        response = next(self._request({"op": "switch_model", "model_key": model_key}))
+        if response["type"] != "result":
+            self._raise_for(response)
+        self.health.invalidate()
+        return response["ready"]
+
+    def _generation_message(self, op, user_prompt, system_prompt, max_new_tokens, temperature, top_p):
+        return {
+            "op": op,
+            "user_prompt": user_prompt,
+            "system_prompt": system_prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p
+        }
+
+    def generate(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
+        # kv_session no cruza procesos: el servidor reutiliza el KV de los bloques fijos con su PrefixKVCache
+        message = self._generation_message("generate", user_prompt, system_prompt, max_new_tokens, temperature, top_p)
+        try:
+            for response in self._request(message, cancel_event):
+                if response["type"] != "result":
+                    self._raise_for(response)
+                self.stats["requests_served"] += 1
+                return response["text"]
+        except (ModelServerBusy, GenerationCancelled):
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en generación con el servidor de modelo: {e}")
+            return "Lo siento, el modelo de IA no está disponible en este momento."
+
+    def generate_stream(self, user_prompt, system_prompt=None, max_new_tokens=300, temperature=0.3, top_p=0.8, cancel_event=None):
+        message = self._generation_message("stream", user_prompt, system_prompt, max_new_tokens, temperature, top_p)
+        generated_length = 0
+        try:
+            for response in self._request(message, cancel_event):
+                if response["type"] == "chunk":
+                    generated_length += len(response["text"])
+                    yield response["text"]
+                elif response["type"] == "done":
+                    self.stats["requests_served"] += 1
+                else:
+                    self._raise_for(response)
+        except ModelServerBusy:
+            raise
+        except GenerationCancelled:
+            return
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[IAEngine] [ERROR] Error en streaming con el servidor de modelo: {e}")
+            if generated_length == 0:
+                yield "Lo siento, el modelo de IA no está disponible en este momento."
+
+
+class IAEngine:
+    def __init__(self, model_name=None, batch_max_size=None, batch_max_wait_ms=None, autoload=True, progress_callback=None):
+        """
+        Con autoload=False solo se prepara la configuración y el modelo se carga después con
+        load_model() (ej. en un hilo de arranque); progress_callback recibe cada paso de la carga.
+        """
+        # Configuración de modelos disponibles; "engine" elige la implementación en ENGINE_REGISTRY
+        self.available_models = {
+            "llama3.2": {
+                "name": "Qwen/Qwen2.5-3B-Instruct",
+                "engine": "transformers",
+                "description": "Qwen2.5-3B - Rápido y eficiente",
+                "quantization": "4bit"  # 4-bit quantization para GTX 1050 Ti
+            },
+            "qwen2.5-3b-cpu": {
+                "name": "Qwen/Qwen2.5-3B-Instruct",
+                "engine": "transformers-cpu",
+                "description": "Qwen2.5-3B - CPU (sin CUDA)",
+                # auto = fp32; bf16 (con bf16 nativo) o int8 (cuantización dinámica) con CALYX_CPU_PRECISION
+                "precision": os.environ.get("CALYX_CPU_PRECISION", "auto")
+            },
+            "stub": {
+                "name": "stub",
+                "engine": "stub",
+                "description": "Engine simulado - benchmarks sin modelo",
+                "latency_ms": float(os.environ.get("CALYX_STUB_LATENCY_MS", "50")),
+                "tokens_per_s": float(os.environ.get("CALYX_STUB_TOKENS_PER_S", "30")),
+                "response_tokens": int(os.environ.get("CALYX_STUB_RESPONSE_TOKENS", "64"))
+            },
+            "remote": {
+                # Nombre del modelo tal como lo expone el servidor remoto
+                "name": os.environ.get("CALYX_REMOTE_MODEL", "qwen2.5-3b-instruct"),
+                "engine": "openai",
+                "description": "Servidor OpenAI-compatible (llama.cpp, vLLM) en otro proceso",
+                "base_url": os.environ.get("CALYX_REMOTE_URL", "http://127.0.0.1:8080/v1"),
+                "timeout_s": float(os.environ.get("CALYX_REMOTE_TIMEOUT_S", "120")),
+                "health_timeout_s": float(os.environ.get("CALYX_REMOTE_HEALTH_TIMEOUT_S", "2")),
+                "max_retries": int(os.environ.get("CALYX_REMOTE_MAX_RETRIES", "2")),
+                "pool_size": int(os.environ.get("CALYX_REMOTE_POOL_SIZE", "8"))
+            },
+            "server": {
+                # Cliente del proceso model_server.py: permite uvicorn --workers N con un solo modelo cargado
+                "name": "model-server",
+                "engine": "model-server",
+                "description": "Servidor de modelo compartido (model_server.py) por IPC local",
+                "address": os.environ.get("CALYX_MODEL_SERVER_ADDRESS") or default_model_server_address(),
+                "timeout_s": float(os.environ.get("CALYX_MODEL_SERVER_TIMEOUT_S", "120")),
+                "pool_size": int(os.environ.get("CALYX_MODEL_SERVER_POOL_SIZE", "8"))
+            }
+            # Espacio reservado para modelo grande en el futuro
+        }
+
+        # Modelo por defecto según el hardware: Qwen2.5-3B 4-bit con CUDA, la variante de CPU sin ella
+        self.current_model_key = default_model_key(self.available_models)
+        current_model_config = self.available_models[self.current_model_key]
+        self.model_name = model_name or current_model_config["name"]
+        self.current_engine = current_model_config["engine"]
+
+        self.model_error = None
+        self.accelerator = Accelerator()
+
+        # Configuración del scheduler de micro-batching (ajustable por variables de entorno)
+        self.scheduler_config = {
+            "max_batch_size": batch_max_size or int(os.environ.get("CALYX_BATCH_MAX_SIZE", "4")),
+            "max_wait_ms": batch_max_wait_ms if batch_max_wait_ms is not None else float(os.environ.get("CALYX_BATCH_MAX_WAIT_MS", "10"))
+        }
+
+        # Executor dedicado para inferencia: la generación nunca corre en el event loop de asyncio.
+        # Sus hilos solo esperan resultados del scheduler, que es quien serializa el acceso al modelo,
+        # así que necesita tantos workers como peticiones puedan entrar en un batch
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=self.scheduler_config["max_batch_size"],
+            thread_name_prefix="calyx-inference"
+        )
+
+        self.progress_callback = progress_callback
+        self.engine = None
+        if autoload:
+            self._load_model()
+
+    def load_model(self):
+        """Cargar el modelo actual si aún no se cargó (tras un error, lo reintenta); devuelve si quedó listo"""
+        if self.engine is None:
+            self._load_model()
+        return self.is_ready()
+
+    def _load_model(self):
+        """Crear, cargar y calentar el engine del modelo actual; un fallo queda en model_error"""
+        try:
+            engine = create_engine(
+                self.current_model_key,
+                self.available_models[self.current_model_key],
+                self.model_name,
+                self.inference_executor,
+                self.scheduler_config
+            )
+            engine.progress_callback = self.progress_callback
+            engine.load()
+        except Exception as e:
+            error_msg = f"Error cargando modelo {self.model_name}: {str(e)}"
+            print(f"[IAEngine] [ERROR] {error_msg}")
+            self.model_error = error_msg
+            return
+
+        try:
+            engine.warmup()
+        except Exception as e:
+            # Sin calentamiento el modelo sigue siendo usable: la primera petición solo tarda más
+            print(f"[IAEngine] [WARNING] Falló la generación de calentamiento: {e}")
+
+        # El engine se publica ya calentado: mientras tanto is_ready() sigue en False
+        self.engine = engine
+        self.model_error = None
+
+    def generate(self, prompt, system_prompt=None, max_new_tokens=120, temperature=0.3, top_p=0.8, kv_session=None, cancel_event=None):
+        """
+        Generación con el engine actual.
+        kv_session (opcional) conserva el cache del modelo entre llamadas consecutivas sobre el mismo prompt creciente.
+        cancel_event (opcional) cancela la petición; en ese caso se lanza GenerationCancelled.
+        """
+        if not self.is_ready():
+            raise RuntimeError("Modelo no está disponible. Verifica que esté cargado correctamente.")
+
+        return self.engine.generate(prompt, system_prompt, max_new_tokens, temperature, top_p, kv_session, cancel_event)
+
+    async def _run_cancellable(self, function, *args, **kwargs):
+        """
+        Ejecutar function(..., cancel_event=...) en el executor de inferencia; si la tarea de asyncio
+        se cancela, el cancel_event libera el modelo en lugar de terminar una respuesta que nadie leerá
+        """
+        loop = asyncio.get_running_loop()
+        cancel_event = Event()
+        try:
+            return await loop.run_in_executor(
+                self.inference_executor,
+                functools.partial(function, *args, cancel_event=cancel_event, **kwargs)
+            )
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    async def agenerate(self, prompt, system_prompt=None, max_new_tokens=120, temperature=0.3, top_p=0.8):
+        """
+        Versión asíncrona de generate(): ejecuta la generación en el executor de inferencia
+        para no bloquear el event loop mientras el modelo trabaja
+        """
+        return await self._run_cancellable(self.generate, prompt, system_prompt=system_prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+
+    def generate_stream(self, prompt, system_prompt=None, max_new_tokens=120, temperature=0.3, top_p=0.8, cancel_event=None):
+        """
+        Generación en streaming: produce fragmentos de texto conforme el modelo genera tokens.
+        Cerrar el generador antes de terminar (o activar cancel_event) cancela la generación.
+        """
+        if not self.is_ready():
+            raise RuntimeError("Modelo no está disponible. Verifica que esté cargado correctamente.")
+
+        return self.engine.generate_stream(prompt, system_prompt, max_new_tokens, temperature, top_p, cancel_event)
+
     def switch_model(self, model_key):
         """Cambiar entre modelos disponibles"""
         if model_key not in self.available_models:
             raise ValueError(f"Modelo '{model_key}' no disponible. Opciones: {list(self.available_models.keys())}")
-        
-        if model_key == self.current_model_key:
+
+        if isinstance(self.engine, ModelServerEngine) and self.available_models[model_key]["engine"] != "model-server":
+            # En modo servidor el cambio aplica al modelo compartido por todos los workers, no a este proceso
+            return self.engine.switch_model(model_key)
+
+        if model_key == self.current_model_key and self.engine is not None:
             print(f"[IAEngine] Modelo '{model_key}' ya está cargado")
             return True
-        
+
         print(f"[IAEngine] Cambiando de '{self.current_model_key}' a '{model_key}'...")
-        
+
         # Limpiar modelo actual de memoria
-        self.model = None
-        self.tokenizer = None
-        self.pipeline = None
+        if self.engine is not None:
+            self.engine.unload()
+            self.engine = None
         self.model_error = None
-        
+
+        model_config = self.available_models[model_key]
+        self.current_model_key = model_key
+        self.model_name = model_config["name"]
+        self.current_engine = model_config["engine"]
+
         self._load_model()
         return self.is_ready()
-    
+
     def get_current_model(self):
         """Obtener información del modelo actual"""
         model_info = self.available_models[self.current_model_key].copy()
@@ -291,6 +1856,39 @@ class IAEngine:
                     "required": ["criterios"]
                 }
             },
+            "sustituir_alimento": {
+                "description": "Buscar sustitutos de un alimento: los alimentos con perfil nutricional más parecido, opcionalmente con menos o más de algún nutriente",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "nombre": {
+                            "type": "string",
+                            "description": "Alimento a sustituir (ej: 'jamón de pavo')"
+                        },
+                        "menos": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Nutrientes en los que el sustituto debe tener menos que el original (ej: ['sodio', 'lipidos'])"
+                        },
+                        "mas": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Nutrientes en los que el sustituto debe tener más que el original (ej: ['fibra', 'proteina'])"
+                        },
+                        "mismo_grupo": {
+                            "type": "boolean",
+                            "description": "Buscar solo en el mismo grupo de alimentos (por defecto true)",
+                            "default": True
+                        },
+                        "limite": {
+                            "type": "number",
+                            "description": "Número de sustitutos (por defecto 5)",
+                            "default": 5
+                        }
+                    },
+                    "required": ["nombre"]
+                }
+            },
             "calcular_composicion_total": {
                 "description": "Calcular la composición nutricional total de una combinación de alimentos",
                 "parameters": {
@@ -365,6 +1963,11 @@ class IAEngine:
                 return self._tool_consultar_alimento(parameters.get("nombre", ""))
             elif tool_name == "buscar_alimentos_filtrados":
                 return self._tool_buscar_alimentos_filtrados(parameters.get("criterios", {}), parameters.get("limite", 10))
+            elif tool_name == "sustituir_alimento":
+                return self._tool_sustituir_alimento(
+                    parameters.get("nombre", ""), parameters.get("menos", []), parameters.get("mas", []),
+                    parameters.get("mismo_grupo", True), parameters.get("limite", 5)
+                )
             elif tool_name == "calcular_composicion_total":
                 return self._tool_calcular_composicion_total(parameters.get("alimentos", []), parameters.get("porciones"))
             elif tool_name == "generar_recomendaciones_dieta":
@@ -385,20 +1988,24 @@ class IAEngine:
 
         try:
             # Importar función de consulta de alimentos
-            from main import get_alimentos_by_name
+            from main import get_alimentos_by_name, get_alimentos_aproximados
 
-            columns, rows = get_alimentos_by_name(nombre_alimento)
+            rows = get_alimentos_by_name(nombre_alimento)
+            aproximado = not rows
+            if aproximado:
+                # Posible error de escritura ("platno", "yogurth"): alimentos con nombre parecido
+                rows = get_alimentos_aproximados(nombre_alimento, 3)
 
-            if not columns or not rows:
+            if not rows:
                 return {
                     "encontrado": False,
                     "mensaje": f"No se encontró información para '{nombre_alimento}' en la base de datos"
                 }
 
             # Obtener el alimento más relevante
-            alimento_dict = dict(zip(columns, rows[0]))
+            alimento_dict = rows[0]
 
-            return {
+            resultado = {
                 "encontrado": True,
                 "alimento": alimento_dict.get('alimento', 'N/A'),
                 "grupo": alimento_dict.get('grupo de alimentos', 'N/A'),
@@ -418,6 +2025,14 @@ class IAEngine:
                     "sodio_mg": alimento_dict.get('sodio (mg)', 'N/A')
                 }
             }
+            if aproximado:
+                resultado["coincidencia_aproximada"] = True
+                resultado["similitud"] = alimento_dict.get('similitud')
+                resultado["mensaje"] = f"No se encontró '{nombre_alimento}'; se muestra el alimento más parecido"
+                resultado["sugerencias"] = [
+                    {"alimento": row.get('alimento', ''), "similitud": row.get('similitud')} for row in rows[1:]
+                ]
+            return resultado
 
         except Exception as e:
             return {"error": f"Error consultando alimento: {str(e)}"}
@@ -428,15 +2043,10 @@ class IAEngine:
             return {"error": "Tipo de fórmula requerido"}
 
         try:
-            import json
-            import os
-
-            # Cargar fórmulas desde JSON
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            formulas_path = os.path.join(current_dir, "data_formulas.json")
+            from calculos.formulas import get_formula_engine
 
-            with open(formulas_path, encoding="utf-8") as f:
-                formulas = json.load(f)
+            # Definiciones ya cargadas por el motor de fórmulas
+            formulas = get_formula_engine().definiciones
 
             # Buscar fórmula por tipo
             formula_encontrada = None
@@ -467,15 +2077,10 @@ class IAEngine:
     def _tool_listar_formulas(self):
         """Tool para listar todas las fórmulas disponibles"""
         try:
-            import json
-            import os
+            from calculos.formulas import get_formula_engine
 
-            # Cargar fórmulas desde JSON
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            formulas_path = os.path.join(current_dir, "data_formulas.json")
-
-            with open(formulas_path, encoding="utf-8") as f:
-                formulas = json.load(f)
+            # Definiciones ya cargadas por el motor de fórmulas
+            formulas = get_formula_engine().definiciones
 
             formulas_disponibles = []
             for key, formula in formulas.items():
@@ -509,6 +2114,42 @@ class IAEngine:
         except Exception as e:
             return {"error": f"Error en búsqueda filtrada: {str(e)}"}
 
+    def _tool_sustituir_alimento(self, nombre_alimento, menos=None, mas=None, mismo_grupo=True, limite=5):
+        """Tool para buscar sustitutos de un alimento por similitud de nutrientes"""
+        if not nombre_alimento:
+            return {"error": "Nombre de alimento requerido"}
+
+        try:
+            from main import get_alimentos_aproximados
+            from utils.matriz_nutrientes import get_matriz_nutrientes
+            from utils.similares import get_buscador_similares
+
+            # Aceptar un nutriente suelto además de una lista ("sodio" o ["sodio"])
+            menos = [menos] if isinstance(menos, str) else list(menos or [])
+            mas = [mas] if isinstance(mas, str) else list(mas or [])
+
+            datos, posiciones = get_matriz_nutrientes().resolver_nombres([nombre_alimento])
+            if posiciones[0] >= 0:
+                id_alimento = datos.ids[posiciones[0]]
+            else:
+                aproximados = get_alimentos_aproximados(nombre_alimento, 1)
+                if not aproximados:
+                    return {
+                        "encontrado": False,
+                        "mensaje": f"No se encontró '{nombre_alimento}' en la base de datos"
+                    }
+                id_alimento = aproximados[0].get("id")
+
+            resultado = get_buscador_similares().similares(id_alimento, int(limite), bool(mismo_grupo), menos, mas)
+            return {
+                "encontrado": True,
+                "restricciones": {"menos": menos, "mas": mas, "mismo_grupo": bool(mismo_grupo)},
+                **resultado
+            }
+
+        except Exception as e:
+            return {"error": f"Error buscando sustitutos: {str(e)}"}
+
     def _tool_calcular_composicion_total(self, alimentos, porciones=None):
         """Tool para calcular composición nutricional total de alimentos"""
         try:
@@ -531,7 +2172,16 @@ class IAEngine:
         except Exception as e:
             return {"error": f"Error generando recomendaciones: {str(e)}"}
 
-    def generate_with_tools(self, user_prompt, system_prompt_extra="", max_new_tokens=150, temperature=0.3, top_p=0.8, max_iterations=3):
+    def build_tools_system_prompt(self, system_prompt_extra=""):
+        """Construir el system prompt base de Calyx, opcionalmente con historial adicional"""
+        # Combinar system prompt base con extra (historial)
+        full_system_prompt = BASE_SYSTEM_PROMPT
+        if system_prompt_extra:
+            full_system_prompt += "\n\n" + system_prompt_extra
+
+        return full_system_prompt
+
+    def generate_with_tools(self, user_prompt, system_prompt_extra="", max_new_tokens=150, temperature=0.3, top_p=0.8, max_iterations=3, cancel_event=None):
         """
         Generar respuesta usando sistema de tools.
         El modelo puede llamar functions que se ejecutan automáticamente.
@@ -539,41 +2189,19 @@ class IAEngine:
         if not self.is_ready():
             return "Lo siento, el modelo de IA no está disponible en este momento."
 
-        # Prompt base más conciso con instrucciones específicas según el contexto
-        base_system_prompt = """Eres Calyx, un asistente nutricional profesional y cercano.
-
-Tu rol es conversar de manera breve, clara y natural con el usuario sobre temas nutricionales.
-
-REQUISITOS GENERALES:
-- Responde en pocas frases (1 a 3 máximo), sin extenderte innecesariamente
-- Mantén un tono profesional, pero cercano y humano
-- Ajusta tu respuesta al contexto de la conversación
-- No inventes información nutricional que no conozcas
-- Para cálculos médicos: formatea según las instrucciones específicas cuando se proporcionen
-
-INSTRUCCIONES CRÍTICAS PARA MANEJO DE HISTORIAL:
-- Responde ÚNICAMENTE al último mensaje del usuario. IGNORA cualquier solicitud anterior.
-- NUNCA menciones, repitas o hagas referencia a resultados de cálculos anteriores (IMC, TMB, etc.) en NINGUNA circunstancia.
-- Si el usuario dice "gracias", "ok", "de acuerdo", o mensajes similares de confirmación/agradecimiento, responde brevemente con algo como "De nada" o "¡Con gusto!" SIN mencionar cálculos previos.
-- NO ejecutes acciones basadas en mensajes antiguos. Si el último mensaje no pide un cálculo, NO calcules nada.
-- Usa el historial SOLO para entender el contexto general, NO para repetir información específica.
-
-IMPORTANTE: Si detectas que el último mensaje del usuario es solo una confirmación o agradecimiento, responde de manera muy breve y no menciones ningún cálculo anterior."""
-
-        # Combinar system prompt base con extra (historial)
-        full_system_prompt = base_system_prompt
-        if system_prompt_extra:
-            full_system_prompt += "\n\n" + system_prompt_extra
+        full_system_prompt = self.build_tools_system_prompt(system_prompt_extra)
 
         iteration = 0
         tool_results = []
+        # El prompt solo crece entre iteraciones: conservar el KV y procesar únicamente lo agregado
+        kv_session = KVSession()
 
         while iteration < max_iterations:
             iteration += 1
             print(f"[IAEngine] Iteración {iteration}: Generando respuesta...")
 
             # Generar respuesta del modelo con system y user separados
-            response = self.generate(user_prompt, system_prompt=full_system_prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+            response = self.generate(user_prompt, system_prompt=full_system_prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p, kv_session=kv_session, cancel_event=cancel_event)
 
             # Verificar si el modelo quiere llamar una tool
             tool_call = self._parse_tool_call(response)
@@ -600,99 +2228,50 @@ IMPORTANTE: Si detectas que el último mensaje del usuario es solo una confirmac
             else:
                 # No hay más tool calls, devolver respuesta final
                 print(f"[IAEngine] Respuesta final generada en iteración {iteration}")
+                if iteration > 1:
+                    print(f"[IAEngine] [CACHE] KV reutilizado entre iteraciones: {kv_session.stats['tokens_reused']} tokens, prefill nuevo: {kv_session.stats['tokens_prefilled']} tokens")
                 return response
 
         # Si se alcanzó el máximo de iteraciones
         return "Lo siento, no pude procesar tu consulta correctamente. ¿Puedes reformular tu pregunta?"
 
+    async def agenerate_with_tools(self, user_prompt, system_prompt_extra="", max_new_tokens=150, temperature=0.3, top_p=0.8, max_iterations=3):
+        """Versión asíncrona de generate_with_tools(), ejecutada en el executor de inferencia"""
+        return await self._run_cancellable(self.generate_with_tools, user_prompt, system_prompt_extra=system_prompt_extra, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p, max_iterations=max_iterations)
+
     def build_calculation_prompt(self, user_prompt, calculation_data):
         """
         Construir prompt optimizado para cálculos médicos.
         El modelo debe generar TODO el contenido del console_block (título, datos, fórmula, resultado)
+        Las instrucciones fijas van primero para que su KV-cache se reutilice entre peticiones.
         """
         import json
 
-        enhanced_prompt = f"""DATOS_CALCULO_MEDICO = {json.dumps(calculation_data, ensure_ascii=False)}
-
-### INSTRUCCIONES PARA EL MODELO (NO COPIAR ESTAS INSTRUCCIONES) ###
-- Usa ÚNICAMENTE los datos de DATOS_CALCULO_MEDICO para generar el cálculo
-- NO copies valores de ejemplo - usa los parámetros reales del JSON
-- Genera ÚNICAMENTE el cálculo médico formateado que aparece después de 'FORMATO A GENERAR'
-- NO incluyas estas instrucciones en tu respuesta
-- NO incluyas ningún texto adicional fuera del formato
-- Incluye TODOS los parámetros relevantes del cálculo
-- Muestra fórmula matemática, sustitución y operaciones paso a paso
-- Finaliza con resultado e interpretación
-- Adapta el título según el tipo de cálculo (IMC, TMB, ICC, etc.)
-
-### FORMATO A GENERAR (USA LOS DATOS REALES, NO COPIES ESTE EJEMPLO) ###
-> Cálculo de IMC
-
-DATOS DE ENTRADA:
-Peso: [peso] kg
-Altura: [altura] m
-
-FÓRMULA:
-IMC = peso / altura²
-
-SUSTITUCIÓN:
-IMC = [peso] / ([altura] × [altura])
-
-OPERACIÓN:
-IMC = [peso] / [altura_cuadrado]
-IMC = [resultado]
+        enhanced_prompt = f"""{CALCULATION_PROMPT_INSTRUCTIONS}
 
-RESULTADO:
-IMC = [resultado] ([interpretacion])"""
+### DATOS DEL CÁLCULO ###
+DATOS_CALCULO_MEDICO = {json.dumps(calculation_data, ensure_ascii=False)}"""
 
         return enhanced_prompt
 
-    def build_nutrition_prompt(self, user_prompt, nutrition_query):
+    def build_nutrition_prompt(self, user_prompt, nutrition_query, tool_result=None):
         """
         Construir prompt optimizado para consultas nutricionales/alimentarias.
         Incluye tools disponibles para acceder a la base de datos SMAE.
+        Las instrucciones fijas van primero para que su KV-cache se reutilice entre peticiones.
+        Con tool_result (búsqueda ya resuelta en el backend) los datos van en el prompt y el
+        modelo escribe directamente la respuesta final, sin la pasada del TOOL_CALL.
         """
-        import json
-
-        enhanced_prompt = f"""CONSULTA_NUTRICIONAL = "{nutrition_query}"
-
-### INSTRUCCIONES PARA RESPUESTAS NUTRICIONALES PROFESIONALES ###
-
-Para consultas sobre alimentos, SIEMPRE debes usar las herramientas disponibles para obtener datos reales de la base de datos SMAE. NO inventes información nutricional.
-
-HERRAMIENTAS DISPONIBLES (usa TOOL_CALL para acceder a datos reales):
-- consultar_alimento: Para información nutricional específica de un alimento (ej: "manzana", "arroz integral")
-- buscar_alimentos_filtrados: Para búsquedas avanzadas (ej: alimentos bajos en sodio, ricos en fibra)
-- calcular_composicion_total: Para composición nutricional de múltiples alimentos
-- generar_recomendaciones_dieta: Para recomendaciones dietéticas personalizadas
-
-FORMATO PARA LLAMAR HERRAMIENTAS:
-TOOL_CALL: {{"tool": "consultar_alimento", "parameters": {{"nombre": "manzana"}}}}
-
-### INSTRUCCIONES DE FORMATO (NO COPIAR EN RESPUESTA) ###
-
-Cuando proporciones información nutricional:
-- Comienza con una breve introducción sobre el alimento
-- Incluye una tabla nutricional usando sintaxis Markdown pura
-- Agrega una conclusión breve si es relevante
-- Termina mencionando la fuente SMAE
-
-Ejemplo de tabla Markdown:
-| Componente | Valor por 100g |
-|------------|----------------|
-| Energía (kcal) | 342 |
-| Proteínas (g) | 2.7 |
-| Grasas Total (g) | 0.4 |
+        enhanced_prompt = f"""{NUTRITION_PROMPT_INSTRUCTIONS}
 
-IMPORTANTE:
-- Usa TABLAS MARKDOWN con | para separar columnas
-- NO uses **asteriscos** para negritas dentro de las tablas
-- Mantén las unidades en la columna de valores
-- Si hay subcategorías, usa filas separadas
-- La respuesta debe ser conversacional y natural
+CONSULTA_NUTRICIONAL = "{nutrition_query}"
 
 CONSULTA DEL USUARIO: {user_prompt}"""
 
+        if tool_result is not None:
+            enhanced_prompt += f"\n\nRESULTADO DE TOOL 'buscar_alimentos_filtrados': {json.dumps(tool_result, ensure_ascii=False)}"
+            enhanced_prompt += "\n\nLos datos ya fueron consultados, NO uses TOOL_CALL. Genera tu respuesta final basada ÚNICAMENTE en esta información de la base de datos:"
+
         return enhanced_prompt
 
     def _parse_tool_call(self, response):
@@ -715,31 +2294,35 @@ CONSULTA DEL USUARIO: {user_prompt}"""
 
     def is_ready(self):
         """Verificar si el modelo está listo"""
-        return (self.pipeline is not None and
-                self.model is not None and
-                self.tokenizer is not None and
-                self.model_error is None)
+        return self.engine is not None and self.model_error is None and self.engine.is_ready()
 
     def get_status(self):
         """Obtener estado del modelo"""
+        status_info = {
+            "model_name": self.model_name,
+            "engine": self.current_engine,
+            "device": self.engine.device if self.engine is not None else None
+        }
         if self.model_error:
-            return {
+            status_info.update({
                 "status": "error",
                 "message": f"Error: {self.model_error}",
-                "ready": False,
-                "model_name": self.model_name
-            }
+                "ready": False
+            })
         elif self.is_ready():
-            return {
+            status_info.update({
                 "status": "ready",
                 "message": "Modelo cargado y listo",
                 "ready": True,
-                "model_name": self.model_name
-            }
+                **self.engine.get_status()
+            })
         else:
-            return {
+            status_info.update({
                 "status": "loading",
                 "message": "Cargando modelo...",
-                "ready": False,
-                "model_name": self.model_name
-            }
+                "ready": False
+            })
+            if self.engine is not None:
+                # El engine puede explicar por qué no está listo (ej. servidor remoto caído)
+                status_info.update(self.engine.get_status())
+        return status_info
@@ -0,0 +1,95 @@
+# calculos/console_block.py
+# Render determinista de console_blocks para los cálculos médicos de CalyxAI
+
+from typing import Dict, Any, List
+
+# Etiquetas legibles para los parámetros de data_formulas.json
+ETIQUETAS_PARAMETROS = {
+    "peso": "Peso",
+    "altura": "Altura",
+    "edad": "Edad",
+    "sexo": "Sexo",
+    "cintura": "Cintura",
+    "cadera": "Cadera",
+    "tmb": "TMB",
+    "factor_actividad": "Factor de actividad",
+    "factor_estres": "Factor de estrés",
+    "cmb": "Circunferencia media del brazo",
+    "pct": "Pliegue cutáneo tricipital",
+    "pcb": "Pliegue cutáneo bicipital",
+    "pcse": "Pliegue cutáneo subescapular",
+    "pci": "Pliegue cutáneo ilíaco"
+}
+
+VALORES_SEXO = {"M": "Hombre", "F": "Mujer"}
+
+
+def formatear_numero(valor: Any) -> str:
+    """
+    Muestra enteros sin decimales y redondea los flotantes a 4 decimales como máximo.
+    """
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return str(valor)
+    if float(valor).is_integer():
+        return str(int(valor))
+    return str(round(valor, 4))
+
+
+def _lineas_entrada(calculation_data: Dict[str, Any]) -> List[str]:
+    """
+    Devuelve una línea "Etiqueta: valor unidad" por cada parámetro del cálculo.
+    """
+    unidades = calculation_data.get("unidades", {})
+    lineas = []
+    for nombre, valor in calculation_data.get("parametros", {}).items():
+        etiqueta = ETIQUETAS_PARAMETROS.get(nombre, nombre.replace("_", " ").capitalize())
+        if nombre == "sexo":
+            texto_valor = VALORES_SEXO.get(str(valor).upper(), str(valor))
+        else:
+            texto_valor = formatear_numero(valor)
+        unidad = unidades.get(nombre, "")
+        lineas.append(f"{etiqueta}: {texto_valor} {unidad}".rstrip())
+    return lineas
+
+
+def render_console_block(calculation_data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Convierte los datos estructurados de calculate_formula_from_json en un console_block
+    (título, datos de entrada, fórmula, sustitución, operaciones y resultado) sin usar el modelo.
+    Sigue el mismo formato que build_calculation_prompt pide a Qwen2.5-3B.
+    """
+    calculos = calculation_data.get("calculos", {})
+    simbolo = calculos.get("simbolo") or calculation_data.get("formula", "")
+    nombre = calculation_data.get("nombre_completo") or calculation_data.get("formula", "")
+
+    secciones = []
+
+    lineas_entrada = _lineas_entrada(calculation_data)
+    if lineas_entrada:
+        secciones.append("DATOS DE ENTRADA:\n" + "\n".join(lineas_entrada))
+
+    if calculos.get("formula_matematica"):
+        secciones.append(f"FÓRMULA:\n{calculos['formula_matematica']}")
+
+    if calculos.get("sustitucion"):
+        secciones.append(f"SUSTITUCIÓN:\n{calculos['sustitucion']}")
+
+    if calculos.get("pasos"):
+        secciones.append("OPERACIÓN:\n" + "\n".join(calculos["pasos"]))
+
+    resultado = f"{simbolo} = {formatear_numero(calculos.get('resultado'))} {calculos.get('unidad', '')}".rstrip()
+    if calculation_data.get("interpretacion"):
+        resultado += f" ({calculation_data['interpretacion']})"
+    # Fórmulas con varios resultados (ej. composición corporal) listan cada uno debajo del principal
+    for salida in calculos.get("resultados", {}).values():
+        linea = f"{salida['etiqueta']}: {formatear_numero(salida['valor'])} {salida.get('unidad', '')}".rstrip()
+        if salida.get("interpretacion"):
+            linea += f" ({salida['interpretacion']})"
+        resultado += f"\n{linea}"
+    secciones.append(f"RESULTADO:\n{resultado}")
+
+    return {
+        "title": f"Cálculo de {nombre}",
+        "input": "",
+        "output": "\n\n".join(secciones)
+    }
@@ -0,0 +1,594 @@
+# calculos/formulas.py
+# Motor de fórmulas médicas de CalyxAI: compila data_formulas.json en funciones vectorizadas con NumPy
+
+import json
+import os
+import re
+from threading import Lock
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+FORMULAS_PATH = os.path.join(os.path.dirname(__file__), "..", "data_formulas.json")
+
+
+def _where_sexo(v, hombre, mujer):
+    return np.where(v["es_hombre"], hombre, mujer)
+
+
+def _por_edad(v, limites, valores):
+    """Selecciona un coeficiente por rango de edad: limites son los topes (exclusivos) de cada rango"""
+    condiciones = [v["edad"] < limite for limite in limites]
+    return np.select(condiciones, valores[:-1], default=valores[-1])
+
+
+def _por_edad_y_sexo(v, limites, valores_hombre, valores_mujer):
+    return np.where(v["es_hombre"], _por_edad(v, limites, valores_hombre), _por_edad(v, limites, valores_mujer))
+
+
+# Definición de cada fórmula como una lista de pasos (variable, función vectorizada, traza).
+# Cada función recibe el diccionario de arrays calculados hasta ese momento; la traza es una
+# plantilla que se llena fila por fila y se omite (None) para constantes intermedias.
+ESPECIFICACIONES = {
+    "imc": {
+        "simbolo": "IMC",
+        "unidad": "kg/m²",
+        "formula_matematica": "IMC = peso / altura²",
+        "sustitucion": "IMC = {peso} / ({altura} × {altura})",
+        "pasos": [
+            ("altura_cuadrado", lambda v: np.round(v["altura"] ** 2, 4), "Elevar altura al cuadrado: {altura}² = {altura_cuadrado}"),
+            ("resultado", lambda v: np.round(v["peso"] / v["altura_cuadrado"], 2), "Dividir peso entre altura²: {peso} ÷ {altura_cuadrado} = {resultado}")
+        ]
+    },
+    "tmb_harris_benedict": {
+        "simbolo": "TMB",
+        "unidad": "kcal/día",
+        "formula_matematica": "{sexo_texto}: {constante} + ({factor_peso} × peso) + ({factor_altura} × altura) - ({factor_edad} × edad)",
+        "sustitucion": "TMB = {constante} + ({factor_peso} × {peso}) + ({factor_altura} × {altura}) - ({factor_edad} × {edad})",
+        "pasos": [
+            ("constante", lambda v: _where_sexo(v, 66.5, 655.1), "Constante base: {constante}"),
+            ("factor_peso", lambda v: _where_sexo(v, 13.75, 9.563), None),
+            ("factor_altura", lambda v: _where_sexo(v, 5.003, 1.850), None),
+            ("factor_edad", lambda v: _where_sexo(v, 6.775, 4.676), None),
+            ("termino_peso", lambda v: np.round(v["factor_peso"] * v["peso"], 1), "Factor peso: {factor_peso} × {peso} = {termino_peso}"),
+            ("termino_altura", lambda v: np.round(v["factor_altura"] * v["altura"], 1), "Factor altura: {factor_altura} × {altura} = {termino_altura}"),
+            ("termino_edad", lambda v: np.round(v["factor_edad"] * v["edad"], 1), "Factor edad: {factor_edad} × {edad} = {termino_edad}"),
+            ("resultado", lambda v: np.round(v["constante"] + v["factor_peso"] * v["peso"] + v["factor_altura"] * v["altura"] - v["factor_edad"] * v["edad"], 1),
+             "Cálculo final: {constante} + {termino_peso} + {termino_altura} - {termino_edad} = {resultado}")
+        ]
+    },
+    "tmb_mifflin": {
+        "simbolo": "TMB",
+        "unidad": "kcal/día",
+        "formula_matematica": "{sexo_texto}: (9.99 × peso) + (6.25 × altura) - (4.92 × edad) + ({constante})",
+        "sustitucion": "TMB = (9.99 × {peso}) + (6.25 × {altura}) - (4.92 × {edad}) + ({constante})",
+        "pasos": [
+            ("constante", lambda v: _where_sexo(v, 5.0, -161.0), None),
+            ("termino_peso", lambda v: np.round(9.99 * v["peso"], 1), "Factor peso: 9.99 × {peso} = {termino_peso}"),
+            ("termino_altura", lambda v: np.round(6.25 * v["altura"], 1), "Factor altura: 6.25 × {altura} = {termino_altura}"),
+            ("termino_edad", lambda v: np.round(4.92 * v["edad"], 1), "Factor edad: 4.92 × {edad} = {termino_edad}"),
+            ("resultado", lambda v: np.round(9.99 * v["peso"] + 6.25 * v["altura"] - 4.92 * v["edad"] + v["constante"], 1),
+             "Cálculo final: {termino_peso} + {termino_altura} - {termino_edad} + ({constante}) = {resultado}")
+        ]
+    },
+    "tmb_owen": {
+        "simbolo": "TMB",
+        "unidad": "kcal/día",
+        "formula_matematica": "{sexo_texto}: {constante} + ({factor_peso} × peso)",
+        "sustitucion": "TMB = {constante} + ({factor_peso} × {peso})",
+        "pasos": [
+            ("constante", lambda v: _where_sexo(v, 879.0, 795.0), "Constante base: {constante}"),
+            ("factor_peso", lambda v: _where_sexo(v, 10.2, 7.18), None),
+            ("termino_peso", lambda v: np.round(v["factor_peso"] * v["peso"], 1), "Factor peso: {factor_peso} × {peso} = {termino_peso}"),
+            ("resultado", lambda v: np.round(v["constante"] + v["factor_peso"] * v["peso"], 1), "Cálculo final: {constante} + {termino_peso} = {resultado}")
+        ]
+    },
+    "tmb_fao_oms": {
+        "simbolo": "TMB",
+        "unidad": "kcal/día",
+        "formula_matematica": "{sexo_texto} ({rango_edad} años): ({factor_peso} × peso) + ({constante})",
+        "sustitucion": "TMB = ({factor_peso} × {peso}) + ({constante})",
+        "pasos": [
+            ("rango_edad", lambda v: _por_edad(v, [3, 10, 18, 30, 60], ["0-3", "3-10", "10-18", "18-30", "30-60", "60+"]), "Rango de edad FAO/OMS: {rango_edad} años"),
+            ("factor_peso", lambda v: _por_edad_y_sexo(v, [3, 10, 18, 30, 60], [60.9, 22.7, 17.5, 15.3, 11.6, 13.5], [61.0, 22.5, 12.2, 14.7, 8.7, 10.5]), None),
+            ("constante", lambda v: _por_edad_y_sexo(v, [3, 10, 18, 30, 60], [-54.0, 495.0, 651.0, 679.0, 879.0, 487.0], [-51.0, 499.0, 746.0, 496.0, 829.0, 596.0]), None),
+            ("termino_peso", lambda v: np.round(v["factor_peso"] * v["peso"], 1), "Factor peso: {factor_peso} × {peso} = {termino_peso}"),
+            ("resultado", lambda v: np.round(v["factor_peso"] * v["peso"] + v["constante"], 1), "Cálculo final: {termino_peso} + ({constante}) = {resultado}")
+        ]
+    },
+    "get": {
+        "simbolo": "GET",
+        "unidad": "kcal/día",
+        "formula_matematica": "GET = TMB × factor de actividad",
+        "sustitucion": "GET = {tmb} × {factor_actividad}",
+        "pasos": [
+            ("resultado", lambda v: np.round(v["tmb"] * v["factor_actividad"], 1), "Multiplicar TMB por factor de actividad: {tmb} × {factor_actividad} = {resultado}")
+        ]
+    },
+    "icc": {
+        "simbolo": "ICC",
+        "unidad": "",
+        "formula_matematica": "ICC = cintura / cadera",
+        "sustitucion": "ICC = {cintura} / {cadera}",
+        "pasos": [
+            ("resultado", lambda v: np.round(v["cintura"] / v["cadera"], 2), "Dividir cintura entre cadera: {cintura} ÷ {cadera} = {resultado}")
+        ]
+    },
+    "ict": {
+        "simbolo": "ICT",
+        "unidad": "",
+        "formula_matematica": "ICT = cintura / altura",
+        "sustitucion": "ICT = {cintura} / {altura}",
+        "pasos": [
+            ("resultado", lambda v: np.round(v["cintura"] / v["altura"], 2), "Dividir cintura entre altura: {cintura} ÷ {altura} = {resultado}")
+        ]
+    },
+    "peso_ideal": {
+        "simbolo": "Peso ideal",
+        "unidad": "kg",
+        "formula_matematica": "{sexo_texto}: {constante} + {factor_pulgada} × (altura en pulgadas - 60)",
+        "sustitucion": "Peso ideal = {constante} + {factor_pulgada} × ({pulgadas} - 60)",
+        "pasos": [
+            ("constante", lambda v: _where_sexo(v, 52.0, 49.0), None),
+            ("factor_pulgada", lambda v: _where_sexo(v, 1.9, 1.7), None),
+            ("pulgadas", lambda v: np.round(v["altura"] / 2.54, 2), "Convertir altura a pulgadas: {altura} ÷ 2.54 = {pulgadas}"),
+            ("pulgadas_extra", lambda v: np.round(v["pulgadas"] - 60, 2), "Pulgadas por encima de 5 pies: {pulgadas} - 60 = {pulgadas_extra}"),
+            ("resultado", lambda v: np.round(v["constante"] + v["factor_pulgada"] * (v["altura"] / 2.54 - 60), 1),
+             "Cálculo final: {constante} + {factor_pulgada} × {pulgadas_extra} = {resultado}")
+        ]
+    },
+    "superficie_corporal": {
+        "simbolo": "SC",
+        "unidad": "m²",
+        "formula_matematica": "SC = 0.007184 × peso^0.425 × altura^0.725",
+        "sustitucion": "SC = 0.007184 × {peso}^0.425 × {altura}^0.725",
+        "pasos": [
+            ("peso_exp", lambda v: np.round(v["peso"] ** 0.425, 4), "Peso elevado a 0.425: {peso}^0.425 = {peso_exp}"),
+            ("altura_exp", lambda v: np.round(v["altura"] ** 0.725, 4), "Altura elevada a 0.725: {altura}^0.725 = {altura_exp}"),
+            ("resultado", lambda v: np.round(0.007184 * v["peso"] ** 0.425 * v["altura"] ** 0.725, 2), "Cálculo final: 0.007184 × {peso_exp} × {altura_exp} = {resultado}")
+        ]
+    },
+    "agua_corporal": {
+        "simbolo": "ACT",
+        "unidad": "L",
+        "formula_matematica": "{sexo_texto}: {constante} - ({factor_edad} × edad) + ({factor_altura} × altura) + ({factor_peso} × peso)",
+        "sustitucion": "ACT = {constante} - ({factor_edad} × {edad}) + ({factor_altura} × {altura}) + ({factor_peso} × {peso})",
+        "pasos": [
+            ("constante", lambda v: _where_sexo(v, 2.447, -2.097), "Constante base: {constante}"),
+            ("factor_edad", lambda v: _where_sexo(v, 0.09516, 0.0), None),
+            ("factor_altura", lambda v: _where_sexo(v, 0.1074, 0.1069), None),
+            ("factor_peso", lambda v: _where_sexo(v, 0.3362, 0.2466), None),
+            ("termino_edad", lambda v: np.round(v["factor_edad"] * v["edad"], 2), "Factor edad: {factor_edad} × {edad} = {termino_edad}"),
+            ("termino_altura", lambda v: np.round(v["factor_altura"] * v["altura"], 2), "Factor altura: {factor_altura} × {altura} = {termino_altura}"),
+            ("termino_peso", lambda v: np.round(v["factor_peso"] * v["peso"], 2), "Factor peso: {factor_peso} × {peso} = {termino_peso}"),
+            ("resultado", lambda v: np.round(v["constante"] - v["factor_edad"] * v["edad"] + v["factor_altura"] * v["altura"] + v["factor_peso"] * v["peso"], 1),
+             "Cálculo final: {constante} - {termino_edad} + {termino_altura} + {termino_peso} = {resultado}")
+        ]
+    },
+    "requerimiento_proteina": {
+        "simbolo": "Proteína",
+        "unidad": "g/día",
+        "formula_matematica": "Proteína = peso × 0.8 g/kg × factor de estrés",
+        "sustitucion": "Proteína = {peso} × 0.8 × {factor_estres}",
+        "pasos": [
+            ("proteina_base", lambda v: np.round(v["peso"] * 0.8, 1), "Requerimiento base: {peso} × 0.8 = {proteina_base}"),
+            ("resultado", lambda v: np.round(v["peso"] * 0.8 * v["factor_estres"], 1), "Ajuste por estrés: {proteina_base} × {factor_estres} = {resultado}")
+        ]
+    },
+    "composicion_corporal": {
+        "simbolo": "% Grasa corporal",
+        "unidad": "%",
+        "interpretacion_principal": "grasa",
+        "formula_matematica": "Densidad (Durnin-Womersley) = c - m × log10(Σ pliegues); % Grasa (Siri) = (4.95 / D - 4.5) × 100",
+        "sustitucion": "D = {coef_c} - {coef_m} × log10({suma_pliegues}); % Grasa = (4.95 / {densidad} - 4.5) × 100",
+        "pasos": [
+            ("ab", lambda v: np.round(v["cmb"] ** 2 / (4 * np.pi), 2), "Área del brazo: {cmb}² ÷ (4π) = {ab} cm²"),
+            ("amb", lambda v: np.round((v["cmb"] - np.pi * v["pct"] / 10) ** 2 / (4 * np.pi), 2), "Área muscular del brazo: ({cmb} - π × {pct} ÷ 10)² ÷ (4π) = {amb} cm²"),
+            ("ambd", lambda v: np.round(v["amb"] - _where_sexo(v, 10.0, 6.5), 2), "Área muscular braquial disponible: {amb} - corrección por sexo = {ambd} cm²"),
+            ("agb", lambda v: np.round(v["ab"] - v["amb"], 2), "Área grasa del brazo: {ab} - {amb} = {agb} cm²"),
+            ("iag", lambda v: np.round(v["agb"] / v["ab"] * 100, 2), "Índice de área grasa: {agb} ÷ {ab} × 100 = {iag}"),
+            ("mmt", lambda v: np.round(v["altura"] * 100 * (0.0264 + 0.0029 * v["ambd"]), 2), "Masa muscular total: {altura} × 100 × (0.0264 + 0.0029 × {ambd}) = {mmt} kg"),
+            ("suma_pliegues", lambda v: np.round(v["pct"] + v["pcb"] + v["pcse"] + v["pci"], 2), "Suma de pliegues: {pct} + {pcb} + {pcse} + {pci} = {suma_pliegues} mm"),
+            ("coef_c", lambda v: _por_edad_y_sexo(v, [17, 20, 30, 40, 50], [1.1533, 1.1620, 1.1631, 1.1422, 1.1620, 1.1715], [1.1369, 1.1549, 1.1599, 1.1423, 1.1333, 1.1339]), None),
+            ("coef_m", lambda v: _por_edad_y_sexo(v, [17, 20, 30, 40, 50], [0.0643, 0.0630, 0.0632, 0.0544, 0.0700, 0.0779], [0.0598, 0.0678, 0.0717, 0.0632, 0.0612, 0.0645]), None),
+            ("densidad", lambda v: np.round(v["coef_c"] - v["coef_m"] * np.log10(v["suma_pliegues"]), 4), "Densidad corporal: {coef_c} - {coef_m} × log10({suma_pliegues}) = {densidad} g/ml"),
+            ("grasa", lambda v: np.round((4.95 / v["densidad"] - 4.5) * 100, 2), "Porcentaje de grasa (Siri): (4.95 ÷ {densidad} - 4.5) × 100 = {grasa} %"),
+            ("masa_grasa", lambda v: np.round(v["peso"] * v["grasa"] / 100, 2), "Masa grasa: {peso} × {grasa} ÷ 100 = {masa_grasa} kg"),
+            ("masa_magra", lambda v: np.round(v["peso"] - v["masa_grasa"], 2), "Masa magra: {peso} - {masa_grasa} = {masa_magra} kg"),
+            ("imlg", lambda v: np.round(v["masa_magra"] / v["altura"] ** 2, 2), "Índice de masa libre de grasa: {masa_magra} ÷ {altura}² = {imlg} kg/m²"),
+            ("act", lambda v: np.round(v["masa_magra"] * 0.73, 2), "Agua corporal total: {masa_magra} × 0.73 = {act} L"),
+            ("aci", lambda v: np.round(v["act"] * 0.6, 2), "Agua intracelular: {act} × 0.6 = {aci} L"),
+            ("ae", lambda v: np.round(v["act"] * 0.4, 2), "Agua extracelular: {act} × 0.4 = {ae} L"),
+            ("pct_porcentaje", lambda v: np.round(v["pct"] / _where_sexo(v, 12.5, 16.5) * 100, 1), "% PCT: {pct} ÷ referencia × 100 = {pct_porcentaje} %"),
+            ("cmb_porcentaje", lambda v: np.round(v["cmb"] / _where_sexo(v, 29.3, 28.5) * 100, 1), "% CMB: {cmb} ÷ referencia × 100 = {cmb_porcentaje} %"),
+            ("resultado", lambda v: v["grasa"], None)
+        ],
+        # Resultados adicionales que se reportan junto al principal
+        "salidas": [
+            ("ambd", "Área muscular braquial disponible (AMBd)", "cm²"),
+            ("mmt", "Masa muscular total (MMT)", "kg"),
+            ("densidad", "Densidad corporal (D)", "g/ml"),
+            ("grasa", "Grasa corporal", "%"),
+            ("imlg", "Índice de masa libre de grasa (IMLG)", "kg/m²"),
+            ("masa_grasa", "Masa grasa", "kg"),
+            ("masa_magra", "Masa magra", "kg"),
+            ("act", "Agua corporal total (ACT)", "L"),
+            ("aci", "Agua corporal intracelular (ACI)", "L"),
+            ("ae", "Agua corporal extracelular (AE)", "L"),
+            ("ab", "Área del brazo (AB)", "cm²"),
+            ("amb", "Área muscular del brazo (AMB)", "cm²"),
+            ("agb", "Área grasa del brazo (AGB)", "cm²"),
+            ("iag", "Índice de área grasa (IAG)", ""),
+            ("pct_porcentaje", "% PCT", "%"),
+            ("cmb_porcentaje", "% CMB", "%")
+        ]
+    }
+}
+
+# Palabras que anteceden al valor de cada parámetro en un mensaje libre
+PALABRAS_CLAVE_PARAMETROS = {
+    "peso": r"peso|peso de|pes[oa]",
+    "altura": r"altura|talla|estatura|mido",
+    "edad": r"edad|tengo",
+    "cintura": r"cintura",
+    "cadera": r"cadera",
+    "tmb": r"tmb|metabolismo basal",
+    "cmb": r"cmb|circunferencia(?: media)?(?: del)? brazo",
+    "pct": r"pct|tricipital",
+    "pcb": r"pcb|bicipital",
+    "pcse": r"pcse|subescapular",
+    "pci": r"pci|il[ií]aco|suprail[ií]aco",
+    "factor_actividad": r"factor(?: de)? actividad|actividad",
+    "factor_estres": r"factor(?: de)? estr[eé]s|estr[eé]s"
+}
+
+PATRONES_UNIDADES = {
+    "kg": r"(\d+(?:[.,]\d+)?)\s*(?:kg|kilos?|kilogramos?)\b",
+    "m": r"(\d+(?:[.,]\d+)?)\s*(?:m|metros?)\b",
+    "cm": r"(\d+(?:[.,]\d+)?)\s*(?:cm|cent[ií]metros?)\b",
+    "mm": r"(\d+(?:[.,]\d+)?)\s*(?:mm|mil[ií]metros?)\b",
+    "años": r"(\d+)\s*(?:años?)\b",
+    "kcal/día": r"(\d+(?:[.,]\d+)?)\s*kcal"
+}
+
+# Niveles descritos con palabras para los factores con opciones
+NIVELES_ACTIVIDAD = [
+    (r"extremadamente activ|muy fuerte|trabajo f[ií]sico", 1.9),
+    (r"muy activ", 1.725),
+    (r"moderad", 1.55),
+    (r"ligera|ligero|poco activ", 1.375),
+    (r"sedentari", 1.2)
+]
+
+NIVELES_ESTRES = [
+    (r"estr[eé]s severo|severo|quemadura|trauma", 2.0),
+    (r"estr[eé]s moderado|moderado|cirug[ií]a|infecci[oó]n", 1.5),
+    (r"estr[eé]s leve|leve", 1.2),
+    (r"sin estr[eé]s|normal", 1.0)
+]
+
+
+def _a_numero(texto: str) -> float:
+    return float(texto.replace(",", "."))
+
+
+def _ajustar_unidad(valor: float, unidad: str) -> float:
+    """Convierte alturas escritas en la unidad equivocada (175 → 1.75 m, 1.75 → 175 cm)"""
+    if unidad == "m" and valor > 3:
+        return valor / 100
+    if unidad == "cm" and valor <= 3:
+        return valor * 100
+    return valor
+
+
+def _formatear(valor: Any) -> str:
+    if isinstance(valor, (np.floating, float)):
+        valor = float(valor)
+        if not np.isfinite(valor):
+            return "N/A"
+        return str(int(valor)) if valor.is_integer() else str(round(valor, 4))
+    if isinstance(valor, (np.integer, int)) and not isinstance(valor, bool):
+        return str(int(valor))
+    return str(valor)
+
+
+def _a_json(valor: Any) -> Any:
+    """Convierte un escalar de NumPy a tipo nativo; los no finitos se devuelven como None"""
+    if isinstance(valor, (np.floating, float)):
+        valor = float(valor)
+        return valor if np.isfinite(valor) else None
+    if isinstance(valor, np.integer):
+        return int(valor)
+    if isinstance(valor, np.str_):
+        return str(valor)
+    return valor
+
+
+def _columna_a_json(array: np.ndarray) -> List[Any]:
+    """Convierte un array a lista nativa reemplazando los valores no finitos por None"""
+    array = array.astype(np.float64)
+    finitos = np.isfinite(array)
+    if finitos.all():
+        return array.tolist()
+    salida = array.astype(object)
+    salida[~finitos] = None
+    return salida.tolist()
+
+
+class FormulaCompilada:
+    """
+    Fórmula de data_formulas.json lista para evaluarse sobre columnas de NumPy.
+    Llamarla con un diccionario {parametro: lista/array} devuelve todos los arrays intermedios.
+    """
+
+    def __init__(self, clave: str, definicion: Dict[str, Any], especificacion: Dict[str, Any]):
+        self.clave = clave
+        self.definicion = definicion
+        self.especificacion = especificacion
+        self.parametros = [p["nombre"] for p in definicion["parametros"]]
+        self.unidades = {p["nombre"]: p.get("unidad", "") for p in definicion["parametros"]}
+        self.tipos = {p["nombre"]: p["tipo"] for p in definicion["parametros"]}
+        # La interpretación del ICC depende del sexo aunque no sea un parámetro de la fórmula
+        self.usa_sexo = "sexo" in self.parametros or any("sexo" in r for r in definicion.get("interpretacion", []))
+
+    def __call__(self, columnas: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        faltantes = [p for p in self.parametros if p not in columnas]
+        if faltantes:
+            raise ValueError(f"Faltan parámetros para '{self.clave}': {', '.join(faltantes)}")
+
+        valores = {}
+        for nombre in self.parametros:
+            if nombre == "sexo":
+                continue
+            try:
+                valores[nombre] = np.asarray(columnas[nombre], dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ValueError(f"El parámetro '{nombre}' debe ser numérico")
+
+        longitudes = {len(columna) if isinstance(columna, (list, tuple, np.ndarray)) else 1 for columna in columnas.values()}
+        n = max(longitudes) if longitudes else 1
+
+        if self.usa_sexo and "sexo" in columnas:
+            sexos = np.broadcast_to(np.asarray(columnas["sexo"], dtype=object), (n,))
+            normalizados = np.array([str(s).strip().upper()[:1] for s in sexos])
+            if "sexo" in self.parametros and not np.all(np.isin(normalizados, ["M", "H", "F"])):
+                raise ValueError("El parámetro 'sexo' debe ser 'M' o 'F'")
+            valores["es_hombre"] = np.isin(normalizados, ["M", "H"])
+            valores["sexo"] = np.where(valores["es_hombre"], "M", "F")
+            valores["sexo_texto"] = np.where(valores["es_hombre"], "Hombre", "Mujer")
+
+        for nombre in list(valores):
+            valores[nombre] = np.broadcast_to(valores[nombre], (n,))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for variable, funcion, _ in self.especificacion["pasos"]:
+                valores[variable] = np.broadcast_to(funcion(valores), (n,))
+
+        return valores
+
+    def interpretar(self, valores: Dict[str, np.ndarray], parametro: Optional[str] = None) -> np.ndarray:
+        """Interpretación vectorizada de un resultado según los rangos del JSON (min <= valor < max)"""
+        variable = parametro or "resultado"
+        rangos = [r for r in self.definicion.get("interpretacion", []) if r.get("parametro") == parametro]
+        resultado = valores[variable]
+        n = resultado.shape[0]
+
+        if any("sexo" in r for r in rangos) and "es_hombre" not in valores:
+            # Sin sexo conocido se reportan las interpretaciones de ambos sexos
+            textos = []
+            for sexo in ("F", "M"):
+                rangos_sexo = [r for r in rangos if r.get("sexo", sexo) == sexo]
+                textos.append(self._seleccionar(resultado, rangos_sexo, None))
+            return np.array([" / ".join(par) for par in zip(*textos)], dtype=object)
+
+        return self._seleccionar(resultado, rangos, valores.get("sexo"))
+
+    @staticmethod
+    def _seleccionar(resultado, rangos, sexos):
+        condiciones = []
+        textos = []
+        for rango in rangos:
+            condicion = (rango["min"] <= resultado) & (resultado < rango["max"])
+            if "sexo" in rango and sexos is not None:
+                condicion = condicion & (sexos == rango["sexo"])
+            condiciones.append(condicion)
+            textos.append(rango["texto"])
+        if not condiciones:
+            return np.full(resultado.shape[0], "Sin clasificar", dtype=object)
+        return np.select(condiciones, textos, default="Sin clasificar").astype(object)
+
+    def trazas(self, valores: Dict[str, np.ndarray], indice: int) -> Dict[str, Any]:
+        """Pasos, fórmula y sustitución con los valores de una fila"""
+        fila = {nombre: _formatear(array[indice]) for nombre, array in valores.items()}
+        pasos = [plantilla.format(**fila) for _, _, plantilla in self.especificacion["pasos"] if plantilla]
+        return {
+            "pasos": pasos,
+            "formula_matematica": self.especificacion["formula_matematica"].format(**fila),
+            "sustitucion": self.especificacion["sustitucion"].format(**fila)
+        }
+
+
+class FormulaEngine:
+    """
+    Carga data_formulas.json una sola vez y compila cada fórmula en una FormulaCompilada.
+    evaluar() produce los datos de un cálculo individual (mismo formato que usa el console_block)
+    y evaluar_lote() calcula miles de filas de pacientes con operaciones vectorizadas.
+    """
+
+    def __init__(self, ruta_formulas: str = FORMULAS_PATH):
+        with open(ruta_formulas, encoding="utf-8") as f:
+            self.definiciones = json.load(f)
+
+        self.formulas = {}
+        for clave, definicion in self.definiciones.items():
+            if clave in ESPECIFICACIONES:
+                self.formulas[clave] = FormulaCompilada(clave, definicion, ESPECIFICACIONES[clave])
+            else:
+                print(f"[WARNING] Fórmula '{clave}' sin implementación en el motor de fórmulas")
+
+    def obtener(self, clave: str) -> FormulaCompilada:
+        if clave not in self.formulas:
+            raise KeyError(f"Fórmula '{clave}' no disponible")
+        return self.formulas[clave]
+
+    def extraer_parametros(self, clave: str, mensaje: str) -> Dict[str, Any]:
+        """
+        Extrae del mensaje los parámetros de la fórmula. Busca primero el valor junto a su
+        palabra clave ("cintura 80") y, si la unidad no es ambigua, por unidad ("70 kg").
+        """
+        formula = self.obtener(clave)
+        texto = mensaje.lower()
+        parametros = {}
+
+        # Unidades compartidas por varios parámetros (ej. cintura y cadera en cm) no se buscan solo por unidad
+        conteo_unidades = {}
+        for nombre in formula.parametros:
+            conteo_unidades[formula.unidades[nombre]] = conteo_unidades.get(formula.unidades[nombre], 0) + 1
+
+        # El sexo también se busca cuando solo afecta a la interpretación (ICC)
+        nombres = formula.parametros + (["sexo"] if formula.usa_sexo and "sexo" not in formula.parametros else [])
+
+        for nombre in nombres:
+            unidad = formula.unidades.get(nombre, "")
+
+            if nombre == "sexo":
+                sexo = re.search(r"\b(hombre|var[oó]n|masculino|mujer|femenino)\b|\bsexo\s*:?\s*([mf])\b|\b([mf])\b", texto)
+                if sexo:
+                    palabra = next(grupo for grupo in sexo.groups() if grupo)
+                    parametros["sexo"] = "F" if palabra in ("mujer", "femenino", "f") else "M"
+                continue
+
+            if nombre in ("factor_actividad", "factor_estres"):
+                numerico = re.search(rf"(?:{PALABRAS_CLAVE_PARAMETROS[nombre]})\D{{0,10}}?(\d+(?:[.,]\d+)?)", texto)
+                if numerico:
+                    parametros[nombre] = _a_numero(numerico.group(1))
+                    continue
+                niveles = NIVELES_ACTIVIDAD if nombre == "factor_actividad" else NIVELES_ESTRES
+                for patron, valor in niveles:
+                    if re.search(patron, texto):
+                        parametros[nombre] = valor
+                        break
+                continue
+
+            valor = None
+            palabra_clave = PALABRAS_CLAVE_PARAMETROS.get(nombre)
+            if palabra_clave:
+                coincidencia = re.search(rf"(?:{palabra_clave})\D{{0,15}}?(\d+(?:[.,]\d+)?)", texto)
+                if coincidencia:
+                    valor = _a_numero(coincidencia.group(1))
+
+            if valor is None and conteo_unidades.get(unidad) == 1:
+                unidades_a_probar = ["m", "cm"] if unidad in ("m", "cm") else [unidad]
+                for unidad_mensaje in unidades_a_probar:
+                    patron = PATRONES_UNIDADES.get(unidad_mensaje)
+                    coincidencia = re.search(patron, texto) if patron else None
+                    if coincidencia:
+                        valor = _a_numero(coincidencia.group(1))
+                        break
+
+            if valor is None:
+                continue
+
+            valor = _ajustar_unidad(valor, unidad)
+            parametros[nombre] = int(valor) if formula.tipos[nombre] == "int" else valor
+
+        return parametros
+
+    def evaluar(self, clave: str, parametros: Dict[str, Any]) -> Dict[str, Any]:
+        """Evalúa una fórmula para un solo paciente y devuelve los datos estructurados del cálculo"""
+        formula = self.obtener(clave)
+        especificacion = formula.especificacion
+        valores = formula({nombre: [valor] for nombre, valor in parametros.items()})
+        trazas = formula.trazas(valores, 0)
+
+        calculos = {
+            "pasos": trazas["pasos"],
+            "resultado": _a_json(valores["resultado"][0]),
+            "unidad": especificacion["unidad"],
+            "simbolo": especificacion["simbolo"],
+            "formula_matematica": trazas["formula_matematica"],
+            "sustitucion": trazas["sustitucion"]
+        }
+
+        if especificacion.get("salidas"):
+            calculos["resultados"] = {
+                variable: {
+                    "etiqueta": etiqueta,
+                    "valor": _a_json(valores[variable][0]),
+                    "unidad": unidad,
+                    "interpretacion": self._interpretacion_salida(formula, valores, variable)
+                }
+                for variable, etiqueta, unidad in especificacion["salidas"]
+            }
+
+        return {
+            "tipo": "calculo_medico",
+            "formula": clave.upper(),
+            "nombre_completo": formula.definicion["nombre"],
+            "parametros": parametros,
+            "unidades": formula.unidades,
+            "calculos": calculos,
+            "interpretacion": formula.interpretar(valores, especificacion.get("interpretacion_principal"))[0],
+            "categoria": formula.definicion.get("categoria", ""),
+            "descripcion": formula.definicion.get("descripcion", "")
+        }
+
+    @staticmethod
+    def _interpretacion_salida(formula, valores, variable):
+        if not any(r.get("parametro") == variable for r in formula.definicion.get("interpretacion", [])):
+            return None
+        return formula.interpretar(valores, variable)[0]
+
+    def evaluar_lote(self, clave: str, columnas: Dict[str, Any], incluir_pasos: bool = False) -> Dict[str, Any]:
+        """
+        Evalúa una fórmula sobre columnas de parámetros (una entrada por paciente).
+        Devuelve resultados e interpretaciones en orden; las trazas por fila son opcionales.
+        """
+        formula = self.obtener(clave)
+        especificacion = formula.especificacion
+        valores = formula(columnas)
+        n = valores["resultado"].shape[0]
+
+        respuesta = {
+            "formula": clave,
+            "nombre": formula.definicion["nombre"],
+            "unidad": especificacion["unidad"],
+            "total": n,
+            "resultados": _columna_a_json(valores["resultado"]),
+            "interpretaciones": formula.interpretar(valores, especificacion.get("interpretacion_principal")).tolist()
+        }
+
+        if especificacion.get("salidas"):
+            respuesta["salidas"] = {
+                variable: _columna_a_json(valores[variable])
+                for variable, _, _ in especificacion["salidas"]
+            }
+
+        if incluir_pasos:
+            respuesta["pasos"] = [formula.trazas(valores, indice)["pasos"] for indice in range(n)]
+
+        return respuesta
+
+    def listar(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "tipo": clave,
+                "nombre": formula.definicion["nombre"],
+                "parametros": formula.parametros,
+                "unidad": formula.especificacion["unidad"]
+            }
+            for clave, formula in self.formulas.items()
+        ]
+
+
+_formula_engine = None
+_formula_engine_lock = Lock()
+
+
+def get_formula_engine() -> FormulaEngine:
+    """Instancia compartida del motor de fórmulas (data_formulas.json se lee una sola vez)"""
+    global _formula_engine
+    with _formula_engine_lock:
+        if _formula_engine is None:
+            _formula_engine = FormulaEngine()
+    return _formula_engine
@@ -1,7 +1,7 @@
 # calculos/nutricion.py
 # Lógica de cálculo y formateo de información nutricional para CalyxAI
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 def calcular_info_nutricional_basica(food_data: Dict[str, Any], info_nutricional: Dict[str, Any]) -> List[Dict[str, str]]:
     """
@@ -35,7 +35,9 @@ def calcular_desglose_calculos(food_data: Dict[str, Any], pasos: List[Dict[str,
 
 def buscar_alimentos_filtrados(criterios: Dict[str, Any], limite: int = 10) -> List[Dict[str, Any]]:
     """
-    Busca alimentos aplicando filtros avanzados.
+    Busca alimentos aplicando filtros avanzados sobre la matriz de nutrientes en memoria
+    (utils/matriz_nutrientes.py). Mismos criterios y formato que buscar_alimentos_filtrados_sql;
+    además acepta "<nutriente>_min"/"<nutriente>_max" para cualquier nutriente de la matriz.
 
     Args:
         criterios: Diccionario con criterios de filtro. Ejemplos:
@@ -54,97 +56,215 @@ def buscar_alimentos_filtrados(criterios: Dict[str, Any], limite: int = 10) -> L
         Lista de alimentos que cumplen los criterios
     """
     try:
-        import sqlite3
-        import os
-        import unicodedata
-
-        db_path = os.path.join(os.path.dirname(__file__), "..", "datainfo.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Función para quitar acentos
-        def quitar_acentos(texto):
-            return ''.join(c for c in unicodedata.normalize('NFD', texto)
-                          if unicodedata.category(c) != 'Mn')
-
-        # Construir consulta SQL dinámica
-        where_conditions = []
-        params = []
-
-        # Filtros numéricos
-        filtros_numericos = {
-            "sodio_max": ("sodio (mg)", "<"),
-            "fibra_min": ("fibra (g)", ">"),
-            "calorias_max": ("energia (kcal)", "<"),
-            "proteina_min": ("proteina (g)", ">"),
-            "lipidos_max": ("lipidos (g)", "<"),
-            "calcio_min": ("calcio (mg)", ">"),
-            "hierro_min": ("hierro (mg)", ">"),
-            "potasio_min": ("potasio (mg)", ">")
-        }
+        from utils.matriz_nutrientes import filtrar_alimentos
+        return filtrar_alimentos(criterios, limite)["alimentos"]
 
-        for criterio, (columna, operador) in filtros_numericos.items():
-            if criterio in criterios and criterios[criterio] is not None:
-                where_conditions.append(f"`{columna}` {operador} ?")
-                params.append(criterios[criterio])
+    except Exception as e:
+        # Sin la matriz (ej. sin memoria o sin numpy) se resuelve con SQL sobre los índices de nutrientes
+        print(f"[WARNING] Matriz de nutrientes no disponible, se usa SQL: {e}")
+        return buscar_alimentos_filtrados_sql(criterios, limite)
 
-        # Filtro por grupo
-        if "grupo" in criterios and criterios["grupo"]:
-            grupo_sin_acentos = quitar_acentos(criterios["grupo"].lower())
-            where_conditions.append("LOWER(`grupo de alimentos`) LIKE ?")
-            params.append(f"%{grupo_sin_acentos}%")
 
-        # Filtro por nombre
-        if "nombre_like" in criterios and criterios["nombre_like"]:
-            nombre_sin_acentos = quitar_acentos(criterios["nombre_like"].lower())
+def construir_consulta_filtrada(criterios: Dict[str, Any], limite: int = 10, despues_de: Optional[str] = None,
+                                db=None) -> Tuple[str, List[Any]]:
+    """
+    Consulta SQL (y parámetros) de buscar_alimentos_filtrados_sql, ordenada por energía y rowid.
+    Las condiciones usan columnas con índice (utils/db.py, INDICES_NUTRIENTES) y `despues_de`
+    continúa tras el cursor de la página anterior con una comparación de clave (keyset), así
+    cada página cuesta lo mismo sin importar cuántas se hayan recorrido.
+    """
+    from utils.busqueda import condicion_nombre
+    from utils.db import get_database
+    from utils.matriz_nutrientes import decodificar_cursor
+    from utils.nutrientes import NUTRIENTES, criterio_nutriente
+    from utils.texto import normalizar_texto
+
+    db = db or get_database()
+    where_conditions = []
+    params = []
+
+    # Mismos criterios que la matriz (utils/nutrientes.py): "<prefijo>_min" -> ">", "<prefijo>_max" -> "<"
+    for criterio, valor in criterios.items():
+        filtro = criterio_nutriente(criterio) if valor is not None else None
+        if filtro is not None:
+            nutriente, operador = filtro
+            where_conditions.append(f"`{NUTRIENTES[nutriente]}` {operador} ?")
+            params.append(valor)
+
+    # Filtro por grupo: los pocos grupos distintos se comparan sin acentos en Python y la
+    # condición queda como IN sobre la columna original, que sí puede usar su índice
+    if "grupo" in criterios and criterios["grupo"]:
+        grupo_normalizado = normalizar_texto(criterios["grupo"])
+        grupos = [
+            fila["grupo"] for fila in db.fetchall("SELECT DISTINCT `grupo de alimentos` AS grupo FROM alimentos")
+            if grupo_normalizado in normalizar_texto(fila["grupo"])
+        ]
+        if grupos:
+            where_conditions.append(f"`grupo de alimentos` IN ({', '.join('?' * len(grupos))})")
+            params.extend(grupos)
+        else:
+            where_conditions.append("0")
+
+    # Filtro por nombre (palabras por prefijo sobre el índice de tokens)
+    if "nombre_like" in criterios and criterios["nombre_like"]:
+        if db.indice_nombres:
+            condicion, params_nombre = condicion_nombre(criterios["nombre_like"])
+            where_conditions.append(condicion)
+            params.extend(params_nombre)
+        else:
             where_conditions.append("LOWER(alimento) LIKE ?")
-            params.append(f"%{nombre_sin_acentos}%")
-
-        # Construir consulta final
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-        query = f"""
-        SELECT * FROM alimentos
+            params.append(f"%{normalizar_texto(criterios['nombre_like'])}%")
+
+    # Paginación por clave: en orden ascendente SQLite pone primero los alimentos sin energía
+    if despues_de:
+        energia, rowid = decodificar_cursor(despues_de)
+        if energia is None:
+            where_conditions.append("(`energia (kcal)` IS NOT NULL OR alimentos.rowid > ?)")
+            params.append(rowid)
+        else:
+            where_conditions.append("(`energia (kcal)`, alimentos.rowid) > (?, ?)")
+            params.extend([energia, rowid])
+
+    where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+    query = f"""
+        SELECT alimentos.rowid AS alimento_rowid, * FROM alimentos
         WHERE {where_clause}
-        ORDER BY `energia (kcal)` ASC
+        ORDER BY `energia (kcal)` ASC, alimentos.rowid ASC
         LIMIT ?
-        """
-        params.append(limite)
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-
-        # Convertir a lista de diccionarios
-        resultados = []
-        for row in rows:
-            alimento_dict = dict(zip(columns, row))
-            resultados.append({
-                "id": alimento_dict.get("id"),
-                "alimento": alimento_dict.get("alimento"),
-                "grupo": alimento_dict.get("grupo de alimentos"),
-                "cantidad_base": f"{alimento_dict.get('cantidad', 100)} {alimento_dict.get('unidad', 'g')}",
-                "nutrientes": {
-                    "energia_kcal": alimento_dict.get("energia (kcal)"),
-                    "proteina_g": alimento_dict.get("proteina (g)"),
-                    "lipidos_g": alimento_dict.get("lipidos (g)"),
-                    "hidratos_carbono_g": alimento_dict.get("hidratos de carbono (g)"),
-                    "fibra_g": alimento_dict.get("fibra (g)"),
-                    "azucar_g": alimento_dict.get("azucar (g)"),
-                    "sodio_mg": alimento_dict.get("sodio (mg)"),
-                    "calcio_mg": alimento_dict.get("calcio (mg)"),
-                    "hierro_mg": alimento_dict.get("hierro (mg)"),
-                    "potasio_mg": alimento_dict.get("potasio (mg)")
-                }
-            })
+    """
+    params.append(limite)
+    return query, params
+
 
-        conn.close()
-        return resultados
+def paginar_alimentos_filtrados_sql(criterios: Dict[str, Any], limite: int = 10,
+                                    despues_de: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Una página de buscar_alimentos_filtrados_sql.
+    Devuelve {"alimentos": [...], "siguiente": cursor para la página siguiente o None}.
+    """
+    from utils.db import get_database
+    from utils.matriz_nutrientes import codificar_cursor
+
+    # Se pide una fila de más para saber si hay otra página
+    query, params = construir_consulta_filtrada(criterios, limite + 1, despues_de)
+    rows = get_database().fetchall(query, params)
+
+    siguiente = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        siguiente = codificar_cursor(rows[-1].get("energia (kcal)"), rows[-1]["alimento_rowid"])
+
+    resultados = []
+    for alimento_dict in rows:
+        resultados.append({
+            "id": alimento_dict.get("id"),
+            "alimento": alimento_dict.get("alimento"),
+            "grupo": alimento_dict.get("grupo de alimentos"),
+            "cantidad_base": f"{alimento_dict.get('cantidad', 100)} {alimento_dict.get('unidad', 'g')}",
+            "nutrientes": {
+                "energia_kcal": alimento_dict.get("energia (kcal)"),
+                "proteina_g": alimento_dict.get("proteina (g)"),
+                "lipidos_g": alimento_dict.get("lipidos (g)"),
+                "hidratos_carbono_g": alimento_dict.get("hidratos de carbono (g)"),
+                "fibra_g": alimento_dict.get("fibra (g)"),
+                "azucar_g": alimento_dict.get("azucar (g)"),
+                "sodio_mg": alimento_dict.get("sodio (mg)"),
+                "calcio_mg": alimento_dict.get("calcio (mg)"),
+                "hierro_mg": alimento_dict.get("hierro (mg)"),
+                "potasio_mg": alimento_dict.get("potasio (mg)")
+            }
+        })
+
+    return {"alimentos": resultados, "siguiente": siguiente}
+
+
+def buscar_alimentos_filtrados_sql(criterios: Dict[str, Any], limite: int = 10) -> List[Dict[str, Any]]:
+    """
+    Busca alimentos aplicando filtros avanzados con una consulta SQL dinámica sobre los índices
+    de nutrientes. Es el respaldo de la versión en memoria (y la referencia del benchmark).
+    """
+    try:
+        return paginar_alimentos_filtrados_sql(criterios, limite)["alimentos"]
 
     except Exception as e:
-        print(f"[ERROR] Error en buscar_alimentos_filtrados: {e}")
+        print(f"[ERROR] Error en buscar_alimentos_filtrados_sql: {e}")
         return []
 
 
+# Unidades de la porción base del SMAE que permiten convertir gramos en factor de porción
+UNIDADES_EN_GRAMOS = {"g", "gr", "gramos", "ml", "mililitros"}
+
+
+def calcular_composicion_receta(ingredientes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Calcula la composición nutricional de una receta en una sola pasada.
+
+    Args:
+        ingredientes: Lista de ingredientes, cada uno como:
+            {"alimento": "arroz", "gramos": 150}   # cantidad en gramos
+            {"alimento": "pollo", "porcion": 1.5}  # factor sobre la porción base del SMAE
+            Si no se indica cantidad se usa 1 porción base.
+
+    Returns:
+        Totales por nutriente y desglose por ingrediente en el mismo orden de entrada.
+        Los ingredientes sin coincidencia se reportan con "encontrado": False (no se descartan).
+    """
+    import numpy as np
+    from utils.matriz_nutrientes import get_matriz_nutrientes
+
+    matriz = get_matriz_nutrientes()
+    nombres = [str(ingrediente.get("alimento", "")) for ingrediente in ingredientes]
+    datos, posiciones = matriz.resolver_nombres(nombres)
+
+    # Factor de porción de cada ingrediente (0 para los que no se pueden calcular)
+    factores = np.zeros(len(ingredientes), dtype=np.float64)
+    errores = [None] * len(ingredientes)
+    for i, (ingrediente, posicion) in enumerate(zip(ingredientes, posiciones)):
+        if posicion < 0:
+            errores[i] = "Alimento no encontrado"
+        elif ingrediente.get("gramos") is not None:
+            cantidad_base = datos.cantidades[posicion]
+            if datos.unidades[posicion] not in UNIDADES_EN_GRAMOS or not cantidad_base > 0:
+                errores[i] = f"La porción base es '{datos.porciones[posicion]}'; indique 'porcion' en lugar de gramos"
+            else:
+                factores[i] = float(ingrediente["gramos"]) / cantidad_base
+        else:
+            factores[i] = float(ingrediente.get("porcion", 1.0))
+
+    # Suma ponderada de todas las filas de nutrientes a la vez (sin dato cuenta como 0)
+    valores = np.nan_to_num(datos.valores[np.maximum(posiciones, 0)].astype(np.float64)) * factores[:, None]
+    totales = valores.sum(axis=0)
+
+    desglose = []
+    for i, (nombre, posicion) in enumerate(zip(nombres, posiciones)):
+        if errores[i]:
+            desglose.append({
+                "consulta": nombre,
+                "alimento": datos.nombres[posicion] if posicion >= 0 else None,
+                "encontrado": bool(posicion >= 0),
+                "error": errores[i]
+            })
+            continue
+        nutrientes = {nutriente: round(float(valor), 2) for nutriente, valor in zip(matriz.nutrientes, valores[i])}
+        desglose.append({
+            "consulta": nombre,
+            "alimento": datos.nombres[posicion],
+            "encontrado": True,
+            "porcion": f"{round(float(factores[i]), 4)}x {datos.porciones[posicion]}",
+            "factor": round(float(factores[i]), 4),
+            "energia_kcal": nutrientes["energia_kcal"],
+            "nutrientes": nutrientes
+        })
+
+    return {
+        "composicion_total": {nutriente: round(float(valor), 2) for nutriente, valor in zip(matriz.nutrientes, totales)},
+        "desglose_por_alimento": desglose,
+        "numero_alimentos": len(ingredientes),
+        "total_alimentos_encontrados": int(np.count_nonzero(posiciones >= 0)),
+        "no_encontrados": [nombre for nombre, posicion in zip(nombres, posiciones) if posicion < 0]
+    }
+
+
 def calcular_composicion_total(alimentos: List[str], porciones: List[float] = None) -> Dict[str, Any]:
     """
     Calcula la composición nutricional total de una lista de alimentos.
@@ -158,9 +278,6 @@ def calcular_composicion_total(alimentos: List[str], porciones: List[float] = No
         Diccionario con composición total y desglose por alimento
     """
     try:
-        import os
-        import sqlite3
-
         if not alimentos:
             return {"error": "Lista de alimentos vacía"}
 
@@ -169,74 +286,9 @@ def calcular_composicion_total(alimentos: List[str], porciones: List[float] = No
         elif len(porciones) != len(alimentos):
             return {"error": "Número de porciones no coincide con número de alimentos"}
 
-        db_path = os.path.join(os.path.dirname(__file__), "..", "datainfo.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        composicion_total = {
-            "energia_kcal": 0.0,
-            "proteina_g": 0.0,
-            "lipidos_g": 0.0,
-            "hidratos_carbono_g": 0.0,
-            "fibra_g": 0.0,
-            "azucar_g": 0.0,
-            "sodio_mg": 0.0,
-            "calcio_mg": 0.0,
-            "hierro_mg": 0.0,
-            "potasio_mg": 0.0
-        }
-
-        desglose = []
-
-        for i, alimento in enumerate(alimentos):
-            # Buscar alimento
-            cursor.execute("SELECT * FROM alimentos WHERE LOWER(alimento) LIKE ? LIMIT 1",
-                          (f"%{alimento.lower()}%",))
-            row = cursor.fetchone()
-
-            if row:
-                columns = [description[0] for description in cursor.description]
-                alimento_dict = dict(zip(columns, row))
-                factor = porciones[i]
-
-                # Sumar a composición total
-                for nutriente, total in composicion_total.items():
-                    columna_db = {
-                        "energia_kcal": "energia (kcal)",
-                        "proteina_g": "proteina (g)",
-                        "lipidos_g": "lipidos (g)",
-                        "hidratos_carbono_g": "hidratos de carbono (g)",
-                        "fibra_g": "fibra (g)",
-                        "azucar_g": "azucar (g)",
-                        "sodio_mg": "sodio (mg)",
-                        "calcio_mg": "calcio (mg)",
-                        "hierro_mg": "hierro (mg)",
-                        "potasio_mg": "potasio (mg)"
-                    }.get(nutriente)
-
-                    if columna_db:
-                        valor = alimento_dict.get(columna_db, 0)
-                        try:
-                            valor_num = float(valor) if valor else 0.0
-                            composicion_total[nutriente] += valor_num * factor
-                        except (ValueError, TypeError):
-                            pass
-
-                # Agregar al desglose
-                desglose.append({
-                    "alimento": alimento_dict.get("alimento"),
-                    "porcion": f"{factor}x {alimento_dict.get('cantidad', 100)} {alimento_dict.get('unidad', 'g')}",
-                    "energia_kcal": (float(alimento_dict.get("energia (kcal)", 0) or 0)) * factor
-                })
-
-        conn.close()
-
-        return {
-            "composicion_total": composicion_total,
-            "desglose_por_alimento": desglose,
-            "numero_alimentos": len(alimentos),
-            "total_alimentos_encontrados": len([d for d in desglose if d["energia_kcal"] > 0])
-        }
+        return calcular_composicion_receta([
+            {"alimento": alimento, "porcion": porcion} for alimento, porcion in zip(alimentos, porciones)
+        ])
 
     except Exception as e:
         print(f"[ERROR] Error en calcular_composicion_total: {e}")
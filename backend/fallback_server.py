@@ -2,45 +2,22 @@ import http.server
 import socketserver
 import json
 import re
-import os
-import sqlite3
-import unicodedata
+from utils.db import get_database
+from utils.busqueda import buscar_alimentos_aproximados, buscar_alimentos_por_nombre
 
 class CalyxHandler(http.server.BaseHTTPRequestHandler):
-    def quitar_acentos(self, texto):
-        return ''.join(c for c in unicodedata.normalize('NFD', texto) 
-                      if unicodedata.category(c) != 'Mn')
-    
     def buscar_alimento(self, nombre_busqueda):
         """Busca alimento en la base de datos"""
         try:
-            db_path = os.path.join(os.path.dirname(__file__), "datainfo.db")
-            if not os.path.exists(db_path):
+            db = get_database()
+            if not db.exists():
                 return None
-                
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            nombre_sin_acentos = self.quitar_acentos(nombre_busqueda.lower())
-            
-            query = """
-            SELECT * FROM alimentos
-            WHERE LOWER(alimento) LIKE ?
-            ORDER BY LENGTH(alimento) ASC
-            LIMIT 1
-            """
             
-            cursor.execute(query, (f"%{nombre_sin_acentos}%",))
-            row = cursor.fetchone()
-            
-            if row:
-                column_names = [description[0] for description in cursor.description]
-                alimento_dict = dict(zip(column_names, row))
-                conn.close()
-                return alimento_dict
-            
-            conn.close()
-            return None
+            resultados = buscar_alimentos_por_nombre(nombre_busqueda, 1)
+            if not resultados:
+                # Tolerar errores de escritura: el alimento con el nombre más parecido
+                resultados = buscar_alimentos_aproximados(nombre_busqueda, 1)
+            return resultados[0] if resultados else None
             
         except Exception as e:
             print(f'Error buscando alimento: {e}')
@@ -200,6 +177,13 @@ if __name__ == '__main__':
     print('Calyx AI Backend - Modo Fallback')
     print('Servidor corriendo en http://localhost:8000')
 
+    # El índice de búsqueda aproximada se construye una vez, antes de atender peticiones
+    try:
+        from utils.difuso import get_buscador_difuso
+        get_buscador_difuso().indice()
+    except Exception as e:
+        print(f'Índice difuso no disponible: {e}')
+
     try:
         with socketserver.TCPServer(('', 8000), CalyxHandler) as httpd:
             httpd.serve_forever()
@@ -1,13 +1,19 @@
 from fastapi import FastAPI, Request, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import os
-import sqlite3
+import re
 import json
+import time
 from threading import Lock
-from ai_engine import IAEngine
+from ai_engine import IAEngine, ModelServerBusy
 # Importar módulos de utilidades y cálculos
 from calculos.nutricion import calcular_info_nutricional_basica, calcular_info_nutricional_completa
+from calculos.console_block import render_console_block
+from calculos.formulas import get_formula_engine
+from utils.busqueda import buscar_alimentos_aproximados, buscar_alimentos_por_nombre
+from utils.consulta_nutricional import interpretar_consulta
 
 app = FastAPI()
 
@@ -20,9 +26,90 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def construir_indice_difuso():
+    """Construye el índice de búsqueda aproximada al arrancar, en segundo plano"""
+    from threading import Thread
+    from utils.difuso import get_buscador_difuso
+
+    def construir():
+        try:
+            get_buscador_difuso().indice()
+        except Exception as e:
+            print(f"[WARNING] No se pudo construir el índice difuso: {e}")
+
+    Thread(target=construir, daemon=True).start()
+
+@app.on_event("startup")
+def cargar_modelo():
+    """Carga y calienta el modelo al arrancar, en segundo plano; el progreso se ve en /backend/startup/progress"""
+    start_ia_engine_loading()
+
 # Instancia global del motor de IA - INICIALIZACIÓN DIFERIDA
 ia_engine = None
+ia_engine_loaded = False
 ia_engine_lock = Lock()  # 🔒 Lock para sincronización de inicialización
+ia_engine_loader = None
+ia_engine_loader_lock = Lock()
+# Momento (time.monotonic) de la última carga fallida; None si no falló
+ia_engine_failed_at = None
+
+# Segundos sugeridos a los clientes para reintentar mientras el modelo carga
+MODEL_LOADING_RETRY_AFTER_S = 5
+# Tras una carga fallida, segundos mínimos antes de reintentarla en segundo plano
+MODEL_LOAD_RETRY_S = float(os.getenv("CALYX_MODEL_LOAD_RETRY_S", "30"))
+
+# Pasos de carga que informan los engines (ver InferenceEngine.report_progress)
+STARTUP_STEPS = {
+    "tokenizer": "Cargando tokenizer",
+    "weights": "Cargando pesos del modelo",
+    "pipeline": "Creando pipeline de inferencia",
+    "warmup": "Generación de calentamiento"
+}
+
+# Progreso real de la carga del modelo, servido por /backend/startup/progress
+backend_startup_status = {
+    "status": "starting",  # starting, loading_model, ready, error
+    "progress_percentage": 0,
+    "current_step": "Iniciando backend",
+    "total_steps": len(STARTUP_STEPS),
+    "current_step_number": 0,
+    "error_message": "",
+    "elapsed_s": 0.0,
+    "steps": {}  # segundos que tomó cada paso terminado
+}
+backend_startup_lock = Lock()
+backend_startup_started_at = time.perf_counter()
+
+def update_startup_status(status, current_step=None, step=None, error_message=""):
+    """Registra el avance de la carga; step es la clave del paso de STARTUP_STEPS que comienza"""
+    with backend_startup_lock:
+        now = round(time.perf_counter() - backend_startup_started_at, 2)
+        previous = backend_startup_status.get("_step")
+        if previous is not None:
+            # El paso anterior termina cuando empieza otro (o cuando la carga acaba)
+            backend_startup_status["steps"][previous] = round(now - backend_startup_status["_step_started_at"], 2)
+        backend_startup_status.update({"status": status, "elapsed_s": now, "error_message": error_message, "_step": step, "_step_started_at": now})
+        if step is not None:
+            number = list(STARTUP_STEPS).index(step) + 1
+            backend_startup_status.update({
+                "current_step": STARTUP_STEPS[step],
+                "current_step_number": number,
+                "progress_percentage": round((number - 1) * 100 / len(STARTUP_STEPS))
+            })
+        elif current_step is not None:
+            backend_startup_status["current_step"] = current_step
+        if status == "ready":
+            backend_startup_status.update({"progress_percentage": 100, "current_step_number": len(STARTUP_STEPS)})
+
+def get_startup_status():
+    """Copia del progreso de arranque sin los campos internos"""
+    with backend_startup_lock:
+        status = {k: v for k, v in backend_startup_status.items() if not k.startswith("_")}
+        status["steps"] = dict(status["steps"])
+    if status["status"] not in ("ready", "error"):
+        status["elapsed_s"] = round(time.perf_counter() - backend_startup_started_at, 2)
+    return status
 
 def get_version():
     """Lee la versión desde el archivo VERSION.txt"""
@@ -34,20 +121,102 @@ def get_version():
         print(f"Error leyendo VERSION.txt: {e}")
         return "1.7.1"  # Fallback
 
+def report_model_load_step(step):
+    update_startup_status("loading_model", step=step)
+
+def record_ia_engine_result():
+    """
+    Tras una carga o un cambio de modelo (con ia_engine_lock tomado): el motor queda cargado solo
+    si no hubo error; si lo hubo, se anota para que start_ia_engine_loading lo reintente más tarde
+    """
+    global ia_engine_loaded, ia_engine_failed_at
+    ia_engine_loaded = ia_engine.model_error is None
+    if ia_engine_loaded:
+        # Un servidor remoto caído no es un error de arranque: /health informa su estado
+        print("[DEBUG] Motor IA cargado exitosamente")
+        update_startup_status("ready", current_step="Backend listo y funcionando")
+    else:
+        ia_engine_failed_at = time.monotonic()
+        update_startup_status("error", current_step="Error al cargar el modelo", error_message=ia_engine.model_error)
+
 def get_ia_engine():
-    """Obtiene la instancia global de IAEngine con inicialización sincronizada"""
-    global ia_engine
+    """
+    Obtiene la instancia global de IAEngine ya cargada, con inicialización sincronizada.
+    Si el hilo de arranque la está cargando, espera a que termine; si la carga anterior falló, la reintenta.
+    """
+    global ia_engine, ia_engine_failed_at
     with ia_engine_lock:  # 🔒 Sincronización para evitar inicializaciones múltiples
         if ia_engine is None:
             print("[DEBUG] Motor IA no inicializado, cargando ahora...")
+            update_startup_status("loading_model", current_step="Preparando motor de IA")
             try:
-                ia_engine = IAEngine()
-                print("[DEBUG] Motor IA cargado exitosamente")
+                # Se publica antes de cargar para que /health y /model/* respondan durante la carga
+                ia_engine = IAEngine(autoload=False)
             except Exception as e:
                 print(f"[ERROR] Error al cargar motor IA: {e}")
-                ia_engine = None
+                ia_engine_failed_at = time.monotonic()
+                update_startup_status("error", current_step="Error al cargar el motor de IA", error_message=str(e))
+                return None
+        if not ia_engine_loaded:
+            if ia_engine.model_error:
+                update_startup_status("loading_model", current_step="Reintentando la carga del modelo")
+            # El progreso de arranque es solo de esta carga, no de los cambios de modelo posteriores
+            ia_engine.progress_callback = report_model_load_step
+            ia_engine.load_model()
+            ia_engine.progress_callback = None
+            record_ia_engine_result()
     return ia_engine
 
+def peek_ia_engine():
+    """Instancia global de IAEngine sin esperar la carga (None si aún no se creó); para endpoints de estado"""
+    return ia_engine
+
+def get_loaded_ia_engine():
+    """
+    IAEngine solo si la carga ya terminó bien, sin tomar ia_engine_lock: None mientras carga o si falló
+    (model_error), así las rutas responden el 503 de model_loading_response con el error de arranque.
+    Las peticiones no deben esperar la carga ocupando un hilo del threadpool.
+    """
+    engine = ia_engine
+    return engine if ia_engine_loaded and engine.model_error is None else None
+
+def start_ia_engine_loading():
+    """
+    Lanza la carga del modelo en un hilo aparte si no está cargado ni cargándose.
+    Una carga fallida se reintenta, como mucho una vez cada MODEL_LOAD_RETRY_S segundos.
+    """
+    global ia_engine_loader
+    from threading import Thread
+    with ia_engine_loader_lock:
+        if ia_engine_loaded or (ia_engine_loader is not None and ia_engine_loader.is_alive()):
+            return
+        if ia_engine_failed_at is not None and time.monotonic() - ia_engine_failed_at < MODEL_LOAD_RETRY_S:
+            return
+        ia_engine_loader = Thread(target=get_ia_engine, name="calyx-model-loader", daemon=True)
+        ia_engine_loader.start()
+
+def switch_ia_engine(model_key):
+    """
+    Cambia el modelo activo con ia_engine_lock tomado, sin cruzarse con una carga en segundo plano.
+    También es la vía de recuperación tras una carga fallida: si el modelo queda listo, el motor pasa a cargado.
+    """
+    with ia_engine_lock:
+        success = ia_engine.switch_model(model_key)
+        record_ia_engine_result()
+    return success
+
+def model_loading_response():
+    """503 para las rutas que necesitan el modelo mientras la carga no terminó bien, con su progreso o su error"""
+    start_ia_engine_loading()
+    startup = get_startup_status()
+    if startup["status"] == "error":
+        return JSONResponse({"error": "AI engine not available", "startup": startup}, status_code=503)
+    return JSONResponse(
+        {"error": f"Modelo cargando: {startup['current_step']}", "startup": startup},
+        status_code=503,
+        headers={"Retry-After": str(MODEL_LOADING_RETRY_AFTER_S)}
+    )
+
 def get_fallback_message():
     """Obtiene mensaje de fallback según el modelo activo"""
     try:
@@ -131,6 +300,67 @@ def parse_ai_response(response):
     # No hay thinking detectable, devolver respuesta completa
     return None, response
 
+class ThinkingStreamParser:
+    """
+    Separa incrementalmente el bloque <think>...</think> de los fragmentos que llegan en streaming.
+    Los tags pueden llegar partidos entre fragmentos, por lo que se retiene el texto ambiguo.
+    """
+    OPEN_TAGS = ("<think>", "<thinking>")
+    CLOSE_TAGS = ("</think>", "</thinking>")
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_thinking = False
+
+    def _find_tag(self, tags):
+        """Busca el primer tag completo en el buffer; devuelve (inicio, longitud) o (-1, 0)"""
+        lower = self.buffer.lower()
+        found = [(lower.find(tag), len(tag)) for tag in tags if lower.find(tag) != -1]
+        return min(found) if found else (-1, 0)
+
+    def _pending_partial_tag(self, tags):
+        """Longitud del sufijo del buffer que podría ser el inicio de un tag"""
+        lower = self.buffer.lower()
+        start = lower.rfind("<")
+        if start == -1:
+            return 0
+        tail = lower[start:]
+        return len(tail) if any(tag.startswith(tail) for tag in tags) else 0
+
+    def feed(self, chunk):
+        """Procesa un fragmento y devuelve una lista de eventos (tipo, texto) con tipo 'thinking' o 'token'"""
+        self.buffer += chunk
+        events = []
+
+        while self.buffer:
+            tags = self.CLOSE_TAGS if self.in_thinking else self.OPEN_TAGS
+            kind = "thinking" if self.in_thinking else "token"
+            index, tag_length = self._find_tag(tags)
+
+            if index != -1:
+                if index > 0:
+                    events.append((kind, self.buffer[:index]))
+                self.buffer = self.buffer[index + tag_length:]
+                self.in_thinking = not self.in_thinking
+                continue
+
+            pending = self._pending_partial_tag(tags)
+            emit_length = len(self.buffer) - pending
+            if emit_length > 0:
+                events.append((kind, self.buffer[:emit_length]))
+                self.buffer = self.buffer[emit_length:]
+            break
+
+        return events
+
+    def flush(self):
+        """Emite el texto retenido al terminar el stream"""
+        events = []
+        if self.buffer:
+            events.append(("thinking" if self.in_thinking else "token", self.buffer))
+            self.buffer = ""
+        return events
+
 def get_tokens_for_formula(formula_key):
     """Determina el número óptimo de tokens basado en la complejidad de la fórmula"""
     # Cálculos ultra-extensos que requieren muchos tokens
@@ -148,160 +378,28 @@ def get_tokens_for_formula(formula_key):
 
 def calculate_formula_from_json(formula_name, message):
     """
-    Calcula una fórmula médica consultando data_formulas.json y extrayendo parámetros del mensaje.
+    Calcula una fórmula médica de data_formulas.json extrayendo los parámetros del mensaje.
+    Usa el motor de fórmulas compilado (calculos/formulas.py), que cubre todas las fórmulas del JSON.
     """
-    import json
-    import re
-    import os
-    
     try:
-        # Cargar data_formulas.json
-        formulas_path = os.path.join(os.path.dirname(__file__), "data_formulas.json")
-        with open(formulas_path, 'r', encoding='utf-8') as f:
-            formulas_data = json.load(f)
-        
-        # Verificar si la fórmula existe
-        if formula_name not in formulas_data:
+        formula_engine = get_formula_engine()
+        if formula_name not in formula_engine.formulas:
             return None
-            
-        formula = formulas_data[formula_name]
-        
+
         # Extraer parámetros del mensaje según la definición de la fórmula
-        extracted_params = {}
-        
-        for param in formula["parametros"]:
-            param_name = param["nombre"]
-            param_type = param["tipo"]
-            param_unit = param.get("unidad", "")
-            
-            # Crear patrón de búsqueda para este parámetro
-            if param_unit in ["kg", "kilogramos"]:
-                pattern = r'(\d+(?:\.\d+)?)\s*(?:kg|kilogramos?)'
-            elif param_unit in ["m", "metros"]:
-                pattern = r'(\d+(?:\.\d+)?)\s*(?:m|metros?)'
-            elif param_unit in ["cm", "centímetros"]:
-                pattern = r'(\d+(?:\.\d+)?)\s*(?:cm|centímetros?)'
-            elif param_unit == "años":
-                pattern = r'(\d+)\s*(?:años?|edad)'
-            elif param_name == "sexo":
-                pattern = r'(?:hombre|varón|masculino|m)\s*(?:\w*\s*)*|(?:mujer|femenino|f)\s*(?:\w*\s*)*'
-            else:
-                continue
-                
-            match = re.search(pattern, message, re.IGNORECASE)
-            if match:
-                if param_name == "sexo":
-                    # Determinar sexo basado en palabras clave
-                    text_found = match.group(0).lower()
-                    if any(word in text_found for word in ['hombre', 'varón', 'masculino', 'm']):
-                        value = "M"
-                    elif any(word in text_found for word in ['mujer', 'femenino', 'f']):
-                        value = "F"
-                    else:
-                        value = "M"  # default
-                else:
-                    value = float(match.group(1)) if param_type == "float" else int(match.group(1))
-                extracted_params[param_name] = value
-        
+        extracted_params = formula_engine.extraer_parametros(formula_name, message)
+
         # Verificar que tenemos todos los parámetros necesarios
-        required_params = [p["nombre"] for p in formula["parametros"]]
+        required_params = formula_engine.obtener(formula_name).parametros
         if not all(param in extracted_params for param in required_params):
             return None
-            
-        # Calcular IMC
-        if formula_name == "imc":
-            peso = extracted_params["peso"]
-            altura = extracted_params["altura"]
-            
-            # Cálculos paso a paso
-            altura_cuadrado = round(altura ** 2, 4)
-            imc_value = round(peso / altura_cuadrado, 2)
-            
-            # Determinar interpretación
-            interpretation = "Sin clasificar"
-            for rango in formula["interpretacion"]:
-                if rango["min"] <= imc_value < rango["max"]:
-                    interpretation = rango["texto"]
-                    break
-            
-            # Devolver datos estructurados para que Qwen2.5-3B los formatee creativamente
-            return {
-                "tipo": "calculo_medico",
-                "formula": formula_name.upper(),
-                "nombre_completo": formula["nombre"],
-                "parametros": extracted_params,
-                "calculos": {
-                    "pasos": [
-                        f"Elevar altura al cuadrado: {altura}² = {altura_cuadrado}",
-                        f"Dividir peso entre altura²: {peso} ÷ {altura_cuadrado} = {imc_value}"
-                    ],
-                    "resultado": imc_value,
-                    "unidad": "kg/m²",
-                    "formula_matematica": "IMC = peso / altura²"
-                },
-                "interpretacion": interpretation,
-                "categoria": formula.get("categoria", ""),
-                "descripcion": formula.get("descripcion", "")
-            }
-            
-        # Calcular TMB Harris-Benedict
-        elif formula_name == "tmb_harris_benedict":
-            peso = extracted_params["peso"]
-            altura = extracted_params["altura"]  # en cm
-            edad = extracted_params["edad"]
-            sexo = extracted_params.get("sexo", "M").upper()
-            
-            # Fórmula Harris-Benedict
-            if sexo == "M":  # Hombre
-                constante = 66.5
-                factor_peso = 13.75
-                factor_altura = 5.003
-                factor_edad = 6.775
-                tmb = constante + (factor_peso * peso) + (factor_altura * altura) - (factor_edad * edad)
-            else:  # Mujer
-                constante = 655.1
-                factor_peso = 9.563
-                factor_altura = 1.850
-                factor_edad = 4.676
-                tmb = constante + (factor_peso * peso) + (factor_altura * altura) - (factor_edad * edad)
-            
-            tmb_value = round(tmb, 1)
-            
-            # Determinar interpretación
-            interpretation = "Sin clasificar"
-            for rango in formula["interpretacion"]:
-                if rango["min"] <= tmb_value < rango["max"]:
-                    interpretation = rango["texto"]
-                    break
-            
-            # Devolver datos estructurados
-            return {
-                "tipo": "calculo_medico",
-                "formula": formula_name.upper(),
-                "nombre_completo": formula["nombre"],
-                "parametros": extracted_params,
-                "calculos": {
-                    "pasos": [
-                        f"Constante base: {constante}",
-                        f"Factor peso: {factor_peso} × {peso} = {round(factor_peso * peso, 1)}",
-                        f"Factor altura: {factor_altura} × {altura} = {round(factor_altura * altura, 1)}",
-                        f"Factor edad: {factor_edad} × {edad} = {round(factor_edad * edad, 1)}",
-                        f"Cálculo final: {constante} + {round(factor_peso * peso, 1)} + {round(factor_altura * altura, 1)} - {round(factor_edad * edad, 1)} = {tmb_value}"
-                    ],
-                    "resultado": tmb_value,
-                    "unidad": "kcal/día",
-                    "formula_matematica": f"{'Hombre' if sexo == 'M' else 'Mujer'}: {constante} + ({factor_peso} × peso) + ({factor_altura} × altura) - ({factor_edad} × edad)"
-                },
-                "interpretacion": interpretation,
-                "categoria": formula.get("categoria", ""),
-                "descripcion": formula.get("descripcion", "")
-            }
-            
+
+        # Devolver datos estructurados (pasos, fórmula, sustitución, resultado e interpretación)
+        return formula_engine.evaluar(formula_name, extracted_params)
+
     except Exception as e:
         print(f"[ERROR] Error calculando fórmula {formula_name}: {e}")
         return None
-    
-    return None
 
 def format_calculation_response(message):
     """
@@ -340,53 +438,187 @@ def format_calculation_response(message):
 
 # Función para consultar alimentos en la base de datos
 def get_alimentos_by_name(nombre_busqueda, limite=5):
-    """Consulta alimentos por nombre con búsqueda aproximada"""
+    """
+    Consulta alimentos por nombre sin distinguir acentos (índice normalizado de utils/busqueda.py).
+    Devuelve una lista de diccionarios, el más relevante primero.
+    """
     try:
-        # Conectar a la base de datos
-        db_path = os.path.join(os.path.dirname(__file__), "datainfo.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        return buscar_alimentos_por_nombre(nombre_busqueda, limite)
 
-        # Función para quitar acentos
-        def quitar_acentos(texto):
-            import unicodedata
-            return ''.join(c for c in unicodedata.normalize('NFD', texto)
-                          if unicodedata.category(c) != 'Mn')
+    except Exception as e:
+        print(f"[ERROR] Error consultando alimentos: {e}")
+        return []
 
-        # Preparar búsqueda sin acentos
-        nombre_sin_acentos = quitar_acentos(nombre_busqueda.lower())
+def get_alimentos_aproximados(nombre_busqueda, limite=5):
+    """
+    Alimentos con nombre parecido aunque tenga errores de escritura (buscador difuso de utils/difuso.py).
+    Cada diccionario incluye "similitud" (0-1); el más parecido primero.
+    """
+    try:
+        return buscar_alimentos_aproximados(nombre_busqueda, limite)
 
-        # Consulta con búsqueda aproximada
-        query = """
-        SELECT * FROM alimentos
-        WHERE LOWER(alimento) LIKE ?
-        ORDER BY LENGTH(alimento) ASC
-        LIMIT ?
-        """
+    except Exception as e:
+        print(f"[ERROR] Error en búsqueda aproximada de alimentos: {e}")
+        return []
 
-        cursor.execute(query, (f"%{nombre_sin_acentos}%", limite))
-        rows = cursor.fetchall()
+def extract_last_user_message(full_prompt):
+    """Extrae solo el último mensaje del usuario del historial de conversación"""
+    lines = full_prompt.strip().split('\n')
+    user_messages = [line.replace('user:', '').strip() for line in lines if line.startswith('user:')]
+    return user_messages[-1] if user_messages else full_prompt
 
-        # Obtener nombres de columnas
-        column_names = [description[0] for description in cursor.description]
+def extract_history_without_last(full_prompt):
+    """Extrae el historial sin el último mensaje del usuario"""
+    lines = full_prompt.strip().split('\n')
+    # Si la última línea es user:, quitarla
+    if lines and lines[-1].startswith('user:'):
+        return '\n'.join(lines[:-1])
+    return full_prompt
 
-        conn.close()
-        return column_names, rows
+# Detectar pedidos de cálculos médicos - PATRONES EXPANDIDOS PARA TODAS LAS FÓRMULAS
+calculation_patterns = {
+    "imc": r'calcula.*imc|imc.*calcula|cuál.*imc|mi.*imc|indice.*masa.*corporal',
+    "tmb_harris_benedict": r'calcula.*tmb.*harris|tmb.*harris.*calcula|tasa.*metabolica.*basal.*harris|metabolismo.*basal.*harris',
+    "tmb_mifflin": r'calcula.*tmb.*mifflin|tmb.*mifflin.*calcula|tasa.*metabolica.*mifflin|metabolismo.*basal.*mifflin',
+    "tmb_owen": r'calcula.*tmb.*owen|tmb.*owen.*calcula|tasa.*metabolica.*owen|metabolismo.*basal.*owen',
+    "tmb_fao_oms": r'calcula.*tmb.*fao|tmb.*fao.*calcula|tasa.*metabolica.*oms|metabolismo.*basal.*fao|metabolismo.*basal.*oms',
+    "get": r'calcula.*get|get.*calcula|gasto.*energetico.*total|energia.*total',
+    "icc": r'calcula.*icc|icc.*calcula|indice.*cintura.*cadera|cintura.*cadera',
+    "ict": r'calcula.*ict|ict.*calcula|indice.*cintura.*altura|cintura.*altura',
+    "peso_ideal": r'calcula.*peso.*ideal|peso.*ideal.*calcula|peso.*óptimo',
+    "superficie_corporal": r'calcula.*superficie.*corporal|superficie.*corporal.*calcula|area.*corporal',
+    "agua_corporal": r'calcula.*agua.*corporal|agua.*corporal.*calcula|hidratacion.*corporal',
+    "requerimiento_proteina": r'calcula.*proteina|requerimiento.*proteina|proteina.*necesaria|necesidad.*proteina',
+    "composicion_corporal": r'calcula.*composicion.*corporal|composicion.*corporal.*calcula|analisis.*corporal|composicion.*cuerpo',
+}
 
-    except Exception as e:
-        print(f"[ERROR] Error consultando alimentos: {e}")
-        return [], []
+# Palabras clave para detectar consultas nutricionales/alimentarias
+nutrition_keywords = [
+    'informacion', 'información', 'datos', 'nutricional', 'nutricionales',
+    'calorias', 'calorías', 'proteinas', 'proteínas', 'grasas', 'fibra',
+    'sodio', 'vitamina', 'mineral', 'alimento', 'alimentos', 'comida',
+    'dieta', 'alimentacion', 'alimentación', 'nutriente', 'nutrientes',
+    'aporte', 'contiene', 'contenido', 'valor', 'valores', 'macronutriente',
+    'micronutriente', 'energia', 'energía', 'kcal', 'kj', 'hidratos',
+    'carbohidratos', 'lipidos', 'lípidos', 'azucar', 'azúcar', 'colesterol'
+]
+
+def detect_calculation_request(last_user_message):
+    """
+    Busca un pedido directo de fórmula médica en el último mensaje.
+    Devuelve los datos del cálculo o None si no hay fórmula o faltan parámetros.
+    """
+    for formula_name, pattern in calculation_patterns.items():
+        if re.search(pattern, last_user_message, re.IGNORECASE):
+            print(f"[LOG] Detectado pedido directo de {formula_name} en el último mensaje, calculando automáticamente...")
+            calculation_data = calculate_formula_from_json(formula_name, last_user_message)
+            if calculation_data:
+                return calculation_data
+    return None
+
+def build_console_block(final_message, calculation_data):
+    """
+    Convierte el texto formateado por Qwen2.5-3B en un console_block.
+    Devuelve None si la respuesta no tiene contenido significativo.
+    """
+    if not final_message or len(final_message.strip()) <= 10:
+        return None
+
+    # Limpiar marcadores de código que pueda agregar Qwen2.5-3B
+    cleaned_message = re.sub(r'```\w*\n?', '', final_message)  # Remover ```plaintext, ```console, etc.
+    cleaned_message = re.sub(r'^\s*plaintext\s*', '', cleaned_message, flags=re.IGNORECASE)
+    cleaned_message = re.sub(r'^\s*console\s*', '', cleaned_message, flags=re.IGNORECASE)
+    cleaned_message = cleaned_message.strip()
+
+    # Parsear respuesta del modelo para extraer título y contenido
+    lines = cleaned_message.split('\n')
+    title = f"Cálculo {calculation_data['formula']}"  # Fallback
+    output_data = cleaned_message
+
+    # Intentar extraer título si el modelo lo proporciona (línea que empieza con >)
+    if lines and lines[0].strip().startswith('>'):
+        title_line = lines[0].strip()
+        title = title_line.replace('>', '').strip()
+        # Remover el título del contenido del output
+        output_data = '\n'.join(lines[1:]).strip()
+
+    return {
+        "title": title,
+        "input": "",  # El modelo incluye los datos de entrada en el output
+        "output": output_data
+    }
+
+def build_chat_generation(ia_engine, prompt, last_user_message, calculation_data=None):
+    """
+    Decide qué prompt y parámetros de generación usar para un mensaje de /chat.
+    Devuelve un dict con el modo ('calculation', 'nutrition' o 'conversation') y los argumentos de generación.
+    """
+    if calculation_data:
+        # Formateo del cálculo con el modelo (modo opcional llm_format; por defecto se usa render_console_block)
+        # Construir prompt optimizado usando el método centralizado en ai_engine
+        return {
+            "mode": "calculation",
+            "prompt": ia_engine.build_calculation_prompt(prompt, calculation_data),
+            "system_prompt": None,
+            # Determinar tokens basados en complejidad de la fórmula
+            "max_new_tokens": get_tokens_for_formula(calculation_data['formula']),
+            "temperature": 0.1,
+            "top_p": 0.3
+        }
+
+    # Búsquedas por nutrientes que el intérprete cubre por completo se resuelven antes de generar
+    consulta = interpretar_consulta(last_user_message)
+    consulta_directa = consulta if consulta and consulta["cubierta"] else None
+
+    if consulta_directa or any(keyword in last_user_message.lower() for keyword in nutrition_keywords):
+        print(f"[LOG] Detectada consulta nutricional: {last_user_message}")
+        tool_result = None
+        if consulta_directa:
+            print(f"[LOG] Consulta interpretada sin el modelo: {consulta_directa['criterios']} (límite {consulta_directa['limite']})")
+            tool_result = ia_engine.execute_tool("buscar_alimentos_filtrados", {
+                "criterios": consulta_directa["criterios"],
+                "limite": consulta_directa["limite"]
+            })
+        # Usar prompt nutricional con tools (o con los resultados ya incluidos)
+        return {
+            "mode": "nutrition",
+            "prompt": ia_engine.build_nutrition_prompt(prompt, last_user_message, tool_result),
+            "system_prompt": None,
+            "consulta_directa": consulta_directa,
+            "max_new_tokens": 512,
+            "temperature": 0.3,
+            "top_p": 0.8
+        }
+
+    # Conversación normal: system prompt general con el historial como contexto
+    history_without_last = extract_history_without_last(prompt)
+    system_prompt_extra = f"HISTORIAL DE CONVERSACIÓN PARA CONTEXTO:\n{history_without_last}\n\n" if history_without_last.strip() else ""
+    return {
+        "mode": "conversation",
+        "prompt": last_user_message,
+        "system_prompt": ia_engine.build_tools_system_prompt(system_prompt_extra),
+        "system_prompt_extra": system_prompt_extra,
+        "max_new_tokens": 512,
+        "temperature": 0.3,
+        "top_p": 0.8
+    }
 
 @app.get("/")
 def root():
     return {"message": "Calyx AI Backend - API de nutrición y consultas médicas"}
 
 @app.get("/health")
-def health():
+async def health():
     print("[LOG] /health endpoint called")
     try:
-        ia_engine = get_ia_engine()
-        return ia_engine.get_status()
+        ia_engine = peek_ia_engine()
+        if ia_engine is None:
+            startup = get_startup_status()
+            return {"status": "error" if startup["status"] == "error" else "loading", "message": startup["error_message"] or startup["current_step"], "ready": False, "startup": startup}
+        status = ia_engine.get_status()
+        if not status.get("ready"):
+            status["startup"] = get_startup_status()
+        return status
     except Exception as e:
         print(f"[ERROR] Error getting IA engine status: {e}")
         return {"status": "error", "message": str(e), "ready": False}
@@ -415,140 +647,306 @@ async def chat(request: Request):
             print("[LOG] /chat error: No prompt provided")
             return JSONResponse({"error": "No prompt provided"}, status_code=400)
 
-        # --- VERIFICAR SI EL USUARIO PIDE CÁLCULO DIRECTO DE FÓRMULA MÉDICA ---
-        import re
-        
-        # Función para extraer solo el último mensaje del usuario del historial
-        def extract_last_user_message(full_prompt):
-            """Extrae solo el último mensaje del usuario del historial de conversación"""
-            lines = full_prompt.strip().split('\n')
-            user_messages = [line.replace('user:', '').strip() for line in lines if line.startswith('user:')]
-            return user_messages[-1] if user_messages else full_prompt
-        
         # Usar solo el último mensaje del usuario para detección de fórmulas
         last_user_message = extract_last_user_message(prompt)
         print(f"[LOG] Último mensaje del usuario: '{last_user_message}'")
-        
-        # Detectar pedidos de cálculos médicos - PATRONES EXPANDIDOS PARA TODAS LAS FÓRMULAS
-        calculation_patterns = {
-            "imc": r'calcula.*imc|imc.*calcula|cuál.*imc|mi.*imc|indice.*masa.*corporal',
-            "tmb_harris_benedict": r'calcula.*tmb.*harris|tmb.*harris.*calcula|tasa.*metabolica.*basal.*harris|metabolismo.*basal.*harris',
-            "tmb_mifflin": r'calcula.*tmb.*mifflin|tmb.*mifflin.*calcula|tasa.*metabolica.*mifflin|metabolismo.*basal.*mifflin',
-            "tmb_owen": r'calcula.*tmb.*owen|tmb.*owen.*calcula|tasa.*metabolica.*owen|metabolismo.*basal.*owen',
-            "tmb_fao_oms": r'calcula.*tmb.*fao|tmb.*fao.*calcula|tasa.*metabolica.*oms|metabolismo.*basal.*fao|metabolismo.*basal.*oms',
-            "get": r'calcula.*get|get.*calcula|gasto.*energetico.*total|energia.*total',
-            "icc": r'calcula.*icc|icc.*calcula|indice.*cintura.*cadera|cintura.*cadera',
-            "ict": r'calcula.*ict|ict.*calcula|indice.*cintura.*altura|cintura.*altura',
-            "peso_ideal": r'calcula.*peso.*ideal|peso.*ideal.*calcula|peso.*óptimo',
-            "superficie_corporal": r'calcula.*superficie.*corporal|superficie.*corporal.*calcula|area.*corporal',
-            "agua_corporal": r'calcula.*agua.*corporal|agua.*corporal.*calcula|hidratacion.*corporal',
-            "requerimiento_proteina": r'calcula.*proteina|requerimiento.*proteina|proteina.*necesaria|necesidad.*proteina',
-            "composicion_corporal": r'calcula.*composicion.*corporal|composicion.*corporal.*calcula|analisis.*corporal|composicion.*cuerpo',
-        }
-        
-        for formula_name, pattern in calculation_patterns.items():
-            if re.search(pattern, last_user_message, re.IGNORECASE):
-                print(f"[LOG] Detectado pedido directo de {formula_name} en el último mensaje, calculando automáticamente...")
-                calculation_data = calculate_formula_from_json(formula_name, last_user_message)
-                if calculation_data:
-                    # Enviar datos a Qwen2.5-3B para formateo creativo en console_block
-                    # Usar get_ia_engine() para obtener la instancia
-                    ia_engine = get_ia_engine()
-                    if ia_engine is None:
-                        return JSONResponse({"error": "AI engine not available"}, status_code=503)
-                        
-                    # Construir prompt optimizado usando el método centralizado en ai_engine
-                    enhanced_prompt = ia_engine.build_calculation_prompt(prompt, calculation_data)
-                    
-                    # Determinar tokens basados en complejidad de la fórmula
-                    max_tokens = get_tokens_for_formula(calculation_data['formula'])
-                    response = ia_engine.generate(enhanced_prompt, max_new_tokens=max_tokens, temperature=0.1, top_p=0.3)
-                    thinking_content, final_message = parse_ai_response(response)
-                    
-                    # Qwen2.5-3B debería responder con texto formateado, convertirlo en console_block
-                    if final_message and len(final_message.strip()) > 10:  # Tiene contenido significativo
-                        # Limpiar marcadores de código que pueda agregar Qwen2.5-3B
-                        import re
-                        cleaned_message = re.sub(r'```\w*\n?', '', final_message)  # Remover ```plaintext, ```console, etc.
-                        cleaned_message = re.sub(r'^\s*plaintext\s*', '', cleaned_message, flags=re.IGNORECASE)
-                        cleaned_message = re.sub(r'^\s*console\s*', '', cleaned_message, flags=re.IGNORECASE)
-                        cleaned_message = cleaned_message.strip()
-                        
-                        # Parsear respuesta del modelo para extraer título y contenido
-                        lines = cleaned_message.split('\n')
-                        title = f"Cálculo {calculation_data['formula']}"  # Fallback
-                        output_data = cleaned_message
-                        
-                        # Intentar extraer título si el modelo lo proporciona (línea que empieza con >)
-                        if lines and lines[0].strip().startswith('>'):
-                            title_line = lines[0].strip()
-                            title = title_line.replace('>', '').strip()
-                            # Remover el título del contenido del output
-                            output_data = '\n'.join(lines[1:]).strip()
-                        
-                        console_block = {
-                            "title": title,
-                            "input": "",  # El modelo incluye los datos de entrada en el output
-                            "output": output_data
-                        }
-                        return {"message": "Cálculo completado", "thinking": thinking_content, "console_block": console_block}
-                    else:
-                        # Fallback: devolver respuesta normal
-                        return {"message": final_message or "Cálculo completado", "thinking": thinking_content, "console_block": None}
 
-        # --- CONVERSACIONES NORMALES: usar generate() con system prompt general ---
-        ia_engine = get_ia_engine()
+        # --- VERIFICAR SI EL USUARIO PIDE CÁLCULO DIRECTO DE FÓRMULA MÉDICA ---
+        calculation_data = detect_calculation_request(last_user_message)
+
+        if calculation_data and not data.get("llm_format"):
+            # Render determinista del console_block: sin llamadas al modelo
+            return {"message": "Cálculo completado", "thinking": None, "console_block": render_console_block(calculation_data)}
+
+        # Mientras el modelo carga se responde 503 en lugar de esperar la carga
+        ia_engine = get_loaded_ia_engine()
         if ia_engine is None:
-            return JSONResponse({"error": "AI engine not available"}, status_code=503)
+            return model_loading_response()
 
-        # Extraer último mensaje y historial para separar system y user
-        last_user_message = extract_last_user_message(prompt)
-        
-        def extract_history_without_last(full_prompt):
-            """Extrae el historial sin el último mensaje del usuario"""
-            lines = full_prompt.strip().split('\n')
-            # Si la última línea es user:, quitarla
-            if lines and lines[-1].startswith('user:'):
-                return '\n'.join(lines[:-1])
-            return full_prompt
-        
-        history_without_last = extract_history_without_last(prompt)
-        system_prompt_extra = f"HISTORIAL DE CONVERSACIÓN PARA CONTEXTO:\n{history_without_last}\n\n" if history_without_last.strip() else ""
-
-        # Detectar si es consulta nutricional/alimentaria
-        nutrition_keywords = [
-            'informacion', 'información', 'datos', 'nutricional', 'nutricionales',
-            'calorias', 'calorías', 'proteinas', 'proteínas', 'grasas', 'fibra',
-            'sodio', 'vitamina', 'mineral', 'alimento', 'alimentos', 'comida',
-            'dieta', 'alimentacion', 'alimentación', 'nutriente', 'nutrientes',
-            'aporte', 'contiene', 'contenido', 'valor', 'valores', 'macronutriente',
-            'micronutriente', 'energia', 'energía', 'kcal', 'kj', 'hidratos',
-            'carbohidratos', 'lipidos', 'lípidos', 'azucar', 'azúcar', 'colesterol'
-        ]
-
-        is_nutrition_query = any(keyword in last_user_message.lower() for keyword in nutrition_keywords)
-
-        if is_nutrition_query:
-            print(f"[LOG] Detectada consulta nutricional: {last_user_message}")
-            # Usar prompt nutricional con tools
-            nutrition_prompt = ia_engine.build_nutrition_prompt(prompt, last_user_message)
-            response = ia_engine.generate(nutrition_prompt, max_new_tokens=512, temperature=0.3, top_p=0.8)
+        # Puede consultar la base de datos (consultas nutricionales interpretadas): fuera del event loop
+        generation = await run_in_threadpool(build_chat_generation, ia_engine, prompt, last_user_message, calculation_data)
+
+        if generation["mode"] == "calculation":
+            # Enviar datos a Qwen2.5-3B para formateo creativo en console_block
+            response = await ia_engine.agenerate(generation["prompt"], max_new_tokens=generation["max_new_tokens"], temperature=generation["temperature"], top_p=generation["top_p"])
+            thinking_content, final_message = parse_ai_response(response)
+
+            # Qwen2.5-3B debería responder con texto formateado, convertirlo en console_block
+            console_block = build_console_block(final_message, calculation_data)
+            if console_block:
+                return {"message": "Cálculo completado", "thinking": thinking_content, "console_block": console_block}
+            # Fallback: devolver respuesta normal
+            return {"message": final_message or "Cálculo completado", "thinking": thinking_content, "console_block": None}
+
+        if generation["mode"] == "nutrition":
+            response = await ia_engine.agenerate(generation["prompt"], max_new_tokens=generation["max_new_tokens"], temperature=generation["temperature"], top_p=generation["top_p"])
         else:
             # Para conversaciones normales, usar generate_with_tools() con system prompt separado
-            response = ia_engine.generate_with_tools(last_user_message, system_prompt_extra=system_prompt_extra, max_new_tokens=512, temperature=0.3, top_p=0.8, max_iterations=1)
-        
+            response = await ia_engine.agenerate_with_tools(generation["prompt"], system_prompt_extra=generation["system_prompt_extra"], max_new_tokens=generation["max_new_tokens"], temperature=generation["temperature"], top_p=generation["top_p"], max_iterations=1)
+
         # Parsear respuesta de Qwen2.5-3B para separar thinking del mensaje final
         thinking_content, final_message = parse_ai_response(response)
-        
+
         # Respuesta normal de conversación
         return {"message": final_message, "thinking": thinking_content, "console_block": None}
 
+    except ModelServerBusy as e:
+        # Backpressure del servidor de modelo compartido: el cliente debe reintentar más tarde
+        print(f"[LOG] /chat servidor de modelo ocupado: {e}")
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(max(1, round(e.retry_after_s)))})
     except Exception as e:
         print(f"[LOG] /chat exception: {e}")
         import traceback
         traceback.print_exc()
         return JSONResponse({"error": f"Error processing request: {str(e)}"}, status_code=500)
 
+def stream_event(event_type, **payload):
+    """Serializa un evento del stream de /chat/stream como una línea NDJSON"""
+    return json.dumps({"type": event_type, **payload}, ensure_ascii=False) + "\n"
+
+def chat_stream_events(prompt, llm_format=False):
+    """
+    Generador de eventos NDJSON para /chat/stream.
+    Emite 'token' y 'thinking' conforme el modelo genera, 'ttft' con el tiempo al primer token,
+    'done' con el mensaje final ya parseado y, para cálculos médicos, 'console_block' al final.
+    """
+    started_at = time.perf_counter()
+    try:
+        last_user_message = extract_last_user_message(prompt)
+        print(f"[LOG] /chat/stream último mensaje del usuario: '{last_user_message}'")
+
+        calculation_data = detect_calculation_request(last_user_message)
+
+        if calculation_data and not llm_format:
+            # Render determinista del console_block: sin llamadas al modelo
+            total_ms = round((time.perf_counter() - started_at) * 1000, 1)
+            yield stream_event("start", mode="calculation")
+            yield stream_event("done", message="Cálculo completado", thinking=None, ttft_ms=None, total_ms=total_ms)
+            yield stream_event("console_block", console_block=render_console_block(calculation_data))
+            return
+
+        # /chat/stream ya respondió 503 si el modelo seguía cargando
+        ia_engine = get_loaded_ia_engine()
+        if ia_engine is None:
+            yield stream_event("error", error="AI engine not available")
+            return
+
+        generation = build_chat_generation(ia_engine, prompt, last_user_message, calculation_data)
+        yield stream_event("start", mode=generation["mode"])
+
+        thinking_parser = ThinkingStreamParser()
+        chunks = []
+        ttft_ms = None
+
+        for chunk in ia_engine.generate_stream(generation["prompt"], system_prompt=generation["system_prompt"], max_new_tokens=generation["max_new_tokens"], temperature=generation["temperature"], top_p=generation["top_p"]):
+            if ttft_ms is None:
+                ttft_ms = round((time.perf_counter() - started_at) * 1000, 1)
+                print(f"[LOG] /chat/stream time-to-first-token: {ttft_ms} ms")
+                yield stream_event("ttft", ttft_ms=ttft_ms)
+            chunks.append(chunk)
+            for kind, text in thinking_parser.feed(chunk):
+                yield stream_event(kind, content=text)
+
+        for kind, text in thinking_parser.flush():
+            yield stream_event(kind, content=text)
+
+        # El mensaje final se parsea sobre el texto completo, igual que en /chat
+        response = "".join(chunks).strip()
+        thinking_content, final_message = parse_ai_response(response)
+        total_ms = round((time.perf_counter() - started_at) * 1000, 1)
+
+        if generation["mode"] == "calculation":
+            console_block = build_console_block(final_message, calculation_data)
+            if console_block:
+                yield stream_event("done", message="Cálculo completado", thinking=thinking_content, ttft_ms=ttft_ms, total_ms=total_ms)
+                yield stream_event("console_block", console_block=console_block)
+                return
+            yield stream_event("done", message=final_message or "Cálculo completado", thinking=thinking_content, ttft_ms=ttft_ms, total_ms=total_ms)
+            return
+
+        if generation["mode"] == "conversation" and ia_engine._parse_tool_call(response):
+            # Mismo comportamiento que generate_with_tools(max_iterations=1) en /chat
+            final_message = "Lo siento, no pude procesar tu consulta correctamente. ¿Puedes reformular tu pregunta?"
+
+        yield stream_event("done", message=final_message, thinking=thinking_content, ttft_ms=ttft_ms, total_ms=total_ms)
+
+    except ModelServerBusy as e:
+        print(f"[LOG] /chat/stream servidor de modelo ocupado: {e}")
+        yield stream_event("error", error=str(e), retry_after_s=e.retry_after_s)
+    except Exception as e:
+        print(f"[LOG] /chat/stream exception: {e}")
+        import traceback
+        traceback.print_exc()
+        yield stream_event("error", error=f"Error processing request: {str(e)}")
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Versión en streaming de /chat (NDJSON, un evento JSON por línea).
+    Los tokens se envían conforme se generan en lugar de esperar la respuesta completa.
+    Igual que /chat, acepta "llm_format": true para que el modelo formatee los cálculos médicos.
+    """
+    print("="*50)
+    print("[LOG] /chat/stream endpoint called")
+    data = await request.json()
+    prompt = data.get("prompt", "").strip()
+    if not prompt:
+        print("[LOG] /chat/stream error: No prompt provided")
+        return JSONResponse({"error": "No prompt provided"}, status_code=400)
+
+    # El 503 de carga va antes de abrir el stream; los cálculos deterministas no necesitan el modelo
+    llm_format = bool(data.get("llm_format"))
+    if get_loaded_ia_engine() is None and (llm_format or not detect_calculation_request(extract_last_user_message(prompt))):
+        return model_loading_response()
+
+    return StreamingResponse(
+        chat_stream_events(prompt, llm_format=llm_format),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/formulas")
+def listar_formulas():
+    """Lista las fórmulas médicas disponibles en el motor de fórmulas"""
+    return {"formulas": get_formula_engine().listar()}
+
+@app.post("/formulas/{formula_key}/batch")
+async def calcular_formula_lote(formula_key: str, request: Request):
+    """
+    Evalúa una fórmula para muchos pacientes en una sola llamada (vectorizado con NumPy).
+    Acepta "filas" (lista de objetos con los parámetros) o "columnas" (parámetro -> lista de valores).
+    Con "incluir_pasos": true devuelve además la traza de operaciones de cada fila.
+    """
+    print(f"[LOG] /formulas/{formula_key}/batch endpoint called")
+    formula_engine = get_formula_engine()
+    if formula_key not in formula_engine.formulas:
+        return JSONResponse({"error": f"Fórmula '{formula_key}' no encontrada"}, status_code=404)
+
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Body JSON inválido"}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "Se requiere 'filas' o 'columnas'"}, status_code=400)
+
+    filas = data.get("filas")
+    columnas = data.get("columnas")
+
+    if filas is not None:
+        if not isinstance(filas, list) or not filas:
+            return JSONResponse({"error": "'filas' debe ser una lista no vacía"}, status_code=400)
+        for i, fila in enumerate(filas):
+            if not isinstance(fila, dict):
+                return JSONResponse({"error": f"Fila {i}: debe ser un objeto con los parámetros"}, status_code=400)
+        parametros = {nombre for fila in filas for nombre in fila}
+        columnas = {nombre: [fila.get(nombre) for fila in filas] for nombre in parametros}
+    elif not isinstance(columnas, dict) or not columnas:
+        return JSONResponse({"error": "Se requiere 'filas' o 'columnas'"}, status_code=400)
+
+    longitudes = {len(valores) if isinstance(valores, list) else 1 for valores in columnas.values()}
+    if len(longitudes - {1}) > 1:
+        return JSONResponse({"error": "Todas las columnas deben tener la misma longitud"}, status_code=400)
+
+    try:
+        return await run_in_threadpool(
+            formula_engine.evaluar_lote,
+            formula_key,
+            columnas,
+            bool(data.get("incluir_pasos"))
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+# Patrones para remover prefijos de la consulta ("informacion de manzana" -> "manzana")
+PREFIJOS_A_REMOVER = [
+    re.compile(r'^informacion completa de\s+', re.IGNORECASE),
+    re.compile(r'^informacion de\s+', re.IGNORECASE),
+    re.compile(r'^datos de\s+', re.IGNORECASE),
+    re.compile(r'^aporta\s+', re.IGNORECASE),
+    re.compile(r'^cu[aá]nt[ao]s?\s+(?:calor[ií]as|prote[ií]nas|grasas|fibra|sodio)\s+.*\s+', re.IGNORECASE)
+]
+
+# Campos relevantes según el grupo de alimentos
+CAMPOS_POR_CATEGORIA = {
+    "verduras": ["cantidad", "energia (kcal)", "fibra (g)"],
+    "hortalizas": ["cantidad", "energia (kcal)", "fibra (g)"],
+    "frutas": ["cantidad", "energia (kcal)", "fibra (g)", "vitamina c (mg)"],
+    "cereales": ["cantidad", "energia (kcal)", "hidratos de carbono (g)", "fibra (g)"],
+    "legumbres": ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)"],
+    "frutos secos": ["cantidad", "energia (kcal)", "lipidos (g)", "proteina (g)"],
+    "carnes": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
+    "pescados": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
+    "lacteos": ["cantidad", "energia (kcal)", "proteina (g)", "calcio (mg)"],
+    "huevos": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
+    "aceites": ["cantidad", "energia (kcal)", "lipidos (g)"],
+    "bebidas": ["cantidad", "energia (kcal)", "hidratos de carbono (g)"],
+    "azucares": ["cantidad", "energia (kcal)", "hidratos de carbono (g)"],
+    "miscelaneos": ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)", "lipidos (g)"]
+}
+
+# Campos por defecto si no se reconoce el grupo
+CAMPOS_DEFAULT = ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)", "lipidos (g)", "fibra (g)"]
+
+# Máximo de alimentos por petición a /alimentos/batch
+MAX_ALIMENTOS_LOTE = 200
+
+def limpiar_nombre_alimento(nombre):
+    """Extrae el nombre real del alimento removiendo prefijos comunes de la consulta"""
+    nombre_limpio = nombre.strip().lower()
+    for patron in PREFIJOS_A_REMOVER:
+        nombre_limpio = patron.sub('', nombre_limpio)
+    return nombre_limpio.strip()
+
+def formatear_alimento(alimento_dict):
+    """Filas de la tabla de /alimento con los campos relevantes según el grupo del alimento"""
+    grupo = alimento_dict.get('grupo de alimentos', '').lower()
+    campos_relevantes = CAMPOS_POR_CATEGORIA.get(grupo, CAMPOS_DEFAULT)
+
+    # Crear filas con campos relevantes
+    info_basica = {
+        "Alimento": alimento_dict.get('alimento', 'N/A'),
+        "Grupo": alimento_dict.get('grupo de alimentos', 'N/A')
+    }
+
+    # Agregar campos relevantes
+    for campo in campos_relevantes:
+        if campo in alimento_dict:
+            valor = alimento_dict[campo]
+            # Formatear valores numéricos
+            try:
+                if isinstance(valor, (int, float)) and valor != 0:
+                    if campo == "cantidad":
+                        info_basica[f"Porción base"] = f"{valor} {alimento_dict.get('unidad', 'g')}"
+                    else:
+                        info_basica[campo.title()] = f"{valor} {campo.split('(')[-1].rstrip(')') if '(' in campo else ''}"
+                else:
+                    info_basica[campo.title()] = str(valor) if valor else "0"
+            except:
+                info_basica[campo.title()] = str(valor) if valor else "N/A"
+
+    return calcular_info_nutricional_basica(alimento_dict, info_basica)
+
+def formatear_variantes(rows):
+    """Sugerencias (máximo 2) a partir de los resultados que siguen al principal"""
+    variantes = []
+    for alt_dict in rows[1:3]:
+        variante = {
+            "alimento": alt_dict.get('alimento', ''),
+            "cantidad": f"{alt_dict.get('cantidad', 0)} {alt_dict.get('unidad', 'g')}",
+            "energia": f"{alt_dict.get('energia (kcal)', 0)} kcal"
+        }
+        if 'similitud' in alt_dict:
+            variante["similitud"] = alt_dict['similitud']
+        variantes.append(variante)
+    return variantes
+
+def mensaje_busqueda(nombre_limpio, alimento_dict, variantes, aproximado):
+    if aproximado:
+        return f"No se encontró '{nombre_limpio}'. ¿Quisiste decir '{alimento_dict.get('alimento', '')}'?"
+    if not variantes:
+        return f"Se encontró una coincidencia exacta para '{nombre_limpio}'."
+    return f"No se encontró una coincidencia exacta para '{nombre_limpio}'. Mostrando la opción más similar y algunas variantes."
+
 @app.get("/alimento")
 def buscar_alimento(nombre: str = Query(..., description="Nombre del alimento a buscar")):
     print(f"[LOG] /alimento endpoint called with nombre={nombre}")
@@ -557,150 +955,379 @@ def buscar_alimento(nombre: str = Query(..., description="Nombre del alimento a
         return JSONResponse({"error": "Nombre de alimento requerido (mínimo 2 caracteres)"}, status_code=400)
 
     try:
-        # Extraer el nombre real del alimento removiendo prefijos comunes
-        nombre_limpio = nombre.strip().lower()
-
-        # Patrones para remover prefijos
-        prefijos_a_remover = [
-            r'^informacion completa de\s+',
-            r'^informacion de\s+',
-            r'^datos de\s+',
-            r'^aporta\s+',
-            r'^cu[aá]nt[ao]s?\s+(?:calor[ií]as|prote[ií]nas|grasas|fibra|sodio)\s+.*\s+'
-        ]
-
-        import re
-        for patron in prefijos_a_remover:
-            nombre_limpio = re.sub(patron, '', nombre_limpio, flags=re.IGNORECASE)
-
-        nombre_limpio = nombre_limpio.strip()
+        nombre_limpio = limpiar_nombre_alimento(nombre)
 
         if not nombre_limpio or len(nombre_limpio) < 2:
             return JSONResponse({"error": "No se pudo extraer un nombre de alimento válido"}, status_code=400)
 
         print(f"[LOG] Nombre limpio extraído: '{nombre_limpio}'")
 
-        # Buscar en base de datos
-        columns, rows = get_alimentos_by_name(nombre_limpio)
+        # Buscar en base de datos; si no hay coincidencias, por similitud (errores de escritura)
+        rows = get_alimentos_by_name(nombre_limpio)
+        aproximado = not rows
+        if aproximado:
+            rows = get_alimentos_aproximados(nombre_limpio, 3)
 
-        if not columns or not rows:
+        if not rows:
             return JSONResponse({
                 "error": f"No se encontraron alimentos que coincidan con '{nombre_limpio}'"
             }, status_code=404)
 
-        # Procesar resultados
-        filas = []
-        variantes = []
-
-        # Obtener el primer resultado (más relevante)
-        alimento_dict = dict(zip(columns, rows[0]))
-
-        # Determinar campos relevantes según el grupo de alimentos
-        grupo = alimento_dict.get('grupo de alimentos', '').lower()
-
-        campos_por_categoria = {
-            "verduras": ["cantidad", "energia (kcal)", "fibra (g)"],
-            "hortalizas": ["cantidad", "energia (kcal)", "fibra (g)"],
-            "frutas": ["cantidad", "energia (kcal)", "fibra (g)", "vitamina c (mg)"],
-            "cereales": ["cantidad", "energia (kcal)", "hidratos de carbono (g)", "fibra (g)"],
-            "legumbres": ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)"],
-            "frutos secos": ["cantidad", "energia (kcal)", "lipidos (g)", "proteina (g)"],
-            "carnes": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
-            "pescados": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
-            "lacteos": ["cantidad", "energia (kcal)", "proteina (g)", "calcio (mg)"],
-            "huevos": ["cantidad", "energia (kcal)", "proteina (g)", "lipidos (g)"],
-            "aceites": ["cantidad", "energia (kcal)", "lipidos (g)"],
-            "bebidas": ["cantidad", "energia (kcal)", "hidratos de carbono (g)"],
-            "azucares": ["cantidad", "energia (kcal)", "hidratos de carbono (g)"],
-            "miscelaneos": ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)", "lipidos (g)"]
+        # El primer resultado es el más relevante; los siguientes, variantes
+        alimento_dict = rows[0]
+        variantes = formatear_variantes(rows)
+
+        return {
+            "filas": formatear_alimento(alimento_dict),
+            "mensaje": mensaje_busqueda(nombre_limpio, alimento_dict, variantes, aproximado),
+            "sugerencias": variantes
         }
 
-        # Campos por defecto si no se reconoce el grupo
-        campos_default = ["cantidad", "energia (kcal)", "proteina (g)", "hidratos de carbono (g)", "lipidos (g)", "fibra (g)"]
+    except Exception as e:
+        print(f"[LOG] /alimento exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
 
-        campos_relevantes = campos_por_categoria.get(grupo, campos_default)
+def resolver_alimentos_lote(nombres):
+    """
+    Resuelve una lista de nombres de alimentos como /alimento pero en lote. Los nombres
+    repetidos se buscan una vez y todos pasan juntos por la búsqueda por nombre (una sentencia
+    por etapa de la búsqueda, no una por nombre); los que no dan resultados, por la búsqueda
+    aproximada. Se guardan hasta 3 candidatos por nombre para dar las mismas sugerencias que
+    /alimento. Devuelve un resultado por nombre, en el mismo orden de entrada.
+    """
+    from utils.busqueda import buscar_alimentos_aproximados_lote, buscar_alimentos_por_nombre_lote
+    from utils.texto import normalizar_texto
 
-        # Crear filas con campos relevantes
-        info_basica = {
-            "Alimento": alimento_dict.get('alimento', 'N/A'),
-            "Grupo": alimento_dict.get('grupo de alimentos', 'N/A')
-        }
+    limpios = [limpiar_nombre_alimento(nombre) if isinstance(nombre, str) else "" for nombre in nombres]
+    validos = [limpio for limpio in limpios if len(limpio) >= 2]
 
-        # Agregar campos relevantes
-        for campo in campos_relevantes:
-            if campo in alimento_dict:
-                valor = alimento_dict[campo]
-                # Formatear valores numéricos
-                try:
-                    if isinstance(valor, (int, float)) and valor != 0:
-                        if campo == "cantidad":
-                            info_basica[f"Porción base"] = f"{valor} {alimento_dict.get('unidad', 'g')}"
-                        else:
-                            info_basica[campo.title()] = f"{valor} {campo.split('(')[-1].rstrip(')') if '(' in campo else ''}"
-                    else:
-                        info_basica[campo.title()] = str(valor) if valor else "0"
-                except:
-                    info_basica[campo.title()] = str(valor) if valor else "N/A"
-
-        filas = calcular_info_nutricional_basica(alimento_dict, info_basica)
-
-        # Buscar variantes si hay más resultados
-        if len(rows) > 1:
-            for row in rows[1:3]:  # Máximo 2 variantes
-                alt_dict = dict(zip(columns, row))
-                variantes.append({
-                    "alimento": alt_dict.get('alimento', ''),
-                    "cantidad": f"{alt_dict.get('cantidad', 0)} {alt_dict.get('unidad', 'g')}",
-                    "energia": f"{alt_dict.get('energia (kcal)', 0)} kcal"
-                })
-
-        mensaje = (
-            f"Se encontró una coincidencia exacta para '{nombre_limpio}'."
-            if not variantes else
-            f"No se encontró una coincidencia exacta para '{nombre_limpio}'. Mostrando la opción más similar y algunas variantes."
-        )
+    # Por nombre normalizado: (estado, hasta 3 filas, la más relevante primero)
+    resueltos = {}
+    for normalizado, rows in buscar_alimentos_por_nombre_lote(validos, 3).items():
+        if rows:
+            exacto = normalizar_texto(rows[0].get('alimento', '')) == normalizado
+            resueltos[normalizado] = ("exacto" if exacto else "encontrado", rows)
+    sin_resultados = [limpio for limpio in validos if normalizar_texto(limpio) not in resueltos]
+    for normalizado, rows in buscar_alimentos_aproximados_lote(sin_resultados, 3).items():
+        resueltos[normalizado] = ("aproximado", rows) if rows else ("no_encontrado", [])
 
-        return {
-            "filas": filas,
-            "mensaje": mensaje,
+    resultados = []
+    for indice, (nombre, limpio) in enumerate(zip(nombres, limpios)):
+        resultado = {"indice": indice, "consulta": nombre}
+        if len(limpio) < 2:
+            resultados.append({**resultado, "estado": "invalido", "error": "No se pudo extraer un nombre de alimento válido"})
+            continue
+
+        estado, rows = resueltos.get(normalizar_texto(limpio), ("no_encontrado", []))
+        if not rows:
+            resultados.append({**resultado, "estado": "no_encontrado", "filas": [], "sugerencias": [],
+                               "mensaje": f"No se encontraron alimentos que coincidan con '{limpio}'"})
+            continue
+
+        alimento_dict = rows[0]
+        variantes = formatear_variantes(rows)
+        resultados.append({
+            **resultado,
+            "estado": estado,
+            "alimento": alimento_dict.get('alimento', ''),
+            "filas": formatear_alimento(alimento_dict),
+            "mensaje": mensaje_busqueda(limpio, alimento_dict, variantes, estado == "aproximado"),
             "sugerencias": variantes
-        }
+        })
+    return resultados
+
+@app.post("/alimentos/batch")
+async def buscar_alimentos_lote(request: Request):
+    """
+    Consulta varios alimentos en una sola petición (ej. cargar un diario de comidas).
+    Body: {"nombres": ["manzana", "arroz integral", "platno"]}
+    Devuelve un resultado por nombre, en el mismo orden, con el mismo formato de /alimento más
+    "estado": exacto | encontrado | aproximado | no_encontrado | invalido.
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Body JSON inválido"}, status_code=400)
 
+    nombres = data.get("nombres") if isinstance(data, dict) else None
+    if not isinstance(nombres, list) or not nombres:
+        return JSONResponse({"error": "Se requiere 'nombres': lista de nombres de alimentos"}, status_code=400)
+    if len(nombres) > MAX_ALIMENTOS_LOTE:
+        return JSONResponse({"error": f"Máximo {MAX_ALIMENTOS_LOTE} alimentos por petición"}, status_code=400)
+
+    print(f"[LOG] /alimentos/batch endpoint called with {len(nombres)} nombres")
+    try:
+        resultados = await run_in_threadpool(resolver_alimentos_lote, nombres)
     except Exception as e:
-        print(f"[LOG] /alimento exception: {e}")
+        print(f"[LOG] /alimentos/batch exception: {e}")
         return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
 
-# Variables globales para el progreso de inicio del backend
-backend_startup_status = {
-    "status": "ready",  # ready, loading, error
-    "progress_percentage": 100,
-    "current_step": "Backend listo y funcionando",
-    "total_steps": 4,
-    "current_step_number": 4,
-    "error_message": ""
-}
+    return {
+        "total": len(resultados),
+        "encontrados": sum(1 for r in resultados if r["estado"] in ("exacto", "encontrado", "aproximado")),
+        "resultados": resultados
+    }
+
+@app.get("/alimentos/export")
+def exportar_alimentos_endpoint(
+    format: str = Query("ndjson", description="ndjson, csv o arrow"),
+    columnas: str = Query(None, description="Columnas separadas por coma (por defecto, todas)"),
+    grupo: list = Query(None, description="Grupo de alimentos a incluir (repetible)"),
+    tamano_bloque: int = Query(1000, description="Filas por bloque")
+):
+    """
+    Exporta la tabla alimentos en streaming (utils/exportar.py), bloque a bloque y sin cargarla
+    completa en memoria. Ejemplo: /alimentos/export?format=csv&columnas=alimento,energia (kcal)&grupo=frutas
+    """
+    print(f"[LOG] /alimentos/export endpoint called with format={format}, columnas={columnas}, grupo={grupo}")
+    from utils.exportar import EXTENSIONES, FORMATOS, exportar_alimentos
+
+    seleccion = [c.strip() for c in columnas.split(",") if c.strip()] if columnas else None
+    try:
+        contenido = exportar_alimentos(format, seleccion, grupo or [], tamano_bloque)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=501)
+    except Exception as e:
+        print(f"[LOG] /alimentos/export exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
+
+    return StreamingResponse(
+        contenido,
+        media_type=FORMATOS[format],
+        headers={"Content-Disposition": f'attachment; filename="alimentos.{EXTENSIONES[format]}"'}
+    )
+
+@app.get("/alimento/{id_alimento}/similares")
+def alimentos_similares(request: Request, id_alimento: int, k: int = 5, mismo_grupo: bool = True,
+                        menos: str = None, mas: str = None):
+    """
+    Sustitutos de un alimento: los más parecidos por perfil de nutrientes (utils/similares.py).
+    menos/mas: nutrientes separados por coma en los que el sustituto debe tener menos/más que el original.
+    Admite además criterios absolutos como en /alimentos/filtrar (sodio_max, fibra_min, ...).
+    Ejemplo: /alimento/42/similares?menos=sodio&mismo_grupo=true&k=5
+    """
+    print(f"[LOG] /alimento/{id_alimento}/similares endpoint called with {dict(request.query_params)}")
+    from utils.similares import get_buscador_similares
+
+    criterios = {}
+    for clave, valor in request.query_params.items():
+        if clave.endswith("_min") or clave.endswith("_max"):
+            try:
+                criterios[clave] = float(valor)
+            except ValueError:
+                return JSONResponse({"error": f"El criterio '{clave}' debe ser numérico"}, status_code=400)
+
+    separar = lambda texto: [n.strip() for n in texto.split(",") if n.strip()] if texto else []
+    try:
+        return get_buscador_similares().similares(
+            id_alimento, max(1, min(k, 50)), mismo_grupo, separar(menos), separar(mas), criterios
+        )
+    except KeyError as e:
+        return JSONResponse({"error": str(e.args[0])}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        print(f"[LOG] /alimento/{id_alimento}/similares exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
+
+@app.get("/alimentos/filtrar")
+def filtrar_alimentos(request: Request, limite: int = 10, ordenar_por: str = "energia_kcal", descendente: bool = False,
+                      despues_de: str = None):
+    """
+    Filtra alimentos por nutrientes sobre la matriz en memoria (utils/matriz_nutrientes.py).
+    Criterios como query params: sodio_max, fibra_min, proteina_min, calorias_max, grupo, nombre_like...
+    Ejemplo: /alimentos/filtrar?sodio_max=100&fibra_min=5&ordenar_por=proteina_g&descendente=true
+    Paginación: repetir la consulta con despues_de=<siguiente> de la respuesta anterior.
+    """
+    print(f"[LOG] /alimentos/filtrar endpoint called with {dict(request.query_params)}")
+    from utils.matriz_nutrientes import filtrar_alimentos
+
+    criterios = {}
+    for clave, valor in request.query_params.items():
+        if clave in ("limite", "ordenar_por", "descendente", "despues_de"):
+            continue
+        if clave.endswith("_min") or clave.endswith("_max"):
+            try:
+                criterios[clave] = float(valor)
+            except ValueError:
+                return JSONResponse({"error": f"El criterio '{clave}' debe ser numérico"}, status_code=400)
+        else:
+            criterios[clave] = valor
+
+    try:
+        pagina = filtrar_alimentos(criterios, max(0, min(limite, 500)), ordenar_por, descendente, despues_de)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        print(f"[LOG] /alimentos/filtrar exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
+
+    return {
+        "encontrados": len(pagina["alimentos"]),
+        "limite": limite,
+        "criterios_aplicados": criterios,
+        "alimentos": pagina["alimentos"],
+        "siguiente": pagina["siguiente"]
+    }
+
+@app.post("/composicion")
+async def calcular_composicion(request: Request):
+    """
+    Composición nutricional de una receta o plan de comidas.
+    Body: {"ingredientes": ["manzana", {"alimento": "arroz", "gramos": 150}, {"alimento": "pollo", "porcion": 1.5}]}
+    Devuelve totales por nutriente y el desglose por ingrediente en el orden de entrada.
+    """
+    print("[LOG] /composicion endpoint called")
+    from calculos.nutricion import calcular_composicion_receta
+
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Body JSON inválido"}, status_code=400)
+
+    ingredientes = data.get("ingredientes") if isinstance(data, dict) else None
+    if not isinstance(ingredientes, list) or not ingredientes:
+        return JSONResponse({"error": "'ingredientes' debe ser una lista no vacía"}, status_code=400)
+
+    normalizados = []
+    for i, ingrediente in enumerate(ingredientes):
+        if isinstance(ingrediente, str):
+            ingrediente = {"alimento": ingrediente}
+        if not isinstance(ingrediente, dict) or not str(ingrediente.get("alimento", "")).strip():
+            return JSONResponse({"error": f"Ingrediente {i}: se requiere 'alimento'"}, status_code=400)
+        for campo in ("gramos", "porcion"):
+            valor = ingrediente.get(campo)
+            if valor is not None and (isinstance(valor, bool) or not isinstance(valor, (int, float)) or valor < 0):
+                return JSONResponse({"error": f"Ingrediente {i}: '{campo}' debe ser un número positivo"}, status_code=400)
+        normalizados.append(ingrediente)
+
+    try:
+        return await run_in_threadpool(calcular_composicion_receta, normalizados)
+    except Exception as e:
+        print(f"[LOG] /composicion exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
+
+def respuesta_diario(operacion, *args, **kwargs):
+    """Ejecuta una operación del diario traduciendo sus errores a respuestas HTTP"""
+    try:
+        return operacion(*args, **kwargs)
+    except KeyError as e:
+        return JSONResponse({"error": str(e.args[0])}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        print(f"[LOG] /diario exception: {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {str(e)}"}, status_code=500)
+
+@app.post("/diario/entradas")
+async def agregar_entrada_diario(request: Request):
+    """
+    Registra un alimento consumido en el diario (utils/diario.py).
+    Body: {"alimento_id": 42, "gramos": 150, "momento": "2024-05-01T08:30"}  (momento opcional: ahora)
+    Devuelve la entrada con sus nutrientes; los totales del día y la semana se actualizan al instante.
+    """
+    print("[LOG] /diario/entradas endpoint called")
+    from utils.diario import get_diario
+
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Body JSON inválido"}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "El body debe ser un objeto JSON"}, status_code=400)
+    if data.get("alimento_id") is None:
+        return JSONResponse({"error": "Se requiere 'alimento_id'"}, status_code=400)
+    return await run_in_threadpool(respuesta_diario, get_diario().agregar, data["alimento_id"], data.get("gramos"), data.get("momento"))
+
+@app.patch("/diario/entradas/{id_entrada}")
+async def editar_entrada_diario(id_entrada: int, request: Request):
+    """Cambia alimento_id, gramos o momento de una entrada. Body: {"gramos": 200}"""
+    print(f"[LOG] /diario/entradas/{id_entrada} PATCH endpoint called")
+    from utils.diario import get_diario
+
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Body JSON inválido"}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "El body debe ser un objeto JSON"}, status_code=400)
+    return await run_in_threadpool(
+        respuesta_diario, get_diario().editar, id_entrada, data.get("alimento_id"), data.get("gramos"), data.get("momento")
+    )
+
+@app.delete("/diario/entradas/{id_entrada}")
+def eliminar_entrada_diario(id_entrada: int):
+    """Borra una entrada del diario y la descuenta de los totales"""
+    print(f"[LOG] /diario/entradas/{id_entrada} DELETE endpoint called")
+    from utils.diario import get_diario
+    return respuesta_diario(get_diario().eliminar, id_entrada)
+
+@app.get("/diario/entradas")
+def listar_entradas_diario(desde: str = None, hasta: str = None, limite: int = 500):
+    """Entradas del diario entre dos fechas YYYY-MM-DD (inclusive). Ejemplo: /diario/entradas?desde=2024-05-01"""
+    from utils.diario import get_diario, parsear_fecha
+
+    def listar():
+        return {"entradas": get_diario().entradas(parsear_fecha(desde), parsear_fecha(hasta), max(1, min(limite, 5000)))}
+    return respuesta_diario(listar)
+
+@app.get("/diario/resumen")
+def resumen_diario(periodo: str = "dia", desde: str = None, hasta: str = None):
+    """
+    Totales de nutrientes por día o por semana, leídos de los totales materializados del diario.
+    Ejemplo: /diario/resumen?periodo=semana&desde=2024-01-01&hasta=2024-12-31
+    """
+    print(f"[LOG] /diario/resumen endpoint called: periodo={periodo}, desde={desde}, hasta={hasta}")
+    from utils.diario import get_diario, parsear_fecha
+
+    def resumir():
+        return get_diario().resumen(periodo, parsear_fecha(desde), parsear_fecha(hasta))
+    return respuesta_diario(resumir)
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Estadísticas de la caché de consultas de alimentos: entradas, memoria y tasa de aciertos"""
+    from utils.cache import get_cache_consultas
+    return get_cache_consultas().get_stats()
+
+@app.post("/cache/limpiar")
+def limpiar_cache():
+    """Vacía la caché de consultas de alimentos"""
+    from utils.cache import get_cache_consultas
+    cache = get_cache_consultas()
+    cache.limpiar()
+    return cache.get_stats()
 
 @app.get("/backend/startup/progress")
 async def get_backend_startup_progress():
-    """Endpoint para obtener el progreso de inicio del backend"""
-    global backend_startup_status
-    return backend_startup_status
+    """Endpoint para obtener el progreso de inicio del backend (pasos reales de la carga del modelo)"""
+    return get_startup_status()
 
 @app.get("/model/current")
-def get_current_model():
+async def get_current_model():
     """Obtener información del modelo actual"""
     try:
-        ia_engine = get_ia_engine()
+        ia_engine = peek_ia_engine()
+        if ia_engine is None:
+            return {"key": None, "is_ready": False, "startup": get_startup_status()}
         return ia_engine.get_current_model()
     except Exception as e:
         return {"error": f"Error al obtener información del modelo: {str(e)}"}
 
 @app.get("/model/status")
-def get_model_status():
+async def get_model_status():
     """Endpoint para verificar el estado del modelo"""
     try:
-        ia_engine = get_ia_engine()
-        status = ia_engine.get_status()
+        ia_engine = peek_ia_engine()
+        if ia_engine is None:
+            startup = get_startup_status()
+            status = {"status": "error" if startup["status"] == "error" else "loading", "message": startup["error_message"] or startup["current_step"]}
+        else:
+            status = ia_engine.get_status()
+            if status.get("status") == "loading":
+                status["message"] = f"Cargando modelo: {get_startup_status()['current_step']}"
         return {
             "model_name": status.get("model_name", "Unknown"),
             "device": status.get("device", "Unknown"),
@@ -732,14 +1359,16 @@ def switch_model(request: dict):
         if not model_key:
             return {"error": "Se requiere 'model_key' en el body"}
         
-        ia_engine = get_ia_engine()
-        success = ia_engine.switch_model(model_key)
+        # Tras una carga fallida se permite cambiar de modelo (o reintentar el mismo) sin esperar al reintento
+        if get_loaded_ia_engine() is None and (peek_ia_engine() is None or get_startup_status()["status"] != "error"):
+            return model_loading_response()
+        success = switch_ia_engine(model_key)
         
         if success:
             return {
                 "success": True,
                 "message": f"Modelo cambiado a {model_key}",
-                "current_model": ia_engine.get_current_model()
+                "current_model": peek_ia_engine().get_current_model()
             }
         else:
             return {"error": "No se pudo cambiar el modelo"}
@@ -748,10 +1377,12 @@ def switch_model(request: dict):
         return {"error": f"Error al cambiar modelo: {str(e)}"}
 
 @app.get("/model/available")
-def get_available_models():
+async def get_available_models():
     """Obtener lista de modelos disponibles"""
     try:
-        ia_engine = get_ia_engine()
+        ia_engine = peek_ia_engine()
+        if ia_engine is None:
+            return {"models": {}, "current": None}
         return {
             "models": ia_engine.available_models,
             "current": ia_engine.current_model_key
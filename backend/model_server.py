@@ -0,0 +1,271 @@
+# model_server.py
+# Servidor de modelo compartido: un solo proceso carga el modelo y los workers de uvicorn
+# le envían sus generaciones por IPC local (engine "model-server", CALYX_MODEL_KEY=server)
+"""
+Uso:
+    python model_server.py [--modelo qwen2.5-3b-cpu] [--direccion /tmp/calyx-model-server.sock] [--max-pendientes 16]
+    CALYX_MODEL_KEY=server uvicorn main:app --workers 4
+
+Protocolo (multiprocessing.connection: socket Unix o named pipe en Windows, autenticado con
+CALYX_MODEL_SERVER_AUTHKEY o, si no está definida, con una clave aleatoria que el servidor escribe al
+arrancar en ~/.calyx/model-server.key con permisos 0600; CALYX_MODEL_SERVER_AUTHKEY_FILE cambia la
+ruta). Un diccionario por mensaje y una petición a la vez por conexión:
+    {"op": "generate", ...}                  -> {"type": "result", "text": ...}
+    {"op": "stream", ...}                    -> {"type": "chunk", "text": ...}* y {"type": "done"}
+    {"op": "status"}                         -> {"type": "status", "status": {...}}
+    {"op": "switch_model", "model_key": ...} -> {"type": "result", "ready": bool}
+Con max_pendientes generaciones en curso la petición se rechaza de inmediato con
+{"type": "busy", "error": ..., "retry_after_s": ...} en lugar de encolarse sin límite.
+Cerrar la conexión con una generación en curso la cancela.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing.connection import AuthenticationError, Listener
+from threading import Event, Lock, Thread
+
+from ai_engine import GenerationCancelled, IAEngine, default_model_server_address, model_server_authkey
+
+
+class ModelServer:
+    """Atiende a los workers: cada conexión en su propio hilo, generaciones a través del IAEngine compartido"""
+
+    # Segundos sugeridos al worker para reintentar cuando la cola está llena
+    RETRY_AFTER_S = 1.0
+    # Intervalo con el que se revisa si el worker cerró la conexión durante una generación
+    POLL_INTERVAL_S = 0.05
+
+    def __init__(self, ia_engine, address, max_pending=16):
+        self.ia_engine = ia_engine
+        self.address = address
+        self.max_pending = max(1, int(max_pending))
+        # Las peticiones admitidas llegan juntas al scheduler y pueden agruparse en un batch
+        self.executor = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix="calyx-model-server")
+        self.lock = Lock()
+        self.switch_lock = Lock()
+        self.in_flight = 0
+        self.stats = {"connections": 0, "requests_served": 0, "rejected_busy": 0, "cancelled": 0, "errors": 0}
+
+    def serve_forever(self):
+        if os.name != "nt" and os.path.exists(self.address):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.address)
+            except OSError:
+                # Socket de una ejecución anterior que no se cerró limpiamente
+                os.unlink(self.address)
+            else:
+                raise RuntimeError(f"Ya hay un servidor de modelo escuchando en {self.address}")
+            finally:
+                probe.close()
+
+        # Clave nueva en cada arranque (salvo que venga de CALYX_MODEL_SERVER_AUTHKEY)
+        authkey = model_server_authkey(create=True)
+        if os.name == "nt":
+            listener = Listener(self.address, authkey=authkey)
+        else:
+            # El socket nace con permisos 0600: no hay un instante tras el bind en que otro usuario pueda conectarse
+            previous_umask = os.umask(0o177)
+            try:
+                listener = Listener(self.address, authkey=authkey)
+            finally:
+                os.umask(previous_umask)
+        print(f"[ModelServer] Escuchando en {self.address} (máximo {self.max_pending} generaciones en curso)")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    print(f"[ModelServer] [WARNING] Conexión rechazada: {e}")
+                    continue
+                self._count("connections")
+                Thread(target=self._handle_connection, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def get_status(self):
+        """Estado del modelo (igual que /model/status) más la ocupación del servidor"""
+        status = self.ia_engine.get_status()
+        status["model_server"] = {"address": self.address, "in_flight": self.in_flight, "max_pending": self.max_pending, **self.stats}
+        return status
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _admit(self):
+        """Reservar un lugar para una generación; False si ya hay max_pending en curso"""
+        with self.lock:
+            if self.in_flight >= self.max_pending:
+                self.stats["rejected_busy"] += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def _release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _handle_connection(self, connection):
+        try:
+            while True:
+                try:
+                    message = connection.recv()
+                except (OSError, EOFError):
+                    return
+                if not self._dispatch(connection, message):
+                    return
+        finally:
+            connection.close()
+
+    def _dispatch(self, connection, message):
+        """Atender un mensaje; devuelve False si la conexión debe cerrarse (worker desconectado o petición cancelada)"""
+        op = message.get("op")
+        try:
+            if op == "status":
+                connection.send({"type": "status", "status": self.get_status()})
+                return True
+            if op == "switch_model":
+                return self._switch_model(connection, message.get("model_key"))
+            if op not in ("generate", "stream"):
+                connection.send({"type": "error", "error": f"Operación no soportada: {op}"})
+                return True
+
+            if not self._admit():
+                connection.send({
+                    "type": "busy",
+                    "error": f"Servidor de modelo ocupado ({self.max_pending} generaciones en curso)",
+                    "retry_after_s": self.RETRY_AFTER_S
+                })
+                return True
+            try:
+                if op == "generate":
+                    return self._generate(connection, message)
+                return self._stream(connection, message)
+            finally:
+                self._release()
+        except (OSError, EOFError):
+            return False
+
+    def _generation_args(self, message):
+        return (message["user_prompt"],), {
+            "system_prompt": message.get("system_prompt"),
+            "max_new_tokens": message.get("max_new_tokens", 120),
+            "temperature": message.get("temperature", 0.3),
+            "top_p": message.get("top_p", 0.8)
+        }
+
+    def _cancelled(self, connection, cancel_event):
+        """
+        El worker no envía nada mientras espera su respuesta: si la conexión tiene algo que leer
+        es porque la cerró (o violó el protocolo), así que la generación se cancela
+        """
+        if not connection.poll():
+            return False
+        cancel_event.set()
+        self._count("cancelled")
+        print("[ModelServer] [CANCEL] El worker cerró la conexión, generación cancelada")
+        return True
+
+    def _generate(self, connection, message):
+        args, kwargs = self._generation_args(message)
+        cancel_event = Event()
+        future = self.executor.submit(self.ia_engine.generate, *args, cancel_event=cancel_event, **kwargs)
+        while not wait([future], timeout=self.POLL_INTERVAL_S).done:
+            if self._cancelled(connection, cancel_event):
+                return False
+
+        try:
+            text = future.result()
+        except GenerationCancelled:
+            return False
+        except Exception as e:
+            self._count("errors")
+            print(f"[ModelServer] [ERROR] Error en generación: {e}")
+            connection.send({"type": "error", "error": str(e)})
+            return True
+
+        connection.send({"type": "result", "text": text})
+        self._count("requests_served")
+        return True
+
+    def _stream(self, connection, message):
+        args, kwargs = self._generation_args(message)
+        cancel_event = Event()
+        chunks = None
+        try:
+            chunks = self.ia_engine.generate_stream(*args, cancel_event=cancel_event, **kwargs)
+            for text in chunks:
+                if self._cancelled(connection, cancel_event):
+                    return False
+                connection.send({"type": "chunk", "text": text})
+        except (OSError, EOFError):
+            cancel_event.set()
+            self._count("cancelled")
+            return False
+        except Exception as e:
+            self._count("errors")
+            print(f"[ModelServer] [ERROR] Error en streaming: {e}")
+            connection.send({"type": "error", "error": str(e)})
+            return True
+        finally:
+            if chunks is not None:
+                # Cerrar el generador detiene model.generate si la generación no terminó
+                chunks.close()
+
+        connection.send({"type": "done"})
+        self._count("requests_served")
+        return True
+
+    def _switch_model(self, connection, model_key):
+        config = self.ia_engine.available_models.get(model_key)
+        if config is not None and config["engine"] == "model-server":
+            connection.send({"type": "error", "error": f"'{model_key}' es el cliente del servidor de modelo, no un modelo"})
+            return True
+        try:
+            with self.switch_lock:
+                ready = self.ia_engine.switch_model(model_key)
+        except ValueError as e:
+            connection.send({"type": "error", "error": str(e)})
+            return True
+        connection.send({"type": "result", "ready": ready})
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de modelo compartido para los workers de uvicorn")
+    parser.add_argument("--modelo", default=os.environ.get("CALYX_MODEL_SERVER_MODEL_KEY"),
+                        help="Clave de available_models a cargar (por defecto, según el hardware)")
+    parser.add_argument("--nombre", help="Checkpoint a cargar en lugar del configurado para el modelo")
+    parser.add_argument("--direccion", default=os.environ.get("CALYX_MODEL_SERVER_ADDRESS") or default_model_server_address(),
+                        help="Socket Unix (o named pipe en Windows) donde escuchar")
+    parser.add_argument("--max-pendientes", type=int, default=int(os.environ.get("CALYX_MODEL_SERVER_MAX_PENDING", "16")),
+                        help="Generaciones en curso a partir de las cuales se responde 'ocupado'")
+    args = parser.parse_args()
+
+    # Los workers usan CALYX_MODEL_KEY=server; este proceso carga el modelo real
+    if args.modelo:
+        os.environ["CALYX_MODEL_KEY"] = args.modelo
+    elif os.environ.get("CALYX_MODEL_KEY") == "server":
+        del os.environ["CALYX_MODEL_KEY"]
+
+    ia_engine = IAEngine(model_name=args.nombre)
+    if ia_engine.current_engine == "model-server":
+        raise SystemExit("El servidor de modelo no puede usar el engine 'model-server': elige un modelo con --modelo")
+    if not ia_engine.is_ready():
+        print(f"[ModelServer] [WARNING] Modelo no disponible: {ia_engine.model_error}")
+
+    # SIGTERM sale por el mismo camino que Ctrl+C para cerrar el listener (y borrar el socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        ModelServer(ia_engine, args.direccion, args.max_pendientes).serve_forever()
+    except KeyboardInterrupt:
+        print("[ModelServer] Detenido")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,13 @@ import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 def load_model(model_name):
     print(f"Cargando {model_name}...")
+    if model_name == "qwen2.5-3b-cpu" or (model_name == "qwen2.5-3b" and not torch.cuda.is_available()):
+        # Sin CUDA no hay cuantización 4-bit (bitsandbytes): pesos bf16/fp32 o int8 dinámico en CPU
+        from ai_engine import configure_cpu_threads, load_cpu_model
+        threads = configure_cpu_threads()
+        tokenizer, model, precision = load_cpu_model("Qwen/Qwen2.5-3B-Instruct", os.environ.get("CALYX_CPU_PRECISION", "auto"))
+        print(f"Usando CPU ({precision}, {threads} hilos) para Qwen2.5-3B")
+        return tokenizer, model
     if model_name == "qwen2.5-3b":
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
@@ -17,7 +24,7 @@ def load_model(model_name):
         print("Usando cuantizacion 4-bit para Qwen2.5-3B")
         full_model_name = "Qwen/Qwen2.5-3B-Instruct"
     else:
-        print(f"Modelo '{model_name}' no soportado. Solo disponible: qwen2.5-3b")
+        print(f"Modelo '{model_name}' no soportado. Disponibles: qwen2.5-3b, qwen2.5-3b-cpu")
         return None, None
     
     tokenizer = AutoTokenizer.from_pretrained(full_model_name, trust_remote_code=True)
@@ -54,8 +61,9 @@ def chat_loop(tokenizer, model, model_name):
 def main():
     if len(sys.argv) != 2:
         print("Uso: python run.py <model_name>")
-        print("Modelo disponible:")
-        print("  qwen2.5-3b  - Qwen2.5-3B-Instruct (3.5GB con 4-bit)")
+        print("Modelos disponibles:")
+        print("  qwen2.5-3b  - Qwen2.5-3B-Instruct (3.5GB con 4-bit; en CPU si no hay CUDA)")
+        print("  qwen2.5-3b-cpu  - Qwen2.5-3B-Instruct en CPU (bf16/fp32, CALYX_CPU_PRECISION=int8 para int8 dinámico)")
         print("  (Espacio reservado para modelo grande en el futuro)")
         return
     
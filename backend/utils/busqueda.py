@@ -0,0 +1,211 @@
+# utils/busqueda.py
+# Búsqueda de alimentos por nombre sobre el índice normalizado de datainfo.db
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.cache import cache_consulta
+from utils.db import get_database
+from utils.texto import STOPWORDS, normalizar_texto, tokenizar
+
+# Límite de palabras de la consulta que se usan para filtrar por índice
+MAX_TOKENS_CONSULTA = 6
+
+# Peso de cada columna de alimentos_fts en bm25(): el nombre pesa más que el grupo
+PESOS_BM25 = (10.0, 1.0)
+
+# Consultas unidas por sentencia en las búsquedas por lote (límite de variables de SQLite)
+CONSULTAS_POR_SENTENCIA = 40
+
+ORDEN_RELEVANCIA = """
+    CASE WHEN b.nombre_normalizado = ? THEN 0
+         WHEN b.nombre_normalizado >= ? AND b.nombre_normalizado < ? THEN 1
+         ELSE 2 END
+"""
+
+
+def _rango_prefijo(prefijo: str) -> Tuple[str, str]:
+    """Rango [prefijo, fin) que recorre el índice B-tree igual que LIKE 'prefijo%'"""
+    return prefijo, prefijo + "\uffff"
+
+
+def condicion_nombre(consulta: str, columna_rowid: str = "alimentos.rowid") -> Tuple[str, List[Any]]:
+    """
+    Condición SQL (y parámetros) que selecciona los alimentos cuyo nombre contiene todas las
+    palabras de la consulta como prefijo de alguna palabra: "arroz int" -> arroz integral cocido.
+    Cada palabra se resuelve con un rango sobre la clave primaria de alimentos_tokens.
+    """
+    tokens = tokenizar(consulta)[:MAX_TOKENS_CONSULTA] or [normalizar_texto(consulta)]
+    subconsultas = []
+    params = []
+    for token in tokens:
+        subconsultas.append("SELECT alimento_rowid FROM alimentos_tokens WHERE token >= ? AND token < ?")
+        params.extend(_rango_prefijo(token))
+    return f"{columna_rowid} IN ({' INTERSECT '.join(subconsultas)})", params
+
+
+def _etapas_fts(normalizada: str, limite: int) -> Optional[List[Tuple[str, List[Any]]]]:
+    """
+    Consultas FTS5 de una búsqueda: primero con todas las palabras y, si hay varias, con cualquiera.
+    None si FTS5 no está disponible o la consulta no tiene palabras de 3+ letras.
+    """
+    db = get_database()
+    if not db.indice_nombres or not db.fts_disponible:
+        return None
+
+    # El tokenizador trigram no puede buscar términos de menos de 3 caracteres
+    terminos = [t for t in normalizada.split() if len(t) >= 3 and t not in STOPWORDS][:MAX_TOKENS_CONSULTA]
+    if not terminos:
+        return None
+
+    inicio, fin = _rango_prefijo(normalizada)
+    query = f"""
+        SELECT a.* FROM alimentos_fts f
+        JOIN alimentos_busqueda b ON b.alimento_rowid = f.rowid
+        JOIN alimentos a ON a.rowid = f.rowid
+        WHERE alimentos_fts MATCH ?
+        ORDER BY {ORDEN_RELEVANCIA}, bm25(alimentos_fts, {PESOS_BM25[0]}, {PESOS_BM25[1]}), LENGTH(b.nombre_normalizado)
+        LIMIT ?
+    """
+    operadores = (" AND ", " OR ") if len(terminos) > 1 else (" AND ",)
+    # Tras normalizar_texto solo quedan [a-z0-9], así que las comillas no necesitan escape
+    return [(query, [operador.join(f'"{termino}"' for termino in terminos), normalizada, inicio, fin, limite])
+            for operador in operadores]
+
+
+def _etapas_busqueda(normalizada: str, limite: int) -> List[Tuple[str, List[Any]]]:
+    """Consultas de buscar_alimentos_por_nombre en el orden en que se prueban: gana la primera con filas"""
+    if not get_database().indice_nombres:
+        # Base sin migrar (ej. archivo de solo lectura): búsqueda por LIKE como antes
+        return [(
+            "SELECT * FROM alimentos WHERE LOWER(alimento) LIKE ? ORDER BY LENGTH(alimento) ASC LIMIT ?",
+            [f"%{normalizada}%", limite]
+        )]
+
+    condicion, params = condicion_nombre(normalizada, "b.alimento_rowid")
+    inicio, fin = _rango_prefijo(normalizada)
+    orden = f"ORDER BY {ORDEN_RELEVANCIA}, LENGTH(b.nombre_normalizado) ASC LIMIT ?"
+    base = "SELECT a.* FROM alimentos_busqueda b JOIN alimentos a ON a.rowid = b.alimento_rowid"
+    return (_etapas_fts(normalizada, limite) or []) + [
+        (f"{base} WHERE {condicion} {orden}", [*params, normalizada, inicio, fin, limite]),
+        (f"{base} WHERE b.nombre_normalizado LIKE ? {orden}", [f"%{normalizada}%", normalizada, inicio, fin, limite])
+    ]
+
+
+def buscar_alimentos_fts(consulta: str, limite: int = 5) -> Optional[List[Dict[str, Any]]]:
+    """
+    Búsqueda de texto completo (FTS5 trigram) ordenada por relevancia BM25.
+    Cada palabra de la consulta se busca como subcadena por índice; primero se exige que estén
+    todas ("arroz integral cocido") y, si no hay resultados, basta con cualquiera de ellas.
+    Devuelve None si FTS5 no está disponible o la consulta no tiene palabras de 3+ letras.
+    """
+    etapas = _etapas_fts(normalizar_texto(consulta), limite)
+    if etapas is None:
+        return None
+    for query, params in etapas:
+        filas = get_database().fetchall(query, params)
+        if filas:
+            return filas
+    return []
+
+
+@cache_consulta("alimentos_por_nombre")
+def buscar_alimentos_por_nombre(consulta: str, limite: int = 5) -> List[Dict[str, Any]]:
+    """
+    Busca alimentos por nombre sin distinguir acentos ni mayúsculas ("platano" encuentra "Plátano").
+    Usa el índice FTS5 (relevancia BM25) cuando está disponible; si no, el índice de palabras.
+    Orden: coincidencia exacta, después nombres que empiezan con la consulta y al final
+    el resto de coincidencias; a igualdad, el más relevante o el nombre más corto.
+    """
+    normalizada = normalizar_texto(consulta)
+    if not normalizada:
+        return []
+
+    for query, params in _etapas_busqueda(normalizada, limite):
+        filas = get_database().fetchall(query, params)
+        if filas:
+            return filas
+    return []
+
+
+def buscar_alimentos_por_nombre_lote(consultas: List[str], limite: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    buscar_alimentos_por_nombre para muchas consultas a la vez: cada etapa de la búsqueda se
+    resuelve para todas las consultas pendientes con una sola sentencia (UNION ALL de las
+    consultas individuales) en lugar de una por nombre. Devuelve {consulta normalizada: filas}
+    con las mismas filas y el mismo orden que la búsqueda individual.
+    """
+    pendientes = {}
+    for consulta in consultas:
+        normalizada = normalizar_texto(consulta)
+        if normalizada and normalizada not in pendientes:
+            pendientes[normalizada] = _etapas_busqueda(normalizada, limite)
+    resultados = {normalizada: [] for normalizada in pendientes}
+
+    etapa = 0
+    while pendientes:
+        activas = [(normalizada, etapas[etapa]) for normalizada, etapas in pendientes.items() if etapa < len(etapas)]
+        for inicio in range(0, len(activas), CONSULTAS_POR_SENTENCIA):
+            bloque = activas[inicio:inicio + CONSULTAS_POR_SENTENCIA]
+            query = " UNION ALL ".join(f"SELECT {indice} AS lote_indice, * FROM ({sql})" for indice, (_, (sql, _)) in enumerate(bloque))
+            params = [param for _, (_, params_etapa) in bloque for param in params_etapa]
+            for fila in get_database().fetchall(query, params):
+                resultados[bloque[fila.pop("lote_indice")][0]].append(fila)
+        etapa += 1
+        pendientes = {normalizada: etapas for normalizada, etapas in pendientes.items()
+                      if not resultados[normalizada] and etapa < len(etapas)}
+    return resultados
+
+
+@cache_consulta("alimentos_aproximados")
+def buscar_alimentos_aproximados(consulta: str, limite: int = 5) -> List[Dict[str, Any]]:
+    """
+    Alimentos con nombre parecido a la consulta aunque tenga errores de escritura ("platno",
+    "yogurth"), según el buscador difuso de utils/difuso.py. Cada fila lleva su "similitud" (0-1).
+    """
+    from utils.difuso import get_buscador_difuso
+
+    sugerencias = get_buscador_difuso().sugerir(consulta, limite)
+    if not sugerencias:
+        return []
+
+    marcadores = ", ".join("?" * len(sugerencias))
+    filas = get_database().fetchall(
+        f"SELECT rowid AS alimento_rowid, * FROM alimentos WHERE rowid IN ({marcadores})",
+        [rowid for rowid, _, _ in sugerencias]
+    )
+    por_rowid = {fila.pop("alimento_rowid"): fila for fila in filas}
+    resultado = []
+    for rowid, _, similitud in sugerencias:
+        if rowid in por_rowid:
+            resultado.append({**por_rowid[rowid], "similitud": similitud})
+    return resultado
+
+
+def buscar_alimentos_aproximados_lote(consultas: List[str], limite: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    buscar_alimentos_aproximados para muchas consultas: el buscador difuso trabaja en memoria y las
+    filas de todas las sugerencias se leen juntas. Devuelve {consulta normalizada: filas}.
+    """
+    from utils.difuso import get_buscador_difuso
+
+    buscador = get_buscador_difuso()
+    sugerencias = {}
+    for consulta in consultas:
+        normalizada = normalizar_texto(consulta)
+        if normalizada not in sugerencias:
+            sugerencias[normalizada] = buscador.sugerir(normalizada, limite)
+
+    rowids = sorted({rowid for lista in sugerencias.values() for rowid, _, _ in lista})
+    por_rowid = {}
+    for inicio in range(0, len(rowids), 500):
+        bloque = rowids[inicio:inicio + 500]
+        marcadores = ", ".join("?" * len(bloque))
+        for fila in get_database().fetchall(
+            f"SELECT rowid AS alimento_rowid, * FROM alimentos WHERE rowid IN ({marcadores})", bloque
+        ):
+            por_rowid[fila.pop("alimento_rowid")] = fila
+
+    return {
+        normalizada: [{**por_rowid[rowid], "similitud": similitud} for rowid, _, similitud in lista if rowid in por_rowid]
+        for normalizada, lista in sugerencias.items()
+    }
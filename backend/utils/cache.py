@@ -0,0 +1,194 @@
+# utils/cache.py
+# Caché en memoria (LRU + TTL) de resultados de consultas de alimentos sobre datainfo.db
+
+import copy
+import functools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from utils.db import get_database
+from utils.texto import normalizar_texto
+
+# Límites por defecto; se pueden ajustar por variables de entorno
+DEFAULT_MAX_ENTRADAS = int(os.getenv("CALYX_CACHE_ENTRADAS", "5000"))
+DEFAULT_MAX_MB = float(os.getenv("CALYX_CACHE_MB", "32"))
+DEFAULT_TTL_SEGUNDOS = float(os.getenv("CALYX_CACHE_TTL", "600"))
+
+
+def _tamano_aproximado(valor: Any) -> int:
+    """Bytes aproximados que ocupa un resultado (listas/diccionarios de filas)"""
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(_tamano_aproximado(k) + _tamano_aproximado(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamano_aproximado(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+def _clave_hashable(valor: Any) -> Hashable:
+    """Convierte argumentos (dicts de criterios, listas) en una clave hashable y estable"""
+    if isinstance(valor, dict):
+        return tuple(sorted((str(k), _clave_hashable(v)) for k, v in valor.items()))
+    if isinstance(valor, (list, tuple)):
+        return tuple(_clave_hashable(v) for v in valor)
+    if isinstance(valor, str):
+        return valor.strip()
+    return valor
+
+
+class CacheConsultas:
+    """
+    Caché LRU con caducidad (TTL) y límite de memoria en MB, segura entre hilos.
+    Se vacía sola cuando cambia datainfo.db (mtime/tamaño del archivo o PRAGMA schema_version),
+    así nunca devuelve resultados de una versión anterior de la base.
+    """
+
+    def __init__(self, max_entradas: int = DEFAULT_MAX_ENTRADAS, max_mb: float = DEFAULT_MAX_MB,
+                 ttl_segundos: float = DEFAULT_TTL_SEGUNDOS, db=None):
+        self.db = db or get_database()
+        self.max_entradas = max_entradas
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_segundos = ttl_segundos
+
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._firma_archivo = None
+        self.version_esquema = None
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.expiradas = 0
+        self.desalojadas = 0
+        self.invalidaciones = 0
+
+    def _vigente(self) -> bool:
+        """Vacía la caché si datainfo.db cambió; False si la base no está disponible (no se cachea)"""
+        try:
+            estado = os.stat(self.db.db_path)
+        except OSError:
+            return False
+        firma = (estado.st_mtime_ns, estado.st_size)
+        if firma == self._firma_archivo:
+            return True
+
+        # La migración de índices escribe en el archivo; debe ocurrir antes de tomar la firma
+        self.db.indice_nombres
+        estado = os.stat(self.db.db_path)
+        fila = self.db.fetchone("PRAGMA schema_version")
+        version = fila["schema_version"] if fila else None
+        with self._lock:
+            if self._firma_archivo is not None:
+                self.invalidaciones += 1
+                print(f"[LOG] datainfo.db cambió; caché de consultas invalidada ({len(self._entradas)} entradas)")
+            self._entradas.clear()
+            self._bytes = 0
+            self._firma_archivo = (estado.st_mtime_ns, estado.st_size)
+            self.version_esquema = version
+        return True
+
+    def obtener(self, clave: Hashable) -> Tuple[bool, Any]:
+        """(True, valor) si la clave está en caché y no ha caducado; (False, None) si no"""
+        if not self._vigente():
+            return False, None
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return False, None
+            valor, expira, tamano = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                self._bytes -= tamano
+                self.expiradas += 1
+                self.fallos += 1
+                return False, None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+        # Copia para que quien llama pueda modificar el resultado sin alterar la caché
+        return True, copy.deepcopy(valor)
+
+    def guardar(self, clave: Hashable, valor: Any):
+        if not self._vigente():
+            return
+        valor = copy.deepcopy(valor)
+        tamano = _tamano_aproximado(valor)
+        if tamano > self.max_bytes:
+            return
+
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+            self._entradas[clave] = (valor, time.monotonic() + self.ttl_segundos, tamano)
+            self._bytes += tamano
+
+            # Desalojar las menos usadas recientemente hasta respetar ambos límites
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, _, tamano_desalojado) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_desalojado
+                self.desalojadas += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "memoria_mb": round(self._bytes / (1024 * 1024), 3),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 3),
+                "ttl_segundos": self.ttl_segundos,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "expiradas": self.expiradas,
+                "desalojadas": self.desalojadas,
+                "invalidaciones": self.invalidaciones,
+                "version_esquema": self.version_esquema
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_consultas() -> CacheConsultas:
+    """Instancia compartida de la caché de consultas"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheConsultas()
+    return _cache
+
+
+def cache_consulta(espacio: str) -> Callable:
+    """
+    Decorador que cachea el resultado de una función de consulta. La clave es el espacio, la
+    consulta (primer argumento) normalizada sin acentos ni mayúsculas y el resto de argumentos:
+    "Plátano", "platano" y " PLATANO " comparten entrada.
+    """
+    def decorador(funcion: Callable) -> Callable:
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if args and isinstance(args[0], str):
+                args = (normalizar_texto(args[0]),) + args[1:]
+            clave = (espacio, _clave_hashable(args), _clave_hashable(kwargs))
+
+            cache = get_cache_consultas()
+            encontrado, valor = cache.obtener(clave)
+            if encontrado:
+                return valor
+            valor = funcion(*args, **kwargs)
+            cache.guardar(clave, valor)
+            return valor
+
+        return envoltura
+    return decorador
@@ -0,0 +1,252 @@
+# utils/consulta_nutricional.py
+# Intérprete determinista de consultas nutricionales en español ("alimentos bajos en sodio y altos en fibra")
+# a criterios de buscar_alimentos_filtrados, sin pasar por el modelo
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.texto import quitar_acentos
+
+# Palabras del usuario -> prefijo de criterio ("<prefijo>_min" / "<prefijo>_max") y unidad del nutriente
+NUTRIENTES_CONSULTA = {
+    "sodio": ("sodio", "mg"),
+    "sal": ("sodio", "mg"),
+    "fibra": ("fibra", "g"),
+    "proteina": ("proteina", "g"),
+    "proteinas": ("proteina", "g"),
+    "grasa": ("lipidos", "g"),
+    "grasas": ("lipidos", "g"),
+    "lipidos": ("lipidos", "g"),
+    "calorias": ("calorias", "kcal"),
+    "kcal": ("calorias", "kcal"),
+    "energia": ("calorias", "kcal"),
+    "azucar": ("azucar", "g"),
+    "azucares": ("azucar", "g"),
+    "carbohidratos": ("hidratos", "g"),
+    "hidratos": ("hidratos", "g"),
+    "calcio": ("calcio", "mg"),
+    "hierro": ("hierro", "mg"),
+    "potasio": ("potasio", "mg")
+}
+
+# Umbrales por porción del SMAE para "bajo en", "alto en" y "sin" (los filtros son estrictos: < y >)
+UMBRALES = {
+    "sodio": {"bajo": 140, "alto": 400, "sin": 5},
+    "fibra": {"bajo": 1, "alto": 3},
+    "proteina": {"bajo": 2, "alto": 10},
+    "lipidos": {"bajo": 3, "alto": 10, "sin": 0.5},
+    "calorias": {"bajo": 40, "alto": 200, "sin": 5},
+    "azucar": {"bajo": 5, "alto": 12, "sin": 0.5},
+    "hidratos": {"bajo": 10, "alto": 30},
+    "calcio": {"bajo": 50, "alto": 120},
+    "hierro": {"bajo": 0.5, "alto": 2.5},
+    "potasio": {"bajo": 100, "alto": 350}
+}
+
+# Palabras del usuario -> criterio "grupo" (coincidencia parcial sin acentos con el grupo de alimentos)
+GRUPOS_CONSULTA = {
+    "fruta": "frutas", "frutas": "frutas",
+    "verdura": "verduras", "verduras": "verduras", "vegetales": "verduras", "hortalizas": "verduras",
+    "cereal": "cereales", "cereales": "cereales",
+    "leguminosa": "leguminosas", "leguminosas": "leguminosas",
+    "lacteo": "leche", "lacteos": "leche",
+    "carne": "origen animal", "carnes": "origen animal"
+}
+
+# Frases que introducen un criterio: palabras -> tipo ("bajo", "alto", "sin", "max", "min")
+MODIFICADORES = [
+    (("bajo", "en"), "bajo"), (("bajos", "en"), "bajo"), (("baja", "en"), "bajo"), (("bajas", "en"), "bajo"),
+    (("pobre", "en"), "bajo"), (("pobres", "en"), "bajo"),
+    (("con", "poco"), "bajo"), (("con", "poca"), "bajo"), (("con", "pocos"), "bajo"), (("con", "pocas"), "bajo"),
+    (("con", "menos"), "bajo"), (("poco",), "bajo"), (("poca",), "bajo"), (("pocos",), "bajo"), (("pocas",), "bajo"),
+    (("alto", "en"), "alto"), (("altos", "en"), "alto"), (("alta", "en"), "alto"), (("altas", "en"), "alto"),
+    (("rico", "en"), "alto"), (("ricos", "en"), "alto"), (("rica", "en"), "alto"), (("ricas", "en"), "alto"),
+    (("fuente", "de"), "alto"), (("con", "mucho"), "alto"), (("con", "mucha"), "alto"),
+    (("con", "muchos"), "alto"), (("con", "muchas"), "alto"), (("con", "mas"), "alto"),
+    (("mucho",), "alto"), (("mucha",), "alto"), (("muchos",), "alto"), (("muchas",), "alto"),
+    (("libre", "de"), "sin"), (("libres", "de"), "sin"), (("sin",), "sin"),
+    (("menos", "de"), "max"), (("menor", "a"), "max"), (("menor", "que"), "max"), (("menores", "a"), "max"),
+    (("por", "debajo", "de"), "max"), (("maximo",), "max"), (("hasta",), "max"),
+    (("mas", "de"), "min"), (("mayor", "a"), "min"), (("mayor", "que"), "min"), (("mayores", "a"), "min"),
+    (("por", "encima", "de"), "min"), (("minimo",), "min"), (("al", "menos"), "min")
+]
+# Las frases más largas primero: "con poca" antes que "poca", "por debajo de" antes que "por"
+MODIFICADORES.sort(key=lambda m: -len(m[0]))
+
+UNIDADES = {"mg": "mg", "miligramos": "mg", "g": "g", "gr": "g", "grs": "g", "gramos": "g",
+            "kcal": "kcal", "calorias": "kcal"}
+
+NUMEROS_ESCRITOS = {"uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7,
+                    "ocho": 8, "nueve": 9, "diez": 10, "quince": 15, "veinte": 20}
+
+# Palabras que no cambian el significado de la consulta
+RELLENO = {
+    "alimento", "alimentos", "comida", "comidas", "producto", "productos", "opcion", "opciones", "cosas",
+    "dame", "dime", "muestrame", "ensename", "lista", "listame", "busca", "buscame", "encuentra",
+    "recomienda", "recomiendame", "sugiere", "sugiereme", "quiero", "necesito", "busco", "me", "puedes",
+    "podrias", "por", "favor", "cuales", "que", "son", "sean", "esten", "tengan", "tienen", "hay",
+    "algunos", "algunas", "unos", "unas", "mejores", "de", "del", "la", "el", "los", "las", "en", "y", "e",
+    "ni", "o", "con", "a", "un", "una", "smae", "porcion", "cada", "muy", "mas", "top", "hola", "gracias",
+    "base", "datos", "segun", "resultados", "ejemplos"
+}
+
+# Palabras tras las que un número es la cantidad de resultados ("dame 5 alimentos", "3 frutas")
+SUSTANTIVOS_LIMITE = {"alimento", "alimentos", "opcion", "opciones", "producto", "productos", "comida",
+                      "comidas", "resultados", "ejemplos"} | set(GRUPOS_CONSULTA)
+
+LIMITE_DEFAULT = 10
+LIMITE_MAXIMO = 50
+
+
+def _tokens(texto: str) -> List[str]:
+    """Minúsculas sin acentos; números con decimales como un solo token ("2,5" -> "2.5")"""
+    texto = quitar_acentos(str(texto or "").lower())
+    return [t.replace(",", ".") for t in re.findall(r"\d+(?:[.,]\d+)?|[a-zñ]+", texto)]
+
+
+def _numero(token: str) -> Optional[float]:
+    if token in NUMEROS_ESCRITOS:
+        return float(NUMEROS_ESCRITOS[token])
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+def _modificador(tokens: List[str], i: int) -> Tuple[Optional[str], int]:
+    for frase, tipo in MODIFICADORES:
+        if tuple(tokens[i:i + len(frase)]) == frase:
+            return tipo, len(frase)
+    return None, 0
+
+
+def _nutriente(tokens: List[str], i: int) -> Tuple[Optional[Tuple[str, str]], int]:
+    """Nutriente en la posición i, saltando artículos ("de la fibra"); "hidratos de carbono" cuenta como uno"""
+    inicio = i
+    while i < len(tokens) and tokens[i] in ("de", "del", "el", "la", "los", "las"):
+        i += 1
+    if i < len(tokens) and tokens[i] in NUTRIENTES_CONSULTA:
+        fin = i + 1
+        if tokens[i] == "hidratos" and tokens[fin:fin + 2] == ["de", "carbono"]:
+            fin += 2
+        return NUTRIENTES_CONSULTA[tokens[i]], fin - inicio
+    return None, 0
+
+
+def _convertir(valor: float, unidad: Optional[str], unidad_nutriente: str) -> float:
+    if unidad == "g" and unidad_nutriente == "mg":
+        return valor * 1000
+    if unidad == "mg" and unidad_nutriente == "g":
+        return valor / 1000
+    return valor
+
+
+def _agregar(criterios: Dict[str, Any], prefijo: str, tipo: str, valor: float):
+    """Agrega un criterio; si ya existe uno del mismo sentido se queda el más estricto"""
+    clave = f"{prefijo}_{'max' if tipo == 'max' else 'min'}"
+    if clave in criterios:
+        valor = min(criterios[clave], valor) if tipo == "max" else max(criterios[clave], valor)
+    criterios[clave] = valor
+
+
+def _umbral(prefijo: str, tipo: str) -> Tuple[str, float]:
+    """Criterio (max/min, valor) para "bajo en", "alto en" o "sin" un nutriente"""
+    umbrales = UMBRALES[prefijo]
+    if tipo == "alto":
+        return "min", umbrales["alto"]
+    if tipo == "sin":
+        # Sin umbral de "sin" (ej. "sin fibra") se interpreta como bajo en el nutriente
+        return "max", umbrales.get("sin", umbrales["bajo"])
+    return "max", umbrales["bajo"]
+
+
+def interpretar_consulta(texto: str) -> Optional[Dict[str, Any]]:
+    """
+    Traduce una consulta en español a criterios de buscar_alimentos_filtrados con reglas y un
+    léxico fijo: "bajo/alto/rico en", "sin", "con poco/mucho", "menos/más de N mg|g|kcal",
+    grupos de alimentos ("frutas", "verduras") y el número de resultados ("dame 5 alimentos").
+
+    Returns:
+        None si no se reconoce ningún criterio. Si no, un dict con "criterios", "limite" y
+        "cubierta": True cuando toda la consulta se explica con los criterios (el resto son
+        palabras de relleno), es decir, cuando los resultados bastan para responder.
+        "sin_interpretar" lista las palabras que impidieron cubrirla.
+    """
+    tokens = _tokens(texto)
+    criterios: Dict[str, Any] = {}
+    limite = None
+    sin_interpretar = []
+    ultimo_nutriente = None
+
+    i = 0
+    while i < len(tokens):
+        tipo, largo = _modificador(tokens, i)
+        if tipo in ("max", "min"):
+            j = i + largo
+            valor = _numero(tokens[j]) if j < len(tokens) else None
+            if valor is not None:
+                j += 1
+                unidad = UNIDADES.get(tokens[j]) if j < len(tokens) else None
+                if unidad:
+                    j += 1
+                nutriente, largo_nutriente = _nutriente(tokens, j)
+                if nutriente is None and unidad == "kcal":
+                    nutriente = NUTRIENTES_CONSULTA["calorias"]
+                elif nutriente is None:
+                    # "sodio menor a 100 mg": el nutriente va antes de la comparación
+                    nutriente = ultimo_nutriente
+                if nutriente is not None:
+                    prefijo, unidad_nutriente = nutriente
+                    _agregar(criterios, prefijo, tipo, _convertir(valor, unidad, unidad_nutriente))
+                    ultimo_nutriente = None
+                    i = j + largo_nutriente
+                    continue
+
+        elif tipo is not None:
+            nutriente, largo_nutriente = _nutriente(tokens, i + largo)
+            if nutriente is not None:
+                # "bajos en sodio, grasa y azúcar" / "sin sal ni azúcar": el modificador se repite
+                j = i + largo
+                while nutriente is not None:
+                    _agregar(criterios, nutriente[0], *_umbral(nutriente[0], tipo))
+                    j += largo_nutriente
+                    k = j + 1 if j < len(tokens) and tokens[j] in ("y", "e", "ni", "o") else j
+                    if _modificador(tokens, k)[0] is not None:
+                        break
+                    nutriente, largo_nutriente = _nutriente(tokens, k)
+                    if nutriente is not None and _modificador(tokens, k + largo_nutriente)[0] in ("max", "min"):
+                        # "bajas en calorías y sodio menor a 50 mg": ese nutriente tiene su propia comparación
+                        break
+                    if nutriente is not None:
+                        j = k
+                ultimo_nutriente = None
+                i = j
+                continue
+
+        token = tokens[i]
+        siguiente = tokens[i + 1] if i + 1 < len(tokens) else ""
+        valor = _numero(token)
+
+        if token in NUTRIENTES_CONSULTA:
+            # Nutriente suelto: solo tiene sentido si le sigue una comparación ("sodio menor a 100")
+            ultimo_nutriente = NUTRIENTES_CONSULTA[token]
+            if _modificador(tokens, i + 1)[0] not in ("max", "min"):
+                sin_interpretar.append(token)
+        elif token in GRUPOS_CONSULTA:
+            criterios["grupo"] = GRUPOS_CONSULTA[token]
+        elif valor is not None and (siguiente in SUSTANTIVOS_LIMITE or i > 0 and tokens[i - 1] == "top"):
+            # "dame 5 alimentos", "top 10"
+            limite = int(valor)
+        elif token not in RELLENO:
+            sin_interpretar.append(token)
+        i += 1
+
+    if not any(clave != "grupo" for clave in criterios):
+        return None
+
+    return {
+        "criterios": criterios,
+        "limite": max(1, min(limite or LIMITE_DEFAULT, LIMITE_MAXIMO)),
+        "cubierta": not sin_interpretar,
+        "sin_interpretar": sin_interpretar
+    }
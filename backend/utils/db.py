@@ -0,0 +1,374 @@
+# utils/db.py
+# Acceso compartido de solo lectura a datainfo.db para el backend de CalyxAI
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from urllib.parse import quote
+
+from utils.texto import normalizar_texto, tokenizar
+
+DB_PATH = os.path.abspath(os.getenv("CALYX_DB_PATH", os.path.join(os.path.dirname(__file__), "..", "datainfo.db")))
+
+# 256 MB de mmap cubren de sobra la base de datos del SMAE
+DEFAULT_MMAP_SIZE = int(os.getenv("CALYX_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Sentencias preparadas que cada conexión mantiene en caché (por texto SQL)
+DEFAULT_CACHED_STATEMENTS = 256
+
+
+def _crear_dict_factory():
+    """
+    Row factory que devuelve diccionarios. La lista de columnas se calcula una vez
+    por sentencia ejecutada (cursor.description) y se reutiliza para todas sus filas.
+    """
+    ultima_descripcion = None
+    columnas = ()
+
+    def dict_factory(cursor, row):
+        nonlocal ultima_descripcion, columnas
+        descripcion = cursor.description
+        if descripcion is not ultima_descripcion:
+            ultima_descripcion = descripcion
+            columnas = tuple(columna[0] for columna in descripcion)
+        return dict(zip(columnas, row))
+
+    return dict_factory
+
+
+# Versión del índice de nombres; cambiarla fuerza la reconstrucción (ej. si cambia normalizar_texto)
+VERSION_INDICE_NOMBRES = 2
+
+
+def _estado_alimentos(conn: sqlite3.Connection) -> str:
+    """
+    Huella de lo que indexa la búsqueda (rowid, nombre y grupo de cada alimento) para detectar si el
+    índice quedó desactualizado: altas, bajas y también alimentos renombrados en su lugar.
+    Recorrer la tabla del SMAE (unos miles de filas) toma milisegundos.
+    """
+    huella = hashlib.sha256()
+    for rowid, nombre, grupo in conn.execute("SELECT rowid, alimento, `grupo de alimentos` FROM alimentos ORDER BY rowid"):
+        huella.update(f"{rowid}\x1f{nombre}\x1f{grupo}\x1e".encode("utf-8"))
+    return f"v{VERSION_INDICE_NOMBRES}:{huella.hexdigest()}"
+
+
+def construir_indice_fts(conn: sqlite3.Connection) -> bool:
+    """
+    Índice FTS5 con tokenizador trigram sobre alimentos_busqueda (contenido externo: nombre y
+    grupo ya normalizados, así la búsqueda no distingue acentos aunque SQLite no los quite).
+    Permite buscar subcadenas por índice y ordenar por relevancia con bm25().
+    Devuelve False si el SQLite instalado no soporta FTS5 o el tokenizador trigram (< 3.34).
+    """
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS alimentos_fts")
+            conn.execute("""
+                CREATE VIRTUAL TABLE alimentos_fts USING fts5(
+                    nombre_normalizado,
+                    grupo_normalizado,
+                    content='alimentos_busqueda',
+                    content_rowid='alimento_rowid',
+                    tokenize='trigram'
+                )
+            """)
+            conn.execute("INSERT INTO alimentos_fts(alimentos_fts) VALUES ('rebuild')")
+            conn.execute("INSERT OR REPLACE INTO alimentos_busqueda_meta VALUES ('fts', '1')")
+        return True
+    except sqlite3.OperationalError as e:
+        print(f"[WARNING] FTS5 trigram no disponible en SQLite {sqlite3.sqlite_version}: {e}")
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO alimentos_busqueda_meta VALUES ('fts', '0')")
+        return False
+
+
+def construir_indice_nombres(conn: sqlite3.Connection, forzar: bool = False) -> bool:
+    """
+    Crea/actualiza las tablas auxiliares de búsqueda sin tocar la tabla alimentos del SMAE:
+    - alimentos_busqueda: nombre y grupo normalizados (sin acentos) por rowid, con índice
+    - alimentos_tokens: una fila por palabra del nombre, indexada para búsquedas por prefijo
+    - alimentos_fts: índice de texto completo (ver construir_indice_fts)
+    Devuelve True si hubo que reconstruir.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS alimentos_busqueda_meta (clave TEXT PRIMARY KEY, valor TEXT)")
+    estado = _estado_alimentos(conn)
+    guardado = conn.execute("SELECT valor FROM alimentos_busqueda_meta WHERE clave = 'estado'").fetchone()
+    if not forzar and guardado and guardado[0] == estado:
+        return False
+
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS alimentos_busqueda")
+        conn.execute("DROP TABLE IF EXISTS alimentos_tokens")
+        conn.execute("""
+            CREATE TABLE alimentos_busqueda (
+                alimento_rowid INTEGER PRIMARY KEY,
+                nombre_normalizado TEXT NOT NULL,
+                grupo_normalizado TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE alimentos_tokens (
+                token TEXT NOT NULL,
+                alimento_rowid INTEGER NOT NULL,
+                PRIMARY KEY (token, alimento_rowid)
+            ) WITHOUT ROWID
+        """)
+
+        filas = conn.execute("SELECT rowid, alimento, `grupo de alimentos` FROM alimentos").fetchall()
+        conn.executemany(
+            "INSERT INTO alimentos_busqueda VALUES (?, ?, ?)",
+            [(rowid, normalizar_texto(nombre), normalizar_texto(grupo)) for rowid, nombre, grupo in filas]
+        )
+        conn.executemany(
+            "INSERT INTO alimentos_tokens VALUES (?, ?)",
+            [(token, rowid) for rowid, nombre, _ in filas for token in tokenizar(nombre)]
+        )
+        conn.execute("CREATE INDEX idx_alimentos_busqueda_nombre ON alimentos_busqueda (nombre_normalizado)")
+        conn.execute("INSERT OR REPLACE INTO alimentos_busqueda_meta VALUES ('estado', ?)", (estado,))
+
+    fts = construir_indice_fts(conn)
+    print(f"[LOG] Índice de nombres normalizados construido ({len(filas)} alimentos, FTS5: {'sí' if fts else 'no'})")
+    return True
+
+
+# Índices sobre las columnas que usan los filtros de nutrientes. Todos terminan en la energía,
+# que es la columna de orden, para que el rango filtrado ya salga ordenado (y paginable por clave)
+INDICES_NUTRIENTES = {
+    "idx_alimentos_energia": ("energia (kcal)",),
+    "idx_alimentos_grupo_energia": ("grupo de alimentos", "energia (kcal)"),
+    "idx_alimentos_sodio_energia": ("sodio (mg)", "energia (kcal)"),
+    "idx_alimentos_fibra_energia": ("fibra (g)", "energia (kcal)"),
+    "idx_alimentos_proteina_energia": ("proteina (g)", "energia (kcal)"),
+    "idx_alimentos_lipidos_energia": ("lipidos (g)", "energia (kcal)")
+}
+
+
+def construir_indices_nutrientes(conn: sqlite3.Connection) -> int:
+    """
+    Crea los índices de INDICES_NUTRIENTES que falten (solo si existen sus columnas) y actualiza
+    las estadísticas del planificador (ANALYZE). Devuelve cuántos índices se crearon.
+    """
+    columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(alimentos)")}
+    existentes = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    creados = 0
+    with conn:
+        for nombre, columnas_indice in INDICES_NUTRIENTES.items():
+            if nombre in existentes or not all(columna in columnas for columna in columnas_indice):
+                continue
+            definicion = ", ".join(f"`{columna}`" for columna in columnas_indice)
+            conn.execute(f"CREATE INDEX {nombre} ON alimentos ({definicion})")
+            creados += 1
+    if creados:
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"[LOG] Índices de nutrientes creados: {creados}")
+    return creados
+
+
+def migrar_base_datos(db_path: str = DB_PATH, forzar: bool = False) -> bool:
+    """
+    Aplica las migraciones de búsqueda sobre datainfo.db con una conexión de escritura.
+    Devuelve False si la base no existe o no se puede escribir (ej. instalada en solo lectura).
+    """
+    if not os.path.exists(db_path):
+        return False
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            construir_indice_nombres(conn, forzar=forzar)
+            construir_indices_nutrientes(conn)
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error as e:
+        print(f"[WARNING] No se pudo migrar {db_path}: {e}")
+        return False
+
+
+class ReadOnlyDatabase:
+    """
+    Pool de conexiones de solo lectura a una base SQLite, una conexión persistente por hilo.
+
+    - Se abre con URI mode=ro (o immutable=1 si el archivo nunca cambia mientras corre el backend)
+    - mmap_size para leer las páginas directamente de memoria
+    - Las sentencias preparadas se reutilizan gracias a la caché por conexión de sqlite3
+    - Las filas se devuelven como diccionarios
+    """
+
+    def __init__(self, db_path: str = DB_PATH, immutable: bool = None, mmap_size: int = DEFAULT_MMAP_SIZE,
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.db_path = os.path.abspath(db_path)
+        if immutable is None:
+            immutable = os.getenv("CALYX_DB_IMMUTABLE", "0") == "1"
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # La migración se intenta antes de abrir la primera conexión de solo lectura y se repite
+        # si el archivo cambia (mtime/tamaño), como se recargan la matriz y el índice difuso
+        self.migrada = None
+        self.fts_disponible = False
+        self._firma_migracion = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.db_path)
+
+    def _uri(self) -> str:
+        uri = f"file:{quote(self.db_path)}?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        return uri
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.exists():
+            raise FileNotFoundError(f"No se encontró la base de datos: {self.db_path}")
+
+        conn = sqlite3.connect(
+            self._uri(),
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = _crear_dict_factory()
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA query_only = 1")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Conexión persistente del hilo actual (se crea en el primer uso)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._asegurar_migracion()
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _firma_archivo(self):
+        try:
+            estado = os.stat(self.db_path)
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+
+    def _migracion_vigente(self) -> bool:
+        if self.migrada is None:
+            return False
+        # Con immutable=1 el archivo no cambia mientras corre el backend
+        return self.immutable or self._firma_archivo() == self._firma_migracion
+
+    def _asegurar_migracion(self):
+        if self._migracion_vigente():
+            return
+        with self._connections_lock:
+            if not self._migracion_vigente() and self.exists():
+                self.migrada = migrar_base_datos(self.db_path)
+                self.fts_disponible = self._leer_meta("fts") == "1"
+                # Firma tomada después de migrar: la migración también escribe en el archivo
+                self._firma_migracion = self._firma_archivo()
+
+    def _leer_meta(self, clave: str) -> Optional[str]:
+        try:
+            conn = self._connect()
+            try:
+                fila = conn.execute("SELECT valor FROM alimentos_busqueda_meta WHERE clave = ?", (clave,)).fetchone()
+            finally:
+                conn.close()
+            return fila["valor"] if fila else None
+        except sqlite3.Error:
+            return None
+
+    @property
+    def indice_nombres(self) -> bool:
+        """True si las tablas de búsqueda normalizada están disponibles"""
+        self._asegurar_migracion()
+        return bool(self.migrada)
+
+    def fetchall(self, query: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        return self.connection().execute(query, params).fetchall()
+
+    def fetchone(self, query: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        return self.connection().execute(query, params).fetchone()
+
+    def iterar_bloques(self, query: str, params: Sequence[Any] = (), tamano_bloque: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorre el resultado de una consulta en bloques de `tamano_bloque` filas (fetchmany) sin
+        cargarlo completo en memoria. Usa una conexión propia que se cierra al terminar, porque
+        un recorrido largo (ej. una exportación en streaming) puede continuar en otros hilos.
+        """
+        self._asegurar_migracion()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                filas = cursor.fetchmany(tamano_bloque)
+                if not filas:
+                    break
+                yield filas
+        finally:
+            conn.close()
+
+    def reconstruir(self):
+        """Cierra el pool y reconstruye los índices de búsqueda (tras actualizar datainfo.db)"""
+        self.close_all()
+        with self._connections_lock:
+            self.migrada = migrar_base_datos(self.db_path, forzar=True)
+            self.fts_disponible = self._leer_meta("fts") == "1"
+            self._firma_migracion = self._firma_archivo()
+        return self.migrada
+
+    def close_all(self):
+        """Cierra todas las conexiones del pool (ej. antes de reemplazar el archivo de la base)"""
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._connections_lock:
+            conexiones = len(self._connections)
+        return {
+            "db_path": self.db_path,
+            "immutable": self.immutable,
+            "indice_nombres": self.indice_nombres,
+            "fts": self.fts_disponible,
+            "mmap_size": self.mmap_size,
+            "conexiones_abiertas": conexiones
+        }
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> ReadOnlyDatabase:
+    """Instancia compartida del pool de datainfo.db"""
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = ReadOnlyDatabase()
+    return _database
+
+
+if __name__ == "__main__":
+    # Uso (desde backend/): python -m utils.db reconstruir [--db ruta/a/datainfo.db]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de datainfo.db")
+    parser.add_argument("comando", choices=["reconstruir"], help="reconstruir: regenera los índices de búsqueda, FTS5 y de nutrientes")
+    parser.add_argument("--db", default=DB_PATH, help="Ruta de la base de datos")
+    args = parser.parse_args()
+
+    if args.comando == "reconstruir":
+        ok = migrar_base_datos(os.path.abspath(args.db), forzar=True)
+        raise SystemExit(0 if ok else 1)
@@ -0,0 +1,369 @@
+# utils/diario.py
+# Diario de alimentos (qué comió el usuario) en SQLite local, con totales diarios y semanales materializados
+
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from calculos.nutricion import UNIDADES_EN_GRAMOS
+from utils.matriz_nutrientes import NUTRIENTES, get_matriz_nutrientes
+
+# El diario es de escritura: va en su propio archivo, separado de datainfo.db (solo lectura)
+DIARIO_PATH = os.path.abspath(os.getenv("CALYX_DIARIO_PATH", os.path.join(os.path.dirname(__file__), "..", "diario.db")))
+
+# Los nutrientes se guardan con el nombre de la API (energia_kcal, sodio_mg, ...)
+COLUMNAS_NUTRIENTES = list(NUTRIENTES)
+
+PERIODOS = {"dia": ("diario_totales_dia", "fecha"), "semana": ("diario_totales_semana", "semana")}
+
+
+def _crear_esquema(conn: sqlite3.Connection):
+    nutrientes = ", ".join(f"{columna} REAL NOT NULL DEFAULT 0" for columna in COLUMNAS_NUTRIENTES)
+    with conn:
+        # Cada entrada guarda los nutrientes ya calculados: editar o borrar resta exactamente lo que sumó
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS diario_entradas (
+                id INTEGER PRIMARY KEY,
+                alimento_id INTEGER NOT NULL,
+                alimento TEXT NOT NULL,
+                gramos REAL NOT NULL,
+                momento TEXT NOT NULL,
+                fecha TEXT NOT NULL,
+                semana TEXT NOT NULL,
+                {nutrientes}
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_diario_entradas_momento ON diario_entradas(momento)")
+        for tabla, clave in PERIODOS.values():
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabla} (
+                    {clave} TEXT PRIMARY KEY,
+                    entradas INTEGER NOT NULL DEFAULT 0,
+                    {nutrientes}
+                ) WITHOUT ROWID
+            """)
+
+
+def _parsear_momento(momento: Optional[str]) -> datetime:
+    """
+    Momento de la entrada (ISO 8601) en hora local y sin zona horaria; sin momento, la hora local
+    actual. Un momento con zona ("2024-05-01T23:30-05:00", "...Z") se convierte a hora local, así
+    fecha y semana son las del usuario y todos los momentos guardados se comparan en el mismo formato.
+    """
+    if momento is None:
+        return datetime.now().replace(microsecond=0)
+    try:
+        valor = datetime.fromisoformat(str(momento).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Momento inválido: '{momento}' (usa ISO 8601, ej. 2024-05-01T08:30)")
+    if valor.tzinfo is not None:
+        valor = valor.astimezone().replace(tzinfo=None)
+    return valor
+
+
+def parsear_fecha(valor: Optional[str]) -> Optional[date]:
+    """Fecha YYYY-MM-DD (o None)"""
+    if valor is None or valor == "":
+        return None
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
+        raise ValueError(f"Fecha inválida: '{valor}' (usa YYYY-MM-DD)")
+
+
+def inicio_semana(dia: date) -> date:
+    """Lunes de la semana (ISO) de `dia`; identifica la semana en los totales semanales"""
+    return dia - timedelta(days=dia.weekday())
+
+
+class DiarioAlimentos:
+    """
+    Entradas del diario (alimento, gramos, momento) y totales de nutrientes por día y por semana.
+    Los totales se mantienen al escribir: agregar, editar o borrar una entrada suma o resta sus
+    nutrientes en la fila de su día y de su semana (O(1)) dentro de la misma transacción, así que
+    leer un rango (aun de un año) lee los totales y nunca recorre las entradas.
+    """
+
+    def __init__(self, db_path: str = DIARIO_PATH, matriz=None):
+        self.db_path = os.path.abspath(db_path)
+        self.matriz = matriz or get_matriz_nutrientes()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            _crear_esquema(conn)
+            self._normalizar_momentos(conn)
+            self._conn = conn
+        return self._conn
+
+    def _normalizar_momentos(self, conn: sqlite3.Connection):
+        """
+        Pasa a hora local las entradas guardadas con zona horaria (ej. "2024-05-01T23:30:00+00:00")
+        y las mueve a los totales de su día/semana locales. Solo toca esas filas; sin ellas no hace nada.
+        """
+        filas = conn.execute(
+            "SELECT * FROM diario_entradas WHERE momento GLOB '*[+-][0-9][0-9]:[0-9][0-9]'"
+        ).fetchall()
+        if not filas:
+            return
+        with conn:
+            for fila in filas:
+                anterior = dict(fila)
+                momento = _parsear_momento(anterior["momento"])
+                entrada = {
+                    **anterior,
+                    "momento": momento.isoformat(),
+                    "fecha": momento.date().isoformat(),
+                    "semana": inicio_semana(momento.date()).isoformat()
+                }
+                self._acumular(conn, anterior, -1)
+                conn.execute(
+                    "UPDATE diario_entradas SET momento = ?, fecha = ?, semana = ? WHERE id = ?",
+                    (entrada["momento"], entrada["fecha"], entrada["semana"], entrada["id"])
+                )
+                self._acumular(conn, entrada, 1)
+        print(f"[LOG] Diario: {len(filas)} momentos con zona horaria pasados a hora local")
+
+    def _nutrientes(self, alimento_id: Any, gramos: float) -> Tuple[str, List[float]]:
+        """Nombre del alimento y sus nutrientes para `gramos` gramos"""
+        datos = self.matriz.datos()
+        posicion = datos.posicion_por_id.get(alimento_id)
+        if posicion is None:
+            raise KeyError(f"No existe el alimento con id {alimento_id}")
+        cantidad_base = datos.cantidades[posicion]
+        if datos.unidades[posicion] not in UNIDADES_EN_GRAMOS or not cantidad_base > 0:
+            raise ValueError(f"La porción base de '{datos.nombres[posicion]}' es '{datos.porciones[posicion]}', no se puede expresar en gramos")
+        factor = gramos / cantidad_base
+        # Sin dato cuenta como 0, igual que en calcular_composicion_receta
+        valores = [0.0 if valor != valor else round(float(valor) * factor, 4) for valor in datos.valores[posicion]]
+        return datos.nombres[posicion], valores
+
+    @staticmethod
+    def _validar_alimento_id(alimento_id: Any) -> int:
+        if isinstance(alimento_id, bool) or not isinstance(alimento_id, int):
+            raise ValueError("'alimento_id' debe ser un número entero")
+        return alimento_id
+
+    @staticmethod
+    def _validar_gramos(gramos: Any) -> float:
+        if isinstance(gramos, bool) or not isinstance(gramos, (int, float)) or not gramos > 0:
+            raise ValueError("'gramos' debe ser un número positivo")
+        return float(gramos)
+
+    def _acumular(self, conn: sqlite3.Connection, entrada: Dict[str, Any], signo: int):
+        """Suma (signo=1) o resta (signo=-1) una entrada en los totales de su día y su semana"""
+        valores = [signo * entrada[columna] for columna in COLUMNAS_NUTRIENTES]
+        for periodo, (tabla, clave) in PERIODOS.items():
+            llave = entrada["fecha"] if periodo == "dia" else entrada["semana"]
+            conn.execute(
+                f"INSERT INTO {tabla} ({clave}, entradas, {', '.join(COLUMNAS_NUTRIENTES)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(COLUMNAS_NUTRIENTES))}) "
+                f"ON CONFLICT({clave}) DO UPDATE SET entradas = entradas + excluded.entradas, "
+                + ", ".join(f"{columna} = {columna} + excluded.{columna}" for columna in COLUMNAS_NUTRIENTES),
+                [llave, signo, *valores]
+            )
+            # Un periodo sin entradas se borra (y no arrastra residuos de redondeo)
+            conn.execute(f"DELETE FROM {tabla} WHERE {clave} = ? AND entradas <= 0", (llave,))
+
+    def _entrada(self, conn: sqlite3.Connection, id_entrada: int) -> Dict[str, Any]:
+        fila = conn.execute("SELECT * FROM diario_entradas WHERE id = ?", (id_entrada,)).fetchone()
+        if fila is None:
+            raise KeyError(f"No existe la entrada {id_entrada}")
+        return dict(fila)
+
+    def _guardar(self, conn: sqlite3.Connection, alimento_id: Any, gramos: float, momento: datetime,
+                 id_entrada: Optional[int] = None) -> Dict[str, Any]:
+        nombre, valores = self._nutrientes(alimento_id, gramos)
+        entrada = {
+            "id": id_entrada,
+            "alimento_id": alimento_id,
+            "alimento": nombre,
+            "gramos": gramos,
+            "momento": momento.isoformat(),
+            "fecha": momento.date().isoformat(),
+            "semana": inicio_semana(momento.date()).isoformat(),
+            **dict(zip(COLUMNAS_NUTRIENTES, valores))
+        }
+        columnas = list(entrada)
+        cursor = conn.execute(
+            f"INSERT INTO diario_entradas ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+            [entrada[columna] for columna in columnas]
+        )
+        entrada["id"] = cursor.lastrowid
+        self._acumular(conn, entrada, 1)
+        return entrada
+
+    def agregar(self, alimento_id: Any, gramos: Any, momento: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Registra que se comieron `gramos` gramos del alimento `alimento_id` en `momento`.
+
+        Raises:
+            KeyError: El alimento no existe
+            ValueError: Alimento, gramos o momento inválidos, o alimento sin porción en gramos
+        """
+        alimento_id = self._validar_alimento_id(alimento_id)
+        gramos = self._validar_gramos(gramos)
+        momento = _parsear_momento(momento)
+        with self._lock:
+            conn = self.connection()
+            with conn:
+                return self._guardar(conn, alimento_id, gramos, momento)
+
+    def editar(self, id_entrada: int, alimento_id: Any = None, gramos: Any = None,
+               momento: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Cambia el alimento, los gramos o el momento de una entrada; los campos en None se conservan.
+        La entrada se resta de los totales de su día/semana anteriores y se suma a los nuevos.
+
+        Raises:
+            KeyError: La entrada o el alimento no existen
+            ValueError: Alimento, gramos o momento inválidos
+        """
+        alimento_id = self._validar_alimento_id(alimento_id) if alimento_id is not None else None
+        gramos = self._validar_gramos(gramos) if gramos is not None else None
+        momento = _parsear_momento(momento) if momento is not None else None
+        with self._lock:
+            conn = self.connection()
+            with conn:
+                anterior = self._entrada(conn, id_entrada)
+                self._acumular(conn, anterior, -1)
+                conn.execute("DELETE FROM diario_entradas WHERE id = ?", (id_entrada,))
+                return self._guardar(
+                    conn,
+                    alimento_id if alimento_id is not None else anterior["alimento_id"],
+                    gramos if gramos is not None else anterior["gramos"],
+                    momento or _parsear_momento(anterior["momento"]),
+                    id_entrada
+                )
+
+    def eliminar(self, id_entrada: int) -> Dict[str, Any]:
+        """Borra una entrada y la resta de los totales. Raises: KeyError si no existe"""
+        with self._lock:
+            conn = self.connection()
+            with conn:
+                entrada = self._entrada(conn, id_entrada)
+                self._acumular(conn, entrada, -1)
+                conn.execute("DELETE FROM diario_entradas WHERE id = ?", (id_entrada,))
+        return entrada
+
+    def entradas(self, desde: Optional[date] = None, hasta: Optional[date] = None, limite: int = 500) -> List[Dict[str, Any]]:
+        """Entradas entre dos fechas (inclusive), en orden cronológico"""
+        query = "SELECT * FROM diario_entradas WHERE 1=1"
+        params: List[Any] = []
+        # Los límites van en el mismo formato que los momentos guardados (hora local, sin zona)
+        if desde:
+            query += " AND momento >= ?"
+            params.append(datetime.combine(desde, time()).isoformat())
+        if hasta:
+            # Todo el día `hasta`
+            query += " AND momento < ?"
+            params.append(datetime.combine(hasta + timedelta(days=1), time()).isoformat())
+        query += " ORDER BY momento, id LIMIT ?"
+        params.append(limite)
+        with self._lock:
+            return [dict(fila) for fila in self.connection().execute(query, params)]
+
+    def resumen(self, periodo: str = "dia", desde: Optional[date] = None, hasta: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Totales de nutrientes por día o por semana entre dos fechas (inclusive), más el total del
+        rango. Se leen de los totales materializados: un año son 365 filas (o 53 por semana).
+        Con periodo "semana" cuentan las semanas que empiezan entre el lunes de `desde` y `hasta`.
+
+        Raises:
+            ValueError: Periodo desconocido
+        """
+        if periodo not in PERIODOS:
+            raise ValueError(f"Periodo '{periodo}' no soportado. Usa: {', '.join(PERIODOS)}")
+        tabla, clave = PERIODOS[periodo]
+        if periodo == "semana" and desde:
+            desde = inicio_semana(desde)
+
+        query = f"SELECT * FROM {tabla} WHERE 1=1"
+        params: List[Any] = []
+        if desde:
+            query += f" AND {clave} >= ?"
+            params.append(desde.isoformat())
+        if hasta:
+            query += f" AND {clave} <= ?"
+            params.append(hasta.isoformat())
+        query += f" ORDER BY {clave}"
+
+        with self._lock:
+            filas = [dict(fila) for fila in self.connection().execute(query, params)]
+
+        total = {columna: 0.0 for columna in COLUMNAS_NUTRIENTES}
+        periodos = []
+        for fila in filas:
+            for columna in COLUMNAS_NUTRIENTES:
+                total[columna] += fila[columna]
+            periodos.append({
+                clave: fila[clave],
+                "entradas": fila["entradas"],
+                "nutrientes": {columna: round(fila[columna], 2) for columna in COLUMNAS_NUTRIENTES}
+            })
+
+        return {
+            "periodo": periodo,
+            "desde": desde.isoformat() if desde else None,
+            "hasta": hasta.isoformat() if hasta else None,
+            "periodos": periodos,
+            "total": {
+                "entradas": sum(fila["entradas"] for fila in filas),
+                "nutrientes": {columna: round(valor, 2) for columna, valor in total.items()}
+            }
+        }
+
+    def reconstruir_totales(self) -> int:
+        """Recalcula los totales diarios y semanales desde las entradas (reparación); devuelve las entradas leídas"""
+        sumas = ", ".join(f"SUM({columna})" for columna in COLUMNAS_NUTRIENTES)
+        with self._lock:
+            conn = self.connection()
+            with conn:
+                for tabla, clave in PERIODOS.values():
+                    conn.execute(f"DELETE FROM {tabla}")
+                    conn.execute(
+                        f"INSERT INTO {tabla} ({clave}, entradas, {', '.join(COLUMNAS_NUTRIENTES)}) "
+                        f"SELECT {clave}, COUNT(*), {sumas} FROM diario_entradas GROUP BY {clave}"
+                    )
+                return conn.execute("SELECT COUNT(*) FROM diario_entradas").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_diario = None
+_diario_lock = threading.Lock()
+
+
+def get_diario() -> DiarioAlimentos:
+    """Instancia compartida del diario de alimentos"""
+    global _diario
+    with _diario_lock:
+        if _diario is None:
+            _diario = DiarioAlimentos()
+    return _diario
+
+
+if __name__ == "__main__":
+    # Uso (desde backend/): python -m utils.diario reconstruir [--db ruta/a/diario.db]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mantenimiento del diario de alimentos")
+    parser.add_argument("accion", choices=["reconstruir"], help="reconstruir: recalcula los totales diarios y semanales")
+    parser.add_argument("--db", default=DIARIO_PATH)
+    args = parser.parse_args()
+
+    diario = DiarioAlimentos(args.db)
+    total = diario.reconstruir_totales()
+    print(f"[LOG] Totales del diario reconstruidos a partir de {total} entradas")
+    diario.close()
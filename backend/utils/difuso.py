@@ -0,0 +1,183 @@
+# utils/difuso.py
+# Búsqueda aproximada de alimentos por nombre (errores de escritura: "platno", "yogurth", "brocoli")
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from utils.db import get_database
+from utils.texto import STOPWORDS, normalizar_texto
+
+# Similitud mínima (0-1) para ofrecer un alimento como sugerencia
+UMBRAL_SIMILITUD = 0.45
+
+# Candidatos por trigramas que pasan a la comparación por distancia de edición
+MAX_CANDIDATOS = 60
+
+# Presupuesto de tiempo por consulta; al agotarse se devuelven los candidatos ya puntuados
+TIEMPO_MAX_MS = 50.0
+
+
+def trigramas(texto: str) -> set:
+    """Trigramas de cada palabra con relleno: "pan" -> {"  p", " pa", "pan", "an "}"""
+    resultado = set()
+    for palabra in texto.split():
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+def distancia_edicion(a: str, b: str, maximo: int) -> int:
+    """Distancia de Levenshtein entre a y b; se corta en maximo + 1 si la supera"""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+
+def _similitud_palabras(consulta: List[str], nombre: List[str]) -> float:
+    """Promedio, por palabra de la consulta, de su mejor similitud de edición con una palabra del nombre"""
+    if not consulta or not nombre:
+        return 0.0
+    total = 0.0
+    for palabra in consulta:
+        mejor = 0.0
+        for candidata in nombre:
+            # Una palabra que es prefijo de otra ("arroz int") cuenta como coincidencia completa
+            if candidata.startswith(palabra):
+                mejor = 1.0
+                break
+            largo = max(len(palabra), len(candidata))
+            maximo = largo // 2
+            distancia = distancia_edicion(palabra, candidata, maximo)
+            if distancia <= maximo:
+                mejor = max(mejor, 1.0 - distancia / largo)
+        total += mejor
+    return total / len(consulta)
+
+
+class _IndiceTrigramas:
+    """Índice invertido trigrama -> posiciones de los nombres que lo contienen"""
+
+    def __init__(self, filas: List[Dict[str, Any]]):
+        self.rowids = np.array([fila["alimento_rowid"] for fila in filas], dtype=np.int64)
+        self.nombres = [fila["alimento"] for fila in filas]
+        self.normalizados = [normalizar_texto(nombre) for nombre in self.nombres]
+        self.palabras = [[p for p in nombre.split() if p not in STOPWORDS] or nombre.split()
+                         for nombre in self.normalizados]
+
+        listas: Dict[str, List[int]] = {}
+        numero_trigramas = np.zeros(len(filas), dtype=np.float32)
+        for posicion, nombre in enumerate(self.normalizados):
+            propios = trigramas(nombre)
+            numero_trigramas[posicion] = len(propios)
+            for trigrama in propios:
+                listas.setdefault(trigrama, []).append(posicion)
+
+        self.numero_trigramas = numero_trigramas
+        self.postings = {trigrama: np.array(posiciones, dtype=np.int32) for trigrama, posiciones in listas.items()}
+
+
+class BuscadorDifuso:
+    """
+    Coincidencia aproximada de nombres de alimentos en dos fases: un índice de trigramas en memoria
+    preselecciona candidatos por coeficiente de Dice y, sobre esos pocos, la distancia de edición
+    por palabra decide el orden. Se construye una vez y se reconstruye si cambia datainfo.db.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        self._lock = threading.Lock()
+        self._firma = None
+        self._indice = None
+
+    def _firma_archivo(self):
+        estado = os.stat(self.db.db_path)
+        return estado.st_mtime_ns, estado.st_size
+
+    def indice(self) -> _IndiceTrigramas:
+        """Índice vigente; se construye la primera vez y se reconstruye si datainfo.db cambió"""
+        # La migración de índices escribe en el archivo; debe ocurrir antes de tomar la firma
+        self.db.indice_nombres
+        firma = self._firma_archivo()
+        if firma != self._firma:
+            with self._lock:
+                if firma != self._firma:
+                    inicio = time.perf_counter()
+                    filas = self.db.fetchall("SELECT rowid AS alimento_rowid, alimento FROM alimentos ORDER BY rowid")
+                    self._indice = _IndiceTrigramas(filas)
+                    self._firma = firma
+                    print(f"[LOG] Índice difuso construido: {len(self._indice.nombres)} alimentos, "
+                          f"{len(self._indice.postings)} trigramas en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return self._indice
+
+    def sugerir(self, consulta: str, limite: int = 5, umbral: float = UMBRAL_SIMILITUD,
+                tiempo_max_ms: float = TIEMPO_MAX_MS) -> List[Tuple[int, str, float]]:
+        """
+        Alimentos más parecidos a la consulta como (rowid, nombre, similitud), de mayor a menor.
+        La similitud combina trigramas (Dice) y distancia de edición por palabra, entre 0 y 1.
+        """
+        normalizada = normalizar_texto(consulta)
+        if not normalizada or limite <= 0:
+            return []
+
+        # El presupuesto es para puntuar: no cuenta la construcción del índice en la primera consulta
+        indice = self.indice()
+        limite_tiempo = time.perf_counter() + tiempo_max_ms / 1000
+        propios = trigramas(normalizada)
+        listas = [indice.postings[t] for t in propios if t in indice.postings]
+        if not listas:
+            return []
+
+        # Trigramas compartidos por nombre en una sola pasada; Dice = 2·compartidos / (|a| + |b|)
+        compartidos = np.bincount(np.concatenate(listas), minlength=len(indice.nombres))
+        dice = 2.0 * compartidos / (len(propios) + indice.numero_trigramas)
+        candidatos = np.flatnonzero(compartidos)
+        if candidatos.size > MAX_CANDIDATOS:
+            candidatos = candidatos[np.argpartition(-dice[candidatos], MAX_CANDIDATOS - 1)[:MAX_CANDIDATOS]]
+        candidatos = candidatos[np.argsort(-dice[candidatos], kind="stable")]
+
+        palabras = [p for p in normalizada.split() if p not in STOPWORDS] or normalizada.split()
+        puntuados = []
+        for posicion in candidatos:
+            if time.perf_counter() > limite_tiempo:
+                break
+            similitud = 0.4 * float(dice[posicion]) + 0.6 * _similitud_palabras(palabras, indice.palabras[posicion])
+            if similitud >= umbral:
+                puntuados.append((similitud, -len(indice.normalizados[posicion]), int(posicion)))
+
+        puntuados.sort(reverse=True)
+        return [
+            (int(indice.rowids[posicion]), indice.nombres[posicion], round(similitud, 3))
+            for similitud, _, posicion in puntuados[:limite]
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        indice = self._indice
+        return {
+            "alimentos": len(indice.nombres) if indice else 0,
+            "trigramas": len(indice.postings) if indice else 0
+        }
+
+
+_buscador = None
+_buscador_lock = threading.Lock()
+
+
+def get_buscador_difuso() -> BuscadorDifuso:
+    """Instancia compartida del buscador difuso"""
+    global _buscador
+    with _buscador_lock:
+        if _buscador is None:
+            _buscador = BuscadorDifuso()
+    return _buscador
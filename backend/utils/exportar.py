@@ -0,0 +1,211 @@
+# utils/exportar.py
+# Exportación en streaming de la tabla alimentos de datainfo.db (NDJSON, CSV, Arrow IPC)
+
+import csv
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from utils.db import get_database
+from utils.texto import normalizar_texto
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+EXTENSIONES = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrow"}
+
+# Filas que se leen (y se emiten) por bloque; acota la memoria de la exportación
+DEFAULT_TAMANO_BLOQUE = 1000
+MAX_TAMANO_BLOQUE = 50000
+
+
+def columnas_alimentos(db=None) -> List[Dict[str, str]]:
+    """Columnas de la tabla alimentos con su tipo declarado (PRAGMA table_info)"""
+    db = db or get_database()
+    return [{"nombre": fila["name"], "tipo": (fila["type"] or "").upper()}
+            for fila in db.fetchall("PRAGMA table_info(alimentos)")]
+
+
+def _consulta_exportacion(columnas: Sequence[str], grupos: Sequence[str], db) -> tuple:
+    """SELECT de las columnas pedidas, filtrado por grupo (sin distinguir acentos) y en orden de rowid"""
+    seleccion = ", ".join(f"`{columna}`" for columna in columnas)
+    query = f"SELECT {seleccion} FROM alimentos"
+    params: List[Any] = []
+
+    grupos = [normalizar_texto(grupo) for grupo in grupos if normalizar_texto(grupo)]
+    if grupos:
+        if db.indice_nombres:
+            marcadores = ", ".join("?" * len(grupos))
+            query += f" WHERE rowid IN (SELECT alimento_rowid FROM alimentos_busqueda WHERE grupo_normalizado IN ({marcadores}))"
+            params.extend(grupos)
+        else:
+            # Sin índice no hay columna normalizada y SQLite no quita acentos: se normalizan en
+            # Python los grupos de la base (son pocos) y se filtra por sus nombres originales
+            buscados = set(grupos)
+            originales = [fila["grupo"] for fila in db.fetchall("SELECT DISTINCT `grupo de alimentos` AS grupo FROM alimentos")
+                          if fila["grupo"] is not None and normalizar_texto(fila["grupo"]) in buscados]
+            if not originales:
+                return query + " WHERE 0 ORDER BY rowid", params
+            marcadores = ", ".join("?" * len(originales))
+            query += f" WHERE `grupo de alimentos` IN ({marcadores})"
+            params.extend(originales)
+
+    return query + " ORDER BY rowid", params
+
+
+def _ndjson(bloques: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for filas in bloques:
+        yield "".join(json.dumps(fila, ensure_ascii=False) + "\n" for fila in filas).encode("utf-8")
+
+
+def _csv(bloques: Iterator[List[Dict[str, Any]]], columnas: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(columnas)
+    for filas in bloques:
+        escritor.writerows([fila[columna] for columna in columnas] for fila in filas)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    # Encabezado de una exportación sin filas
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _SalidaBloques(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes hasta que se vacía (para el stream de Arrow)"""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def _a_numero(valor, tipo):
+    # SQLite no obliga el tipo declarado; un texto en una columna REAL se exporta como nulo
+    if valor is None or valor == "":
+        return None
+    try:
+        return tipo(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _arrow(bloques: Iterator[List[Dict[str, Any]]], columnas: Sequence[Dict[str, str]]) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    tipos = []
+    for columna in columnas:
+        if "INT" in columna["tipo"]:
+            tipos.append((pa.int64(), int))
+        elif any(t in columna["tipo"] for t in ("REAL", "FLOA", "DOUB", "NUM")):
+            tipos.append((pa.float64(), float))
+        else:
+            tipos.append((pa.string(), None))
+    esquema = pa.schema([(columna["nombre"], tipo) for columna, (tipo, _) in zip(columnas, tipos)])
+
+    salida = _SalidaBloques()
+    with pa.ipc.new_stream(salida, esquema) as escritor:
+        for filas in bloques:
+            arrays = []
+            for columna, (tipo, conversion) in zip(columnas, tipos):
+                valores = [fila[columna["nombre"]] for fila in filas]
+                if conversion is None:
+                    valores = [None if v is None else str(v) for v in valores]
+                else:
+                    valores = [_a_numero(v, conversion) for v in valores]
+                arrays.append(pa.array(valores, type=tipo))
+            escritor.write_batch(pa.RecordBatch.from_arrays(arrays, schema=esquema))
+            yield salida.vaciar()
+    # Fin del stream (y el esquema, si no hubo filas)
+    yield salida.vaciar()
+
+
+def exportar_alimentos(formato: str = "ndjson", columnas: Optional[Sequence[str]] = None,
+                       grupos: Optional[Sequence[str]] = None,
+                       tamano_bloque: int = DEFAULT_TAMANO_BLOQUE) -> Iterator[bytes]:
+    """
+    Genera la tabla alimentos en el formato pedido, bloque a bloque, sin cargarla completa en
+    memoria: las filas se leen con un cursor en bloques de `tamano_bloque` y cada bloque se
+    serializa y se emite antes de leer el siguiente.
+
+    Args:
+        formato: "ndjson", "csv" o "arrow" (Arrow IPC stream; requiere pyarrow)
+        columnas: Columnas a exportar (todas si es None)
+        grupos: Grupos de alimentos a incluir (todos si es None); sin distinguir acentos
+        tamano_bloque: Filas por bloque
+
+    Raises:
+        ValueError: Formato, columnas o tamaño de bloque inválidos
+        RuntimeError: Formato arrow sin pyarrow instalado
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato '{formato}' no soportado. Usa: {', '.join(FORMATOS)}")
+    if not 1 <= tamano_bloque <= MAX_TAMANO_BLOQUE:
+        raise ValueError(f"tamano_bloque debe estar entre 1 y {MAX_TAMANO_BLOQUE}")
+
+    db = get_database()
+    disponibles = columnas_alimentos(db)
+    if columnas:
+        por_nombre = {columna["nombre"]: columna for columna in disponibles}
+        desconocidas = [columna for columna in columnas if columna not in por_nombre]
+        if desconocidas:
+            raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}")
+        disponibles = [por_nombre[columna] for columna in dict.fromkeys(columnas)]
+
+    if formato == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("El formato arrow requiere pyarrow (pip install pyarrow)")
+
+    nombres = [columna["nombre"] for columna in disponibles]
+    query, params = _consulta_exportacion(nombres, grupos or [], db)
+    bloques = db.iterar_bloques(query, params, tamano_bloque)
+
+    if formato == "ndjson":
+        return _ndjson(bloques)
+    if formato == "csv":
+        return _csv(bloques, nombres)
+    return _arrow(bloques, disponibles)
+
+
+if __name__ == "__main__":
+    # Uso (desde backend/): python -m utils.exportar --formato csv --salida alimentos.csv [--columnas ...] [--grupo ...]
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Exporta la tabla alimentos de datainfo.db")
+    parser.add_argument("--formato", choices=list(FORMATOS), default="ndjson")
+    parser.add_argument("--salida", help="Archivo de salida (por defecto, la salida estándar)")
+    parser.add_argument("--columnas", help="Columnas separadas por coma (por defecto, todas)")
+    parser.add_argument("--grupo", action="append", default=[], help="Grupo de alimentos a incluir (repetible)")
+    parser.add_argument("--tamano-bloque", type=int, default=DEFAULT_TAMANO_BLOQUE)
+    args = parser.parse_args()
+
+    columnas = [c.strip() for c in args.columnas.split(",") if c.strip()] if args.columnas else None
+    try:
+        generador = exportar_alimentos(args.formato, columnas, args.grupo, args.tamano_bloque)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    destino = open(args.salida, "wb") if args.salida else sys.stdout.buffer
+    try:
+        for parte in generador:
+            destino.write(parte)
+    finally:
+        if args.salida:
+            destino.close()
@@ -0,0 +1,273 @@
+# utils/matriz_nutrientes.py
+# Matriz de nutrientes en memoria (alimentos × nutrientes) para filtrados vectorizados con NumPy
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.cache import cache_consulta
+from utils.db import get_database
+from utils.nutrientes import ALIAS_CRITERIOS, NUTRIENTES, criterio_nutriente
+from utils.texto import normalizar_texto, tokenizar
+
+def _a_float(valor) -> float:
+    try:
+        return float(valor) if valor is not None and valor != "" else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def codificar_cursor(valor: Optional[float], rowid: int) -> str:
+    """Cursor de paginación por clave: valor de orden del último alimento y su rowid ("12.5:431")"""
+    return f"{'null' if valor is None else repr(valor)}:{rowid}"
+
+
+def decodificar_cursor(cursor: str) -> Tuple[Optional[float], int]:
+    try:
+        valor, rowid = cursor.rsplit(":", 1)
+        return (None if valor == "null" else float(valor)), int(rowid)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Cursor de paginación inválido: '{cursor}'")
+
+
+class _Instantanea:
+    """Arrays de una carga de la matriz; se reemplazan juntos para que una recarga no mezcle versiones"""
+
+    def __init__(self, filas: List[Dict[str, Any]]):
+        n = len(filas)
+        self.valores = np.array(
+            [[_a_float(fila[columna]) for columna in NUTRIENTES.values()] for fila in filas],
+            dtype=np.float32
+        ).reshape(n, len(NUTRIENTES))
+
+        self.rowids = np.array([fila["alimento_rowid"] for fila in filas], dtype=np.int64)
+        self.ids = np.array([fila["id"] for fila in filas], dtype=object)
+        self.nombres = np.array([fila["alimento"] for fila in filas], dtype=object)
+        self.grupos = np.array([fila["grupo de alimentos"] for fila in filas], dtype=object)
+        self.porciones = np.array([f"{fila['cantidad']} {fila['unidad']}" for fila in filas], dtype=object)
+        self.cantidades = np.array([_a_float(fila["cantidad"]) for fila in filas], dtype=np.float64)
+        self.unidades = np.array([normalizar_texto(fila["unidad"]) for fila in filas], dtype=object)
+        # Con un espacio al inicio, " token" encuentra las palabras que empiezan con token
+        self.nombres_normalizados = np.array([" " + normalizar_texto(nombre) for nombre in self.nombres], dtype=str)
+
+        # Los grupos se codifican una vez; filtrar por grupo es comparar enteros
+        grupos, codigos = np.unique(np.array([normalizar_texto(g) for g in self.grupos], dtype=str), return_inverse=True)
+        self.grupos_normalizados = grupos.tolist()
+        self.codigos_grupo = codigos.astype(np.int32)
+
+        # Posición en la matriz por id y por nombre normalizado exacto (el primero si se repite)
+        self.posicion_por_id = {id_alimento: i for i, id_alimento in enumerate(self.ids)}
+        self.posicion_por_nombre = {}
+        for i, nombre in enumerate(self.nombres_normalizados):
+            self.posicion_por_nombre.setdefault(nombre[1:], i)
+
+        # Nombres normalizados ordenados: los que empiezan con un prefijo forman un rango contiguo
+        sin_espacio = np.char.lstrip(self.nombres_normalizados)
+        self.orden_nombres = np.argsort(sin_espacio, kind="stable")
+        self.nombres_ordenados = sin_espacio[self.orden_nombres]
+        self.longitudes_ordenadas = np.char.str_len(self.nombres_ordenados)
+
+
+class MatrizNutrientes:
+    """
+    Copia columnar de la tabla alimentos: una matriz float32 (alimentos × nutrientes) más arrays
+    de id, nombre y grupo. Los filtros multi-criterio, el orden y el top-k se resuelven con
+    máscaras de NumPy en lugar de SQL dinámico. Se recarga sola si cambia datainfo.db.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        self.nutrientes = list(NUTRIENTES)
+        self._indice_nutriente = {nombre: i for i, nombre in enumerate(self.nutrientes)}
+        self._lock = threading.Lock()
+        self._firma = None
+        self._datos = None
+
+    def _firma_archivo(self):
+        estado = os.stat(self.db.db_path)
+        return estado.st_mtime_ns, estado.st_size
+
+    def _cargar(self) -> _Instantanea:
+        columnas = ", ".join(f"`{columna}`" for columna in NUTRIENTES.values())
+        filas = self.db.fetchall(
+            f"SELECT rowid AS alimento_rowid, id, alimento, `grupo de alimentos`, cantidad, unidad, {columnas} FROM alimentos ORDER BY rowid"
+        )
+        datos = _Instantanea(filas)
+        print(f"[LOG] Matriz de nutrientes cargada: {len(filas)} alimentos × {len(self.nutrientes)} nutrientes")
+        return datos
+
+    def datos(self) -> _Instantanea:
+        """Datos vigentes; se cargan la primera vez y se recargan si datainfo.db cambió (mtime/tamaño)"""
+        # La migración de índices escribe en el archivo; debe ocurrir antes de tomar la firma
+        self.db.indice_nombres
+        firma = self._firma_archivo()
+        if firma != self._firma:
+            with self._lock:
+                if firma != self._firma:
+                    self._datos = self._cargar()
+                    self._firma = firma
+        return self._datos
+
+    def _mascara(self, datos: _Instantanea, criterios: Dict[str, Any]) -> np.ndarray:
+        mascara = np.ones(datos.valores.shape[0], dtype=bool)
+
+        with np.errstate(invalid="ignore"):
+            for criterio, valor in criterios.items():
+                filtro = criterio_nutriente(criterio) if valor is not None else None
+                if filtro is None:
+                    continue
+                nutriente, operador = filtro
+                columna = datos.valores[:, self._indice_nutriente[nutriente]]
+                # Mismos operadores estrictos que la versión SQL; NaN (sin dato) nunca cumple
+                mascara &= (columna > float(valor)) if operador == ">" else (columna < float(valor))
+
+        if criterios.get("grupo"):
+            grupo = normalizar_texto(criterios["grupo"])
+            codigos = [i for i, nombre in enumerate(datos.grupos_normalizados) if grupo in nombre]
+            mascara &= np.isin(datos.codigos_grupo, codigos)
+
+        if criterios.get("nombre_like"):
+            # Cada palabra de la consulta debe ser el inicio de alguna palabra del nombre
+            for token in tokenizar(criterios["nombre_like"]) or [normalizar_texto(criterios["nombre_like"])]:
+                mascara &= np.char.find(datos.nombres_normalizados, " " + token) >= 0
+
+        return mascara
+
+    def filtrar(self, criterios: Dict[str, Any], limite: int = 10, ordenar_por: str = "energia_kcal",
+                descendente: bool = False) -> List[Dict[str, Any]]:
+        """
+        Misma interfaz y formato de salida que buscar_alimentos_filtrados, resuelto en memoria.
+        Devuelve los `limite` alimentos que cumplen todos los criterios, ordenados por `ordenar_por`.
+        """
+        return self.filtrar_pagina(criterios, limite, ordenar_por, descendente)["alimentos"]
+
+    def filtrar_pagina(self, criterios: Dict[str, Any], limite: int = 10, ordenar_por: str = "energia_kcal",
+                       descendente: bool = False, despues_de: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Una página de filtrar() con paginación por clave (keyset): `despues_de` es el cursor
+        "siguiente" de la página anterior (mismos criterios y orden) y la página empieza justo
+        después de ese alimento, sin recorrer las páginas previas.
+        Devuelve {"alimentos": [...], "siguiente": cursor o None si no hay más}.
+        """
+        nutriente = ALIAS_CRITERIOS.get(ordenar_por, ordenar_por)
+        if nutriente not in self._indice_nutriente:
+            raise ValueError(f"No se puede ordenar por '{ordenar_por}'")
+        cursor = decodificar_cursor(despues_de) if despues_de else None
+
+        datos = self.datos()
+        indices = np.flatnonzero(self._mascara(datos, criterios))
+        if indices.size == 0 or limite <= 0:
+            return {"alimentos": [], "siguiente": None}
+
+        clave = datos.valores[indices, self._indice_nutriente[nutriente]].astype(np.float64)
+        if descendente:
+            clave = -clave
+        # Los alimentos sin dato van al final en ambos sentidos
+        clave = np.where(np.isnan(clave), np.inf, clave)
+
+        if cursor is not None:
+            valor, rowid = cursor
+            valor = np.inf if valor is None else valor
+            siguientes = (clave > valor) | ((clave == valor) & (datos.rowids[indices] > rowid))
+            indices, clave = indices[siguientes], clave[siguientes]
+            if indices.size == 0:
+                return {"alimentos": [], "siguiente": None}
+
+        candidatos = np.arange(indices.size)
+        if indices.size > limite:
+            # Top-k sin ordenar todo el resultado: solo los que no superan el k-ésimo valor
+            umbral = np.partition(clave, limite - 1)[limite - 1]
+            candidatos = np.flatnonzero(clave <= umbral)
+        # A igualdad de valor se respeta el orden de la tabla (como el desempate por rowid del SQL)
+        seleccion = candidatos[np.lexsort((candidatos, clave[candidatos]))][:limite]
+
+        siguiente = None
+        if indices.size > limite:
+            ultimo = seleccion[-1]
+            valor = None if np.isinf(clave[ultimo]) else float(clave[ultimo])
+            siguiente = codificar_cursor(valor, int(datos.rowids[indices[ultimo]]))
+
+        return {
+            "alimentos": [self._fila(datos, indice) for indice in indices[seleccion]],
+            "siguiente": siguiente
+        }
+
+    def resolver_nombres(self, nombres: List[str]):
+        """
+        Resuelve una lista de nombres de alimentos a posiciones de la matriz en una sola pasada.
+        Los nombres repetidos se resuelven una vez; la coincidencia exacta (sin acentos) es un
+        acceso a diccionario, el nombre más corto que empieza con la consulta se obtiene por
+        búsqueda binaria y solo el resto pasa por el índice de búsqueda.
+        Devuelve (datos, posiciones) con -1 para los nombres sin coincidencia.
+        """
+        from utils.busqueda import buscar_alimentos_por_nombre
+
+        datos = self.datos()
+        normalizados = [normalizar_texto(nombre) for nombre in nombres]
+        resueltos = {}
+        for nombre, normalizado in zip(nombres, normalizados):
+            if normalizado in resueltos:
+                continue
+            posicion = datos.posicion_por_nombre.get(normalizado, -1)
+            if posicion == -1 and normalizado:
+                posicion = self._posicion_por_prefijo(datos, normalizado)
+            if posicion == -1 and normalizado:
+                encontrados = buscar_alimentos_por_nombre(nombre, 1)
+                if encontrados:
+                    posicion = datos.posicion_por_id.get(encontrados[0].get("id"), -1)
+            resueltos[normalizado] = posicion
+
+        posiciones = np.array([resueltos[normalizado] for normalizado in normalizados], dtype=np.int64)
+        return datos, posiciones
+
+    def _posicion_por_prefijo(self, datos: _Instantanea, prefijo: str) -> int:
+        """Posición del nombre más corto que empieza con `prefijo`, o -1 si no hay ninguno"""
+        inicio = int(np.searchsorted(datos.nombres_ordenados, prefijo, side="left"))
+        fin = int(np.searchsorted(datos.nombres_ordenados, prefijo + "\uffff", side="left"))
+        if inicio >= fin:
+            return -1
+        mas_corto = inicio + int(np.argmin(datos.longitudes_ordenadas[inicio:fin]))
+        return int(datos.orden_nombres[mas_corto])
+
+    def _fila(self, datos: _Instantanea, indice: int) -> Dict[str, Any]:
+        return {
+            "id": datos.ids[indice],
+            "alimento": datos.nombres[indice],
+            "grupo": datos.grupos[indice],
+            "cantidad_base": datos.porciones[indice],
+            "nutrientes": {
+                nutriente: (None if np.isnan(valor) else round(float(valor), 4))
+                for nutriente, valor in zip(self.nutrientes, datos.valores[indice])
+            }
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        datos = self._datos
+        return {
+            "alimentos": int(datos.valores.shape[0]) if datos else 0,
+            "nutrientes": self.nutrientes,
+            "memoria_mb": round(datos.valores.nbytes / (1024 * 1024), 2) if datos else 0,
+            "grupos": len(datos.grupos_normalizados) if datos else 0
+        }
+
+
+_matriz = None
+_matriz_lock = threading.Lock()
+
+
+def get_matriz_nutrientes() -> MatrizNutrientes:
+    """Instancia compartida de la matriz de nutrientes (se carga en el primer uso)"""
+    global _matriz
+    with _matriz_lock:
+        if _matriz is None:
+            _matriz = MatrizNutrientes()
+    return _matriz
+
+
+@cache_consulta("alimentos_filtrados")
+def filtrar_alimentos(criterios: Dict[str, Any], limite: int = 10, ordenar_por: str = "energia_kcal",
+                      descendente: bool = False, despues_de: Optional[str] = None) -> Dict[str, Any]:
+    """MatrizNutrientes.filtrar_pagina sobre la instancia compartida, con caché de resultados"""
+    return get_matriz_nutrientes().filtrar_pagina(criterios, limite, ordenar_por, descendente, despues_de)
@@ -0,0 +1,52 @@
+# utils/nutrientes.py
+# Nutrientes filtrables y criterios "<prefijo>_min" / "<prefijo>_max", compartidos por la matriz
+# en memoria y por la versión SQL (sin depender de NumPy)
+
+from typing import Optional, Tuple
+
+# Nutrientes de la matriz: nombre en la API -> columna de datainfo.db
+NUTRIENTES = {
+    "energia_kcal": "energia (kcal)",
+    "proteina_g": "proteina (g)",
+    "lipidos_g": "lipidos (g)",
+    "hidratos_carbono_g": "hidratos de carbono (g)",
+    "fibra_g": "fibra (g)",
+    "azucar_g": "azucar (g)",
+    "sodio_mg": "sodio (mg)",
+    "calcio_mg": "calcio (mg)",
+    "hierro_mg": "hierro (mg)",
+    "potasio_mg": "potasio (mg)"
+}
+
+# Prefijos aceptados en los criterios "<prefijo>_min" / "<prefijo>_max" (sodio_max, fibra_min, ...)
+ALIAS_CRITERIOS = {
+    "calorias": "energia_kcal",
+    "energia": "energia_kcal",
+    "proteina": "proteina_g",
+    "lipidos": "lipidos_g",
+    "grasas": "lipidos_g",
+    "hidratos": "hidratos_carbono_g",
+    "carbohidratos": "hidratos_carbono_g",
+    "fibra": "fibra_g",
+    "azucar": "azucar_g",
+    "sodio": "sodio_mg",
+    "calcio": "calcio_mg",
+    "hierro": "hierro_mg",
+    "potasio": "potasio_mg"
+}
+
+
+def criterio_nutriente(criterio: str) -> Optional[Tuple[str, str]]:
+    """
+    Nutriente y operador de un criterio numérico: "sodio_max" -> ("sodio_mg", "<"),
+    "fibra_g_min" -> ("fibra_g", ">"). None si el criterio no filtra un nutriente conocido.
+    """
+    if criterio.endswith("_min"):
+        operador = ">"
+    elif criterio.endswith("_max"):
+        operador = "<"
+    else:
+        return None
+    prefijo = criterio[:-4]
+    nutriente = ALIAS_CRITERIOS.get(prefijo, prefijo if prefijo in NUTRIENTES else None)
+    return (nutriente, operador) if nutriente else None
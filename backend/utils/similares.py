@@ -0,0 +1,222 @@
+# utils/similares.py
+# Alimentos similares (vecinos más cercanos) sobre los perfiles de nutrientes, con árboles k-d por grupo
+
+import heapq
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.matriz_nutrientes import ALIAS_CRITERIOS, get_matriz_nutrientes
+
+# Alimentos por hoja del árbol; en la hoja las distancias se calculan vectorizadas
+TAMANO_HOJA = 32
+
+# Con menos alimentos que esto, recorrer el conjunto completo vectorizado es más rápido que el árbol
+MIN_ALIMENTOS_ARBOL = 4096
+
+
+class _ArbolKD:
+    """
+    Árbol k-d estático sobre un conjunto de puntos (una fila por alimento). Cada nodo interno
+    parte por la mediana de la dimensión con mayor rango; las hojas guardan un rango de `orden`.
+    """
+
+    def __init__(self, puntos: np.ndarray, posiciones: np.ndarray, tamano_hoja: int = TAMANO_HOJA,
+                 min_puntos: int = MIN_ALIMENTOS_ARBOL):
+        self.puntos = puntos
+        self.posiciones = posiciones
+        self.orden = np.arange(len(puntos))
+        # Por nodo: dimensión de corte (-1 en hojas), valor de corte, hijos y rango [inicio, fin)
+        self.dimension: List[int] = []
+        self.corte: List[float] = []
+        self.izquierdo: List[int] = []
+        self.derecho: List[int] = []
+        self.inicio: List[int] = []
+        self.fin: List[int] = []
+        if len(puntos):
+            # Un conjunto pequeño queda como una sola hoja
+            self._construir(0, len(puntos), tamano_hoja if len(puntos) >= min_puntos else len(puntos))
+
+    def _nuevo_nodo(self, inicio: int, fin: int) -> int:
+        for lista, valor in ((self.dimension, -1), (self.corte, 0.0), (self.izquierdo, -1),
+                             (self.derecho, -1), (self.inicio, inicio), (self.fin, fin)):
+            lista.append(valor)
+        return len(self.dimension) - 1
+
+    def _construir(self, inicio: int, fin: int, tamano_hoja: int) -> int:
+        nodo = self._nuevo_nodo(inicio, fin)
+        if fin - inicio <= tamano_hoja:
+            return nodo
+
+        indices = self.orden[inicio:fin]
+        bloque = self.puntos[indices]
+        rangos = bloque.max(axis=0) - bloque.min(axis=0)
+        dimension = int(np.argmax(rangos))
+        if rangos[dimension] == 0:
+            # Todos los puntos iguales: no se puede partir
+            return nodo
+
+        mitad = (fin - inicio) // 2
+        particion = np.argpartition(bloque[:, dimension], mitad)
+        self.orden[inicio:fin] = indices[particion]
+
+        self.dimension[nodo] = dimension
+        self.corte[nodo] = float(self.puntos[self.orden[inicio + mitad], dimension])
+        self.izquierdo[nodo] = self._construir(inicio, inicio + mitad, tamano_hoja)
+        self.derecho[nodo] = self._construir(inicio + mitad, fin, tamano_hoja)
+        return nodo
+
+    def vecinos(self, consulta: np.ndarray, k: int, permitidos: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """
+        Los k puntos más cercanos a `consulta` (distancia euclidiana) como (distancia, posición en
+        la matriz), del más cercano al más lejano. `permitidos` es una máscara sobre las posiciones
+        de la matriz; los puntos que no cumplen se saltan sin dejar de podar ramas.
+        """
+        if not self.dimension or k <= 0:
+            return []
+
+        mejores: List[Tuple[float, int]] = []  # max-heap por distancia (negada)
+        pendientes = [(0.0, 0)]                 # min-heap por cota inferior de distancia²
+        while pendientes:
+            cota, nodo = heapq.heappop(pendientes)
+            if len(mejores) == k and cota >= -mejores[0][0]:
+                break
+
+            dimension = self.dimension[nodo]
+            if dimension == -1:
+                indices = self.orden[self.inicio[nodo]:self.fin[nodo]]
+                posiciones = self.posiciones[indices]
+                if permitidos is not None:
+                    validos = permitidos[posiciones]
+                    indices, posiciones = indices[validos], posiciones[validos]
+                if indices.size == 0:
+                    continue
+                distancias = ((self.puntos[indices] - consulta) ** 2).sum(axis=1)
+                if distancias.size > k:
+                    # Solo los k mejores de la hoja pueden entrar en el resultado
+                    seleccion = np.argpartition(distancias, k - 1)[:k]
+                    distancias, posiciones = distancias[seleccion], posiciones[seleccion]
+                for distancia, posicion in zip(distancias.tolist(), posiciones.tolist()):
+                    if len(mejores) < k:
+                        heapq.heappush(mejores, (-distancia, posicion))
+                    elif distancia < -mejores[0][0]:
+                        heapq.heapreplace(mejores, (-distancia, posicion))
+                continue
+
+            diferencia = float(consulta[dimension]) - self.corte[nodo]
+            cercano, lejano = ((self.izquierdo[nodo], self.derecho[nodo]) if diferencia < 0
+                               else (self.derecho[nodo], self.izquierdo[nodo]))
+            heapq.heappush(pendientes, (cota, cercano))
+            heapq.heappush(pendientes, (max(cota, diferencia * diferencia), lejano))
+
+        return [(float(np.sqrt(-d)), posicion) for d, posicion in sorted(mejores, reverse=True)]
+
+
+class _IndiceSimilares:
+    """Perfiles normalizados (z-score por nutriente) y un árbol k-d global y otro por grupo"""
+
+    def __init__(self, datos):
+        valores = datos.valores.astype(np.float64)
+        with np.errstate(invalid="ignore"):
+            media = np.nanmean(valores, axis=0)
+            desviacion = np.nanstd(valores, axis=0)
+        media = np.nan_to_num(media)
+        desviacion = np.where(np.nan_to_num(desviacion) > 0, desviacion, 1.0)
+        # Sin dato = valor medio del nutriente (0 tras normalizar): no acerca ni aleja
+        self.perfiles = np.nan_to_num((valores - media) / desviacion)
+
+        posiciones = np.arange(len(valores))
+        self.arbol = _ArbolKD(self.perfiles, posiciones)
+        self.arboles_grupo = {
+            codigo: _ArbolKD(self.perfiles[datos.codigos_grupo == codigo], posiciones[datos.codigos_grupo == codigo])
+            for codigo in range(len(datos.grupos_normalizados))
+        }
+
+
+class BuscadorSimilares:
+    """
+    Sustitutos de un alimento: los vecinos más cercanos en el espacio de nutrientes normalizado,
+    opcionalmente del mismo grupo y con restricciones relativas ("menos sodio", "más fibra") o
+    absolutas (mismos criterios que buscar_alimentos_filtrados). Se reconstruye con la matriz.
+    """
+
+    def __init__(self, matriz=None):
+        self.matriz = matriz or get_matriz_nutrientes()
+        self._lock = threading.Lock()
+        self._datos = None
+        self._indice = None
+
+    def indice(self):
+        datos = self.matriz.datos()
+        if datos is not self._datos:
+            with self._lock:
+                if datos is not self._datos:
+                    self._indice = _IndiceSimilares(datos)
+                    self._datos = datos
+        return self._datos, self._indice
+
+    def _nutriente(self, nombre: str) -> int:
+        nutriente = ALIAS_CRITERIOS.get(nombre, nombre)
+        if nutriente not in self.matriz.nutrientes:
+            raise ValueError(f"Nutriente desconocido: '{nombre}'")
+        return self.matriz.nutrientes.index(nutriente)
+
+    def similares(self, id_alimento: Any, k: int = 5, mismo_grupo: bool = True, menos: Sequence[str] = (),
+                  mas: Sequence[str] = (), criterios: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Los k alimentos más parecidos al alimento `id_alimento`.
+
+        Args:
+            k: Número de sustitutos
+            mismo_grupo: Buscar solo dentro del grupo de alimentos del original
+            menos: Nutrientes en los que el sustituto debe tener menos que el original (ej. ["sodio"])
+            mas: Nutrientes en los que el sustituto debe tener más que el original (ej. ["fibra"])
+            criterios: Criterios absolutos como en buscar_alimentos_filtrados (ej. {"sodio_max": 100})
+
+        Raises:
+            KeyError: El alimento no existe
+            ValueError: Nutriente desconocido
+        """
+        datos, indice = self.indice()
+        posicion = datos.posicion_por_id.get(id_alimento)
+        if posicion is None:
+            raise KeyError(f"No existe el alimento con id {id_alimento}")
+
+        permitidos = None
+        if menos or mas or criterios:
+            permitidos = self.matriz._mascara(datos, criterios or {})
+            with np.errstate(invalid="ignore"):
+                for nombre in menos:
+                    columna = self._nutriente(nombre)
+                    permitidos &= datos.valores[:, columna] < datos.valores[posicion, columna]
+                for nombre in mas:
+                    columna = self._nutriente(nombre)
+                    permitidos &= datos.valores[:, columna] > datos.valores[posicion, columna]
+        if permitidos is None:
+            permitidos = np.ones(len(datos.valores), dtype=bool)
+        permitidos[posicion] = False
+
+        arbol = indice.arboles_grupo[int(datos.codigos_grupo[posicion])] if mismo_grupo else indice.arbol
+        vecinos = arbol.vecinos(indice.perfiles[posicion], k, permitidos)
+
+        return {
+            "original": self.matriz._fila(datos, posicion),
+            "similares": [
+                {**self.matriz._fila(datos, vecino), "distancia": round(distancia, 4)}
+                for distancia, vecino in vecinos
+            ]
+        }
+
+
+_buscador = None
+_buscador_lock = threading.Lock()
+
+
+def get_buscador_similares() -> BuscadorSimilares:
+    """Instancia compartida del buscador de alimentos similares"""
+    global _buscador
+    with _buscador_lock:
+        if _buscador is None:
+            _buscador = BuscadorSimilares()
+    return _buscador
@@ -0,0 +1,34 @@
+# utils/texto.py
+# Normalización de texto para búsquedas de alimentos en CalyxAI
+
+import re
+import unicodedata
+from typing import List
+
+# Palabras que no aportan a la búsqueda por nombre ("pechuga de pollo" -> pechuga, pollo)
+STOPWORDS = {"de", "del", "la", "el", "los", "las", "con", "sin", "en", "y", "a", "al", "o", "u", "para", "por"}
+
+
+def quitar_acentos(texto: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', texto)
+                   if unicodedata.category(c) != 'Mn')
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Minúsculas, sin acentos (la ñ queda como n) y con cualquier separador reducido a un espacio:
+    "Plátano, macho (crudo)" -> "platano macho crudo"
+    """
+    if not texto:
+        return ""
+    texto = quitar_acentos(str(texto).lower())
+    return re.sub(r"[^a-z0-9]+", " ", texto).strip()
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Palabras significativas del texto normalizado, sin repetir y en orden"""
+    tokens = []
+    for token in normalizar_texto(texto).split():
+        if token not in STOPWORDS and token not in tokens:
+            tokens.append(token)
+    return tokens
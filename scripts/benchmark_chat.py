@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark de /chat y /chat/stream con el engine simulado ("stub"): mide la capa HTTP, el ruteo
+de modos y el ciclo de tools sin cargar el modelo. La latencia y los tokens/s del engine son
+configurables, así que el resultado aísla el costo propio del backend (y la espera en cola).
+Uso: python scripts/benchmark_chat.py [--peticiones 200] [--concurrencia 8] [--latencia-ms 50]
+                                      [--tokens-s 30] [--tokens 32] [--tool-call] [--db datainfo.db]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+PROMPTS = [
+    "user: hola, ¿qué puedes hacer?",
+    "user: alimentos bajos en sodio y altos en fibra",
+    "user: dame información nutricional de la manzana",
+    "user: ¿qué es el índice glucémico?"
+]
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+async def ejecutar(app, ruta, peticiones, concurrencia):
+    import httpx
+
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, errores = [], 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://calyx", timeout=300) as cliente:
+        async def una(i):
+            nonlocal errores
+            async with semaforo:
+                inicio = time.perf_counter()
+                respuesta = await cliente.post(ruta, json={"prompt": PROMPTS[i % len(PROMPTS)]})
+                if respuesta.status_code != 200 or '"error"' in respuesta.text:
+                    errores += 1
+                latencias.append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(peticiones)))
+        total = time.perf_counter() - inicio
+
+    return latencias, errores, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de /chat con el engine simulado")
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--latencia-ms", type=float, default=50)
+    parser.add_argument("--tokens-s", type=float, default=30)
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens por respuesta del engine simulado")
+    parser.add_argument("--tool-call", action="store_true", help="El engine responde primero un TOOL_CALL (ciclo de tools)")
+    parser.add_argument("--db", help="datainfo.db a usar (por defecto, la del backend)")
+    args = parser.parse_args()
+
+    # La configuración del engine se lee al crear IAEngine: fijarla antes de importar el backend
+    os.environ["CALYX_MODEL_KEY"] = "stub"
+    os.environ["CALYX_STUB_LATENCY_MS"] = str(args.latencia_ms)
+    os.environ["CALYX_STUB_TOKENS_PER_S"] = str(args.tokens_s)
+    os.environ["CALYX_STUB_RESPONSE_TOKENS"] = str(args.tokens)
+    if args.db:
+        os.environ["CALYX_DB_PATH"] = os.path.abspath(args.db)
+    sys.path.insert(0, BACKEND_DIR)
+    import main as backend
+
+    engine = backend.get_ia_engine()
+    if args.tool_call:
+        engine.engine.tool_call = {"tool": "consultar_alimento", "parameters": {"nombre": "manzana"}}
+
+    # Tiempo mínimo por respuesta que impone el engine simulado
+    minimo_ms = args.latencia_ms + (args.tokens - 1) * 1000 / args.tokens_s
+    print(f"Engine simulado: {args.latencia_ms} ms + {args.tokens} tokens a {args.tokens_s} tokens/s (≥ {minimo_ms:.0f} ms por generación)")
+    print(f"{args.peticiones} peticiones, concurrencia {args.concurrencia}")
+
+    for ruta in ("/chat", "/chat/stream"):
+        latencias, errores, total = asyncio.run(ejecutar(backend.app, ruta, args.peticiones, args.concurrencia))
+        print(f"{ruta:<13} p50 {statistics.median(latencias):8.1f} ms  p95 {percentil(latencias, 95):8.1f} ms  "
+              f"{args.peticiones / total:6.1f} req/s  errores: {errores}")
+
+    print(json.dumps(engine.get_status().get("stub"), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark de inferencia en CPU (engine transformers-cpu): tokens/s de decodificación y latencia
+de prefill por precisión (bf16, fp32, int8 dinámico) sobre un checkpoint Qwen pequeño.
+Con --aleatorio no descarga nada: usa la arquitectura de Qwen2.5-0.5B con pesos aleatorios
+(mismo costo de cómputo, texto sin sentido), útil en nodos sin acceso a Hugging Face.
+Uso: python scripts/benchmark_cpu.py [--modelo Qwen/Qwen2.5-0.5B-Instruct] [--precisiones bf16 fp32 int8]
+                                     [--tokens 64] [--repeticiones 3] [--hilos N] [--aleatorio [--capas 24]]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+PROMPT = "Dame una lista de alimentos bajos en sodio y altos en fibra, con una breve explicación de cada uno."
+
+
+def cargar(args, precision):
+    """(tokenizer o None, modelo listo para CPU) con la precisión pedida"""
+    import torch
+    from ai_engine import load_cpu_model, prepare_cpu_model
+
+    if not args.aleatorio:
+        tokenizer, modelo, _ = load_cpu_model(args.modelo, precision)
+        return tokenizer, modelo
+
+    from transformers import AutoModelForCausalLM, Qwen2Config
+    # Dimensiones de Qwen2.5-0.5B-Instruct
+    config = Qwen2Config(
+        vocab_size=151936, hidden_size=896, intermediate_size=4864, num_hidden_layers=args.capas,
+        num_attention_heads=14, num_key_value_heads=2, max_position_embeddings=32768, tie_word_embeddings=True
+    )
+    torch.manual_seed(0)
+    modelo = AutoModelForCausalLM.from_config(config, dtype=torch.bfloat16 if precision == "bf16" else torch.float32)
+    return None, prepare_cpu_model(modelo, precision)
+
+
+def medir(args, precision):
+    import torch
+
+    tokenizer, modelo = cargar(args, precision)
+    if tokenizer is not None:
+        texto = tokenizer.apply_chat_template([{"role": "user", "content": PROMPT}], tokenize=False, add_generation_prompt=True)
+        input_ids = tokenizer(texto, return_tensors="pt").input_ids
+        pad_token_id = tokenizer.eos_token_id
+    else:
+        input_ids = torch.randint(0, 151936, (1, 48))
+        pad_token_id = 0
+
+    def generar(nuevos):
+        with torch.no_grad():
+            # Greedy y longitud fija: todas las precisiones generan exactamente `nuevos` tokens
+            modelo.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=nuevos,
+                            min_new_tokens=nuevos, do_sample=False, pad_token_id=pad_token_id)
+
+    generar(2)  # calentamiento (inicialización de kernels de oneDNN)
+
+    prefill, total = [], []
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        generar(1)
+        prefill.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        generar(args.tokens)
+        total.append(time.perf_counter() - inicio)
+
+    prefill_s = min(prefill)
+    # La decodificación es el tiempo total menos el prefill del prompt
+    decode_s = max(min(total) - prefill_s, 1e-9)
+    del modelo
+    gc.collect()
+    return {
+        "prompt_tokens": input_ids.shape[-1],
+        "prefill_ms": prefill_s * 1000,
+        "tokens_s": (args.tokens - 1) / decode_s
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inferencia en CPU por precisión")
+    parser.add_argument("--modelo", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--precisiones", nargs="+", default=["bf16", "fp32", "int8"], choices=["bf16", "fp32", "int8"])
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--hilos", type=int, help="Hilos de torch (por defecto, los que elegiría el backend)")
+    parser.add_argument("--aleatorio", action="store_true", help="Pesos aleatorios con la arquitectura de Qwen2.5-0.5B")
+    parser.add_argument("--capas", type=int, default=24, help="Capas del modelo aleatorio")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    from ai_engine import configure_cpu_threads, cpu_bf16_supported
+
+    hilos = configure_cpu_threads(args.hilos)
+    modelo = f"aleatorio ({args.capas} capas, arquitectura Qwen2.5-0.5B)" if args.aleatorio else args.modelo
+    print(f"Modelo: {modelo}")
+    print(f"Hilos: {hilos}, bf16 nativo: {'sí' if cpu_bf16_supported() else 'no'}, tokens generados: {args.tokens}")
+    print(f"{'precisión':<10} {'prompt':>7} {'prefill (ms)':>13} {'tokens/s':>9}")
+
+    resultados = {}
+    for precision in args.precisiones:
+        if precision == "bf16" and not cpu_bf16_supported():
+            print(f"{precision:<10} (omitido: sin bf16 nativo, se emularía)")
+            continue
+        r = medir(args, precision)
+        resultados[precision] = r
+        print(f"{precision:<10} {r['prompt_tokens']:>7} {r['prefill_ms']:>13.1f} {r['tokens_s']:>9.2f}")
+
+    if "fp32" in resultados:
+        base = resultados["fp32"]["tokens_s"]
+        for precision, r in resultados.items():
+            if precision != "fp32":
+                print(f"{precision}: {r['tokens_s'] / base:.2f}x tokens/s respecto a fp32")
+
+
+if __name__ == '__main__':
+    main()
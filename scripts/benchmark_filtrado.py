@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark de buscar_alimentos_filtrados: SQL dinámico vs. matriz de nutrientes en memoria (NumPy).
+Genera una tabla sintética de alimentos (100k filas por defecto) en un archivo temporal.
+Uso: python scripts/benchmark_filtrado.py [--filas 100000] [--repeticiones 50]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+COLUMNAS_NUTRIENTES = [
+    "energia (kcal)", "energia (kj)", "proteina (g)", "lipidos (g)", "hidratos de carbono (g)",
+    "fibra (g)", "azucar (g)", "sodio (mg)", "calcio (mg)", "hierro (mg)", "potasio (mg)"
+]
+
+NOMBRES_BASE = ["Arroz integral cocido", "Plátano", "Pechuga de pollo", "Frijol negro cocido", "Manzana",
+                "Leche descremada", "Avena", "Salmón", "Brócoli cocido", "Tortilla de maíz"]
+GRUPOS = ["Cereales", "Frutas", "Alimentos de origen animal", "Leguminosas", "Verduras", "Leche"]
+
+CRITERIOS = [
+    {"sodio_max": 100, "fibra_min": 5},
+    {"calorias_max": 200, "proteina_min": 10},
+    {"grupo": "verduras", "sodio_max": 50},
+    {"nombre_like": "arroz", "fibra_min": 2},
+    {"lipidos_max": 5, "calcio_min": 100, "hierro_min": 2}
+]
+
+
+def crear_base_sintetica(ruta, filas):
+    """Crear una tabla alimentos con el mismo esquema de columnas que datainfo.db"""
+    random.seed(42)
+    conn = sqlite3.connect(ruta)
+    columnas = ", ".join(f"`{c}` REAL" for c in COLUMNAS_NUTRIENTES)
+    conn.execute(f"CREATE TABLE alimentos (id INTEGER PRIMARY KEY, alimento TEXT, `grupo de alimentos` TEXT, cantidad REAL, unidad TEXT, {columnas})")
+    marcadores = ", ".join("?" * (5 + len(COLUMNAS_NUTRIENTES)))
+    conn.executemany(
+        f"INSERT INTO alimentos VALUES ({marcadores})",
+        (
+            (i + 1, f"{random.choice(NOMBRES_BASE)} {i}", random.choice(GRUPOS), 100, "g",
+             *[round(random.uniform(0, 400), 2) for _ in COLUMNAS_NUTRIENTES])
+            for i in range(filas)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def medir(funcion, repeticiones):
+    """Tiempo medio en milisegundos de todos los criterios de prueba"""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for criterios in CRITERIOS:
+            funcion(criterios, 10)
+    return (time.perf_counter() - inicio) * 1000 / (repeticiones * len(CRITERIOS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de filtrado de alimentos")
+    parser.add_argument("--filas", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "datainfo.db")
+        print(f"Generando {args.filas} alimentos sintéticos...")
+        crear_base_sintetica(ruta, args.filas)
+
+        # La ruta de la base debe fijarse antes de importar los módulos del backend
+        os.environ["CALYX_DB_PATH"] = ruta
+        sys.path.insert(0, BACKEND_DIR)
+        from calculos.nutricion import buscar_alimentos_filtrados_sql
+        from utils.matriz_nutrientes import get_matriz_nutrientes
+        from utils.db import get_database
+
+        # Los índices de búsqueda se construyen en el primer uso; no cuentan como carga de la matriz
+        get_database().indice_nombres
+
+        matriz = get_matriz_nutrientes()
+        inicio = time.perf_counter()
+        matriz.datos()
+        print(f"Carga de la matriz: {(time.perf_counter() - inicio) * 1000:.1f} ms ({matriz.get_stats()['memoria_mb']} MB)")
+
+        # Ambas versiones deben devolver los mismos alimentos
+        for criterios in CRITERIOS:
+            ids_sql = [a["id"] for a in buscar_alimentos_filtrados_sql(criterios, 10)]
+            ids_matriz = [a["id"] for a in matriz.filtrar(criterios, 10)]
+            if ids_sql != ids_matriz:
+                print(f"⚠ Resultados distintos para {criterios}: {ids_sql} vs {ids_matriz}")
+
+        ms_sql = medir(buscar_alimentos_filtrados_sql, args.repeticiones)
+        ms_matriz = medir(matriz.filtrar, args.repeticiones)
+        print(f"SQL dinámico:      {ms_sql:.2f} ms/consulta")
+        print(f"Matriz en memoria: {ms_matriz:.2f} ms/consulta")
+        print(f"Aceleración:       {ms_sql / ms_matriz:.1f}x")
+
+        get_database().close_all()
+
+
+if __name__ == '__main__':
+    main()
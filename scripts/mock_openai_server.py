@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Servidor OpenAI-compatible simulado para probar el engine "openai" (remote) sin llama.cpp ni vLLM.
+Implementa GET /v1/models y POST /v1/chat/completions (normal y stream SSE) con HTTP/1.1 keep-alive;
+la respuesta es determinista (depende del último mensaje) y se emite a tokens/s configurables.
+--fallos N hace que las primeras N peticiones de generación respondan 503 (para probar reintentos).
+Uso: python scripts/mock_openai_server.py [--puerto 8080] [--latencia-ms 20] [--tokens-s 200] [--tokens 24] [--fallos 0]
+Backend: CALYX_MODEL_KEY=remote CALYX_REMOTE_URL=http://127.0.0.1:8080/v1 python backend/main.py
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELO = "mock-qwen2.5-3b-instruct"
+
+
+def crear_handler(args):
+    estado = {"fallos": args.fallos, "conexiones": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with lock:
+                estado["conexiones"] += 1
+
+        def log_message(self, formato, *valores):
+            pass
+
+        def _json(self, codigo, datos):
+            cuerpo = json.dumps(datos).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def _chunk(self, texto):
+            datos = texto.encode("utf-8")
+            self.wfile.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/v1/models":
+                self._json(200, {"object": "list", "data": [{"id": MODELO, "object": "model"}],
+                                 "conexiones": estado["conexiones"]})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path != "/v1/chat/completions":
+                self._json(404, {"error": "not found"})
+                return
+            with lock:
+                fallar = estado["fallos"] > 0
+                estado["fallos"] -= fallar
+            if fallar:
+                self._json(503, {"error": "servidor ocupado"})
+                return
+
+            ultimo = cuerpo["messages"][-1]["content"]
+            digest = hashlib.sha1(ultimo.encode("utf-8")).hexdigest()
+            tokens = [f"tok{digest[i % 40]} " for i in range(min(args.tokens, int(cuerpo.get("max_tokens", args.tokens))))]
+            time.sleep(args.latencia_ms / 1000)
+
+            if not cuerpo.get("stream"):
+                time.sleep(len(tokens) / args.tokens_s)
+                self._json(200, {"id": "mock", "object": "chat.completion", "model": MODELO, "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}
+                ]})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                evento = {"id": "mock", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}}]}
+                self._chunk(f"data: {json.dumps(evento)}\n\n")
+                time.sleep(1 / args.tokens_s)
+            self._chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor OpenAI-compatible simulado")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--latencia-ms", type=float, default=20)
+    parser.add_argument("--tokens-s", type=float, default=200)
+    parser.add_argument("--tokens", type=int, default=24)
+    parser.add_argument("--fallos", type=int, default=0)
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.puerto), crear_handler(args))
+    servidor.daemon_threads = True
+    print(f"Servidor simulado en http://127.0.0.1:{args.puerto}/v1 (modelo {MODELO})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Verifica que interpretar_consulta traduzca cada frase de CASOS a los criterios esperados y que
+solo marque como cubiertas las consultas que explica por completo.
+Uso: python scripts/verificar_consultas.py
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Frase -> (criterios, cubierta); el límite por defecto es 10 salvo que la frase pida otro
+CASOS = {
+    "alimentos bajos en sodio y altos en fibra": ({"sodio_max": 140, "fibra_min": 3}, True),
+    "bajos en sodio, grasa y azúcar": ({"sodio_max": 140, "lipidos_max": 3, "azucar_max": 5}, True),
+    "sin sal ni azúcar": ({"sodio_max": 5, "azucar_max": 0.5}, True),
+    "sodio menor a 100 mg": ({"sodio_max": 100}, True),
+    "frutas con menos de 10 g de azucar": ({"grupo": "frutas", "azucar_max": 10}, True),
+    "cereales con más de 3 g de fibra": ({"grupo": "cereales", "fibra_min": 3}, True),
+    "lacteos ricos en calcio": ({"grupo": "leche", "calcio_min": 120}, True),
+    "alimentos sin grasa y calorias por debajo de 100": ({"lipidos_max": 0.5, "calorias_max": 100}, True),
+    # El modificador compartido no se lleva un nutriente que trae su propia comparación
+    "verduras bajas en calorías y sodio menor a 50 mg": ({"grupo": "verduras", "calorias_max": 40, "sodio_max": 50}, True),
+    "bajos en grasa y azúcar menor a 5 g y altos en fibra": ({"lipidos_max": 3, "azucar_max": 5, "fibra_min": 3}, True),
+    "alimentos bajos en sodio y recetas": ({"sodio_max": 140}, False),
+}
+
+# Frase -> límite de resultados esperado
+LIMITES = {
+    "dame 5 alimentos ricos en proteina y con poca grasa": 5,
+    "top 3 frutas altas en potasio": 3,
+}
+
+
+def main():
+    sys.path.insert(0, BACKEND_DIR)
+    from utils.consulta_nutricional import interpretar_consulta
+
+    fallos = 0
+    for frase, (criterios, cubierta) in CASOS.items():
+        resultado = interpretar_consulta(frase)
+        if resultado is None or resultado["criterios"] != criterios or resultado["cubierta"] != cubierta:
+            fallos += 1
+            print(f"✗ {frase!r}: {resultado} (esperado {criterios}, cubierta={cubierta})")
+    for frase, limite in LIMITES.items():
+        resultado = interpretar_consulta(frase)
+        if resultado is None or resultado["limite"] != limite:
+            fallos += 1
+            print(f"✗ {frase!r}: {resultado} (esperado limite={limite})")
+    print(f"Consultas revisadas: {len(CASOS) + len(LIMITES)}")
+
+    if fallos:
+        print(f"{fallos} verificaciones fallidas")
+        sys.exit(1)
+    print("Todo correcto")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Verifica que cada combinación de filtros de buscar_alimentos_filtrados_sql use un índice
+(EXPLAIN QUERY PLAN) y que la paginación por clave recorra exactamente los mismos alimentos
+que una consulta sin límite, tanto en SQL como en la matriz en memoria. También comprueba que
+ambas versiones acepten los mismos criterios y devuelvan los mismos alimentos.
+Genera una tabla sintética de alimentos en un archivo temporal.
+Uso: python scripts/verificar_indices.py [--filas 20000]
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_filtrado import BACKEND_DIR, crear_base_sintetica
+
+FILTROS = {
+    "sodio_max": 100,
+    "fibra_min": 300,
+    "calorias_max": 50,
+    "proteina_min": 350,
+    "lipidos_max": 20,
+    "grupo": "verduras"
+}
+
+# Criterios que emite interpretar_consulta, incluidos los alias y nombres de nutriente de la API
+CRITERIOS_EQUIVALENTES = [
+    {"azucar_max": 50},
+    {"sodio_min": 300, "grupo": "frutas"},
+    {"lipidos_min": 200, "hidratos_max": 100},
+    {"grasas_max": 80, "carbohidratos_min": 250},
+    {"energia_kcal_max": 60, "potasio_mg_min": 100},
+]
+
+
+def combinaciones():
+    """Cada filtro solo y cada par de filtros"""
+    claves = list(FILTROS)
+    for n in (1, 2):
+        for grupo in itertools.combinations(claves, n):
+            yield {clave: FILTROS[clave] for clave in grupo}
+
+
+def usa_indice(plan):
+    """True si la consulta lee alimentos por índice y nunca con un recorrido completo de la tabla"""
+    detalles = [fila["detail"] for fila in plan]
+    recorrido_completo = any(d.strip() in ("SCAN alimentos", "SCAN TABLE alimentos") for d in detalles)
+    por_indice = any("alimentos USING" in d and "INDEX idx_alimentos_" in d for d in detalles)
+    return por_indice and not recorrido_completo, detalles
+
+
+def recorrer_paginas(paginar, criterios, tamano):
+    ids, cursor = [], None
+    while True:
+        pagina = paginar(criterios, tamano, cursor)
+        ids.extend(a["id"] for a in pagina["alimentos"])
+        cursor = pagina["siguiente"]
+        if cursor is None:
+            return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificación de índices y paginación de filtros")
+    parser.add_argument("--filas", type=int, default=20000)
+    args = parser.parse_args()
+
+    fallos = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "datainfo.db")
+        crear_base_sintetica(ruta, args.filas)
+
+        # La ruta de la base debe fijarse antes de importar los módulos del backend
+        os.environ["CALYX_DB_PATH"] = ruta
+        sys.path.insert(0, BACKEND_DIR)
+        from calculos.nutricion import construir_consulta_filtrada, paginar_alimentos_filtrados_sql
+        from utils.db import get_database
+        from utils.matriz_nutrientes import get_matriz_nutrientes
+
+        db = get_database()
+        db.indice_nombres
+
+        for criterios in combinaciones():
+            for despues_de in (None, "120.5:42"):
+                query, params = construir_consulta_filtrada(criterios, 10, despues_de, db)
+                correcto, detalles = usa_indice(db.fetchall(f"EXPLAIN QUERY PLAN {query}", params))
+                if not correcto:
+                    fallos += 1
+                    print(f"✗ {criterios} despues_de={despues_de}: {' | '.join(detalles)}")
+        print(f"Planes de consulta revisados: {2 * len(list(combinaciones()))}, sin índice: {fallos}")
+
+        matriz = get_matriz_nutrientes()
+        paginar_matriz = lambda criterios, limite, cursor: matriz.filtrar_pagina(criterios, limite, despues_de=cursor)
+        for criterios in [{"sodio_max": 100}, {"grupo": "frutas", "fibra_min": 200}]:
+            completo_sql = [a["id"] for a in paginar_alimentos_filtrados_sql(criterios, args.filas)["alimentos"]]
+            completo_matriz = [a["id"] for a in matriz.filtrar(criterios, args.filas)]
+            for nombre, paginar, completo in (("SQL", paginar_alimentos_filtrados_sql, completo_sql),
+                                              ("matriz", paginar_matriz, completo_matriz)):
+                paginado = recorrer_paginas(paginar, criterios, 37)
+                if paginado != completo:
+                    fallos += 1
+                    print(f"✗ Paginación {nombre} {criterios}: {len(paginado)} vs {len(completo)} alimentos")
+        print("Paginación por clave revisada")
+
+        for criterios in CRITERIOS_EQUIVALENTES:
+            ids_sql = [a["id"] for a in paginar_alimentos_filtrados_sql(criterios, args.filas)["alimentos"]]
+            ids_matriz = [a["id"] for a in matriz.filtrar(criterios, args.filas)]
+            if not ids_sql or ids_sql != ids_matriz:
+                fallos += 1
+                print(f"✗ SQL y matriz difieren {criterios}: {len(ids_sql)} vs {len(ids_matriz)} alimentos")
+        print(f"Criterios equivalentes revisados: {len(CRITERIOS_EQUIVALENTES)}")
+
+        db.close_all()
+
+    if fallos:
+        print(f"{fallos} verificaciones fallidas")
+        sys.exit(1)
+    print("Todo correcto")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Verifica el InferenceScheduler de ai_engine.py con un Qwen2 diminuto inicializado al azar (sin
+descargas): que las peticiones concurrentes se agrupen en batches, que cada llamador reciba su
+propia salida recortada a su max_new_tokens, que una petición cancelada en cola termine con
+GenerationCancelled y que una petición sola con prefijo fijo reutilice el PrefixKVCache.
+Uso: python scripts/verificar_scheduler.py [--peticiones 6]
+"""
+
+import argparse
+import os
+import sys
+import time
+from threading import Event
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Vocabulario de palabras "w0".."w199"; la salida decodificada se vuelve a contar por palabras
+PALABRAS = [f"w{i}" for i in range(200)]
+PREFIJO = " ".join(PALABRAS[:40])
+
+
+def crear_modelo():
+    """Tokenizer por palabras y Qwen2 de 2 capas con pesos aleatorios"""
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    vocabulario = {"<pad>": 0, "<eos>": 1, **{palabra: i + 2 for i, palabra in enumerate(PALABRAS)}}
+    base = Tokenizer(models.WordLevel(vocabulario, unk_token="<pad>"))
+    base.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=base, pad_token="<pad>", eos_token="<eos>")
+
+    torch.manual_seed(0)
+    config = Qwen2Config(
+        vocab_size=len(vocabulario), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+        pad_token_id=0, eos_token_id=1
+    )
+    model = Qwen2ForCausalLM(config).eval()
+    # Sin fin de secuencia ni tokens especiales: cada salida tiene exactamente su límite de tokens
+    model.generation_config.eos_token_id = None
+    model.generation_config.suppress_tokens = [0, 1]
+    return model, tokenizer
+
+
+def contar_tokens(texto):
+    return len(texto.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificación del scheduler de inferencia")
+    parser.add_argument("--peticiones", type=int, default=6)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    from ai_engine import GenerationCancelled, InferenceScheduler, PrefixKVCache
+
+    model, tokenizer = crear_modelo()
+    fallos = 0
+
+    # Peticiones concurrentes de distinto largo y límite: se juntan en la ventana de espera
+    scheduler = InferenceScheduler(model, tokenizer, max_batch_size=4, max_wait_ms=200)
+    peticiones = [(" ".join(PALABRAS[i:i + 3 + 2 * i]), 2 + i) for i in range(args.peticiones)]
+    futuros = [scheduler.submit(prompt, max_new_tokens=limite) for prompt, limite in peticiones]
+    for (prompt, limite), futuro in zip(peticiones, futuros):
+        texto = futuro.result(timeout=60)
+        if contar_tokens(texto) != limite:
+            fallos += 1
+            print(f"✗ Petición con límite {limite}: recibió {contar_tokens(texto)} tokens ({texto!r})")
+    stats = scheduler.get_stats()
+    if not stats["batches_run"] < stats["requests_served"]:
+        fallos += 1
+        print(f"✗ Sin batching: {stats['batches_run']} batches para {stats['requests_served']} peticiones")
+    print(f"Batching: {stats['requests_served']} peticiones en {stats['batches_run']} batches "
+          f"(máximo {stats['max_batch_seen']})")
+
+    # Con el modelo ocupado, la segunda petición espera en cola y se cancela antes de llegar a él
+    with scheduler.model_lock:
+        en_curso = scheduler.submit("w1 w2 w3", max_new_tokens=4)
+        time.sleep(scheduler.max_wait_ms / 1000 + 0.2)
+        cancelar = Event()
+        en_cola = scheduler.submit("w4 w5 w6", max_new_tokens=4, cancel_event=cancelar)
+        cancelar.set()
+    try:
+        en_cola.result(timeout=60)
+        fallos += 1
+        print("✗ La petición cancelada en cola devolvió una salida")
+    except GenerationCancelled:
+        pass
+    if contar_tokens(en_curso.result(timeout=60)) != 4:
+        fallos += 1
+        print("✗ La petición en curso no terminó con sus 4 tokens")
+    print(f"Cancelación en cola revisada (canceladas: {scheduler.get_stats()['cancelled']})")
+    scheduler.shutdown()
+
+    # Una petición sola con prefijo fijo usa el PrefixKVCache: la primera lo calcula, la segunda lo reutiliza
+    cache = PrefixKVCache(static_prefixes=(PREFIJO,))
+    scheduler = InferenceScheduler(model, tokenizer, max_wait_ms=0, prefix_cache=cache, model_key="verificacion")
+    for sufijo in ("w150 w151", "w160 w161 w162"):
+        texto = scheduler.generate(f"{PREFIJO} {sufijo}", max_new_tokens=5, prefix_text=PREFIJO)
+        if contar_tokens(texto) != 5:
+            fallos += 1
+            print(f"✗ Generación con prefijo cacheado: {contar_tokens(texto)} tokens en lugar de 5")
+    estadisticas_cache = cache.get_stats()
+    if estadisticas_cache["hits"] < 1:
+        fallos += 1
+        print(f"✗ El PrefixKVCache no registró aciertos: {estadisticas_cache}")
+    print(f"PrefixKVCache: {estadisticas_cache['hits']} aciertos, {estadisticas_cache['tokens_saved']} tokens reutilizados")
+    scheduler.shutdown()
+
+    if fallos:
+        print(f"{fallos} verificaciones fallidas")
+        sys.exit(1)
+    print("Todo correcto")
+
+
+if __name__ == '__main__':
+    main()